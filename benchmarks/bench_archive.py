@@ -0,0 +1,74 @@
+"""Benchmark of the archive builder against a plain ZIP_DEFLATED zipfile.
+
+Creates a synthetic ESMValTool-like output tree with plots (incompressible),
+NetCDF files and text/YAML files and archives it with both methods::
+
+    $ python benchmarks/bench_archive.py --size 2048
+"""
+
+import os
+import time
+import shutil
+import zipfile
+import argparse
+import tempfile
+
+from copernicus import archive
+
+
+def legacy_compress_output(output_dir, archive_file):
+    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as ziph:
+        for root, dirs, files in os.walk(output_dir):
+            for file in files:
+                path = os.path.join(root, file)
+                ziph.write(path, os.path.relpath(path, output_dir))
+    return archive_file
+
+
+def write_file(path, size, compressible):
+    chunk = (b'lat lon time pr 0.000123 ' * 42000)[:1024 ** 2] if compressible else os.urandom(1024 ** 2)
+    with open(path, 'wb') as fp:
+        for _ in range(size // len(chunk)):
+            fp.write(chunk)
+        fp.write(chunk[:size % len(chunk)])
+
+
+def make_tree(output_dir, size_mb):
+    """Split ``size_mb`` into 40% NetCDF, 40% text and 20% PNG files."""
+    kinds = [('work', '.nc', 0.4, 64, False), ('work', '.txt', 0.4, 16, True), ('plots', '.png', 0.2, 2, False)]
+    for subdir, ext, share, file_mb, compressible in kinds:
+        path = os.path.join(output_dir, subdir, 'diag', 'main')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        for i in range(max(1, int(size_mb * share / file_mb))):
+            write_file(os.path.join(path, 'file{0:04d}{1}'.format(i, ext)), file_mb * 1024 ** 2, compressible)
+
+
+def measure(name, func, output_dir, archive_file):
+    start = time.time()
+    func(output_dir, archive_file)
+    elapsed = time.time() - start
+    print("{0:<10} {1:8.2f} s {2:10.1f} MB".format(name, elapsed, os.path.getsize(archive_file) / 1024. ** 2))
+    os.remove(archive_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=2048, help='size of the output tree in MB.')
+    parser.add_argument('--workdir', default=None, help='directory for the synthetic output tree.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(dir=args.workdir)
+    try:
+        output_dir = os.path.join(workdir, 'output')
+        print("creating {0} MB output tree in {1} ...".format(args.size, output_dir))
+        make_tree(output_dir, args.size)
+        archive_file = os.path.join(workdir, 'diagnostic_result.zip')
+        measure('legacy', legacy_compress_output, output_dir, archive_file)
+        measure('builder', archive.build_archive, output_dir, archive_file)
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
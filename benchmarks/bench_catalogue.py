@@ -0,0 +1,78 @@
+"""Scan, update and lookup times of the data catalogue on a generated BADC
+DRS tree of empty files::
+
+    $ python benchmarks/bench_catalogue.py --datasets 40 --ensembles 5
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+from copernicus import catalogue
+
+EXPERIMENTS = ['historical', 'rcp45', 'rcp85']
+VARIABLES = [('day', 'day', 'pr'), ('day', 'day', 'tas'), ('Amon', 'mon', 'tas'), ('Amon', 'mon', 'pr'),
+             ('Amon', 'mon', 'psl'), ('Amon', 'mon', 'ta'), ('day', 'day', 'zg')]
+DECADES = range(1950, 2010, 10)
+
+
+def make_tree(root, datasets, ensembles):
+    files = 0
+    for i in range(datasets):
+        dataset = 'MODEL-{0}'.format(i)
+        for exp in EXPERIMENTS:
+            for ensemble in ['r{0}i1p1'.format(e + 1) for e in range(ensembles)]:
+                for mip, frequency, short_name in VARIABLES:
+                    path = os.path.join(root, 'INST', dataset, exp, frequency, 'atmos', mip, ensemble, 'latest',
+                                        short_name)
+                    os.makedirs(path)
+                    for decade in DECADES:
+                        name = '{0}_{1}_{2}_{3}_{4}_{5}0101-{6}1231.nc'.format(
+                            short_name, mip, dataset, exp, ensemble, decade, decade + 9)
+                        open(os.path.join(path, name), 'w').close()
+                        files += 1
+    return files
+
+
+def timed(func, repeat=1):
+    start = time.time()
+    for _ in range(repeat):
+        result = func()
+    return (time.time() - start) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--datasets', type=int, default=40, help='number of models.')
+    parser.add_argument('--ensembles', type=int, default=5, help='ensemble members per experiment.')
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp(prefix='bench-catalogue-')
+    try:
+        root = os.path.join(tmpdir, 'archive')
+        files = make_tree(root, args.datasets, args.ensembles)
+        path = os.path.join(tmpdir, 'catalogue.json')
+        data = catalogue.Catalogue({'CMIP5': root}, path)
+        elapsed, stats = timed(data.update)
+        print("{0} files, {1} directories, {2} variables".format(files, stats['dirs'], len(data)))
+        print("full scan          {0:10.1f} ms".format(1000 * elapsed))
+        elapsed, stats = timed(data.update)
+        print("unchanged update   {0:10.1f} ms ({1} listed)".format(1000 * elapsed, stats['listed']))
+        new_dir = os.path.join(root, 'INST', 'MODEL-0', 'historical', 'day', 'atmos', 'day', 'r1i1p1', 'latest', 'pr')
+        open(os.path.join(new_dir, 'pr_day_MODEL-0_historical_r1i1p1_20100101-20121231.nc'), 'w').close()
+        elapsed, stats = timed(data.update)
+        print("one new file       {0:10.1f} ms ({1} listed)".format(1000 * elapsed, stats['listed']))
+        elapsed, _ = timed(lambda: catalogue.Catalogue({'CMIP5': root}, path).load())
+        print("load persisted     {0:10.1f} ms".format(1000 * elapsed))
+        dataset = dict(project='CMIP5', dataset='MODEL-1', exp='historical', ensemble='r1i1p1', mip='day')
+        elapsed, _ = timed(lambda: data.missing([dataset], ['pr'], 1960, 2000), repeat=10000)
+        print("validate request   {0:10.1f} us".format(1e6 * elapsed))
+        elapsed, _ = timed(lambda: data.values('dataset', project='CMIP5', mip='day', short_name='pr'), repeat=10000)
+        print("allowed values     {0:10.1f} us".format(1e6 * elapsed))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Requests per second of GetCapabilities and DescribeProcess with and without
+the document cache, measured in-process with the werkzeug test client::
+
+    $ python benchmarks/bench_documents.py --duration 5
+"""
+
+import time
+import argparse
+
+from werkzeug.test import Client
+from pywps import Service
+
+from copernicus import wsgi
+from copernicus.service import CachingService
+from copernicus.processes import registry
+
+REQUESTS = [
+    ('GetCapabilities', '/wps?service=wps&request=getcapabilities&version=1.0.0', {}),
+    ('DescribeProcess all', '/wps?service=wps&request=describeprocess&version=1.0.0&identifier=all', {}),
+    ('GetCapabilities gzip', '/wps?service=wps&request=getcapabilities&version=1.0.0',
+     {'Accept-Encoding': 'gzip'}),
+]
+
+
+def rate(client, url, headers, duration):
+    done = 0
+    end = time.time() + duration
+    while time.time() < end:
+        assert client.get(url, headers=headers).status_code == 200
+        done += 1
+    return done / duration
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--duration', type=float, default=5, help='seconds per measurement.')
+    args = parser.parse_args()
+    config_files = wsgi.get_config_files()
+    for service_cls in [Service, CachingService]:
+        service = service_cls(processes=[], cfgfiles=config_files)
+        service.processes = registry
+        client = Client(service)
+        for name, url, headers in REQUESTS:
+            print("{0:<15} {1:<21} {2:10.1f} requests/s".format(
+                service_cls.__name__, name, rate(client, url, headers, args.duration)))
+
+
+if __name__ == '__main__':
+    main()
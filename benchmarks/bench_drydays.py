@@ -0,0 +1,85 @@
+"""Time and memory of the native consecutive dry days on a multi-decade daily field::
+
+    $ python benchmarks/bench_drydays.py --years 30 --lat 64 --lon 128
+
+The native engine streams the field in time chunks. It is compared to a loop
+over the grid points and days of the whole field in memory, like the
+``diag_cdd.py`` diagnostic of the ESMValTool recipe, timed on ``--loop-lat``
+latitudes and scaled to the grid. Both must give the same maps.
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from copernicus import drydays
+from copernicus import ncdata
+
+
+def loop_drydays(pr, plim, frlim):
+    """The maps of ESMValTool's diag_cdd.py: a loop over the grid points of the
+    whole field, pairing the wet to dry and dry to wet changes of each series."""
+    drymax = np.zeros(pr.shape[1:])
+    dryfreq = np.zeros(pr.shape[1:])
+    for i in range(pr.shape[1]):
+        for j in range(pr.shape[2]):
+            change = np.diff(np.concatenate([[0], pr[:, i, j] < plim]).astype(int))
+            starts = np.nonzero(change == 1)[0]
+            ends = np.nonzero(change == -1)[0]
+            spells = ends - starts[:len(ends)]
+            running = len(pr) - starts[-1] if len(starts) > len(ends) else 0
+            drymax[i, j] = max(spells.max(initial=0), running)
+            dryfreq[i, j] = (spells >= frlim).sum()
+    return drymax, dryfreq
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, default=30, help='years of daily data.')
+    parser.add_argument('--lat', type=int, default=64, help='latitudes.')
+    parser.add_argument('--lon', type=int, default=128, help='longitudes.')
+    parser.add_argument('--loop-lat', type=int, default=8, help='latitudes timed with the loop.')
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    tmpdir = tempfile.mkdtemp(prefix='bench-drydays-')
+    try:
+        path = os.path.join(tmpdir, 'pr.nc')
+        with ncdata.FieldWriter(path, 'pr', np.linspace(-88, 88, args.lat), np.linspace(0, 357, args.lon),
+                                'days since 1980-01-01', 'noleap', {'units': 'kg m-2 s-1'}) as writer:
+            for year in range(args.years):
+                pr = rng.gamma(0.3, 3.0, size=(365, args.lat, args.lon)) / drydays.SECONDS_PER_DAY
+                writer.write(365 * year + np.arange(365) + 0.5, pr)
+        steps = 365 * args.years
+        print("{0} days of {1}x{2} points, {3:.0f} MB as float32".format(
+            steps, args.lat, args.lon, steps * args.lat * args.lon * 4 / 1024.0 ** 2))
+        field = ncdata.Field([path], 'pr', 1980, 1980 + args.years)
+
+        tracemalloc.start()
+        start = time.time()
+        drymax, dryfreq = drydays.compute(field, 1, 5)
+        native = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1024.0 ** 2
+        tracemalloc.reset_peak()
+        print("native        {0:8.2f} s {1:8.0f} MB".format(native, peak))
+
+        start = time.time()
+        _, pr = field.read()
+        read = time.time() - start
+        peak = tracemalloc.get_traced_memory()[1] / 1024.0 ** 2
+        tracemalloc.stop()
+        start = time.time()
+        expected = loop_drydays(pr[:, :args.loop_lat], 1.0 / drydays.SECONDS_PER_DAY, 5)
+        loop = read + (time.time() - start) * args.lat / args.loop_lat
+        print("loop          {0:8.2f} s {1:8.0f} MB (scaled from {2} latitudes)".format(loop, peak, args.loop_lat))
+        print("speedup       {0:8.1f}".format(loop / native))
+        assert (expected[0] == drymax[:args.loop_lat]).all() and (expected[1] == dryfreq[:args.loop_lat]).all()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
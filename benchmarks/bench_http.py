@@ -0,0 +1,271 @@
+"""HTTP load test of the WPS service with realistic request mixes.
+
+Concurrent client processes send GetCapabilities, DescribeProcess, sync and
+async Execute requests of the ``sleep`` process and poll the status of the
+async jobs over keep-alive connections. Throughput and p50/p95/p99 latency
+are reported per operation.
+
+The service runs in-process (werkzeug server in a thread, ``--server
+inprocess``), is started with ``copernicus start`` (``--server werkzeug`` or
+``--server gunicorn``) or an already running service is used (``--url``)::
+
+    $ python benchmarks/bench_http.py --mix portal --clients 8 --duration 20
+    $ python benchmarks/bench_http.py --mix mixed --server gunicorn --workers 4
+    $ python benchmarks/bench_http.py --url http://localhost:5000/wps
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+import multiprocessing
+from http.client import HTTPConnection
+from urllib.parse import urlparse
+
+WPS = '?service=WPS&version=1.0.0&request='
+OPERATIONS = {
+    'capabilities': WPS + 'GetCapabilities',
+    'describe': WPS + 'DescribeProcess&identifier=sleep',
+    'describe_all': WPS + 'DescribeProcess&identifier=all',
+    'execute_sync': WPS + 'Execute&identifier=sleep&DataInputs=delay={delay}',
+    'execute_async': WPS + 'Execute&identifier=sleep&storeExecuteResponse=true&status=true'
+                           '&DataInputs=delay={delay}',
+}
+# weights of the operations
+MIXES = {
+    'portal': {'capabilities': 5, 'describe': 3, 'describe_all': 2},
+    'execute': {'execute_sync': 1, 'execute_async': 1},
+    'mixed': {'capabilities': 4, 'describe': 3, 'describe_all': 1, 'execute_sync': 1, 'execute_async': 1},
+}
+STATUS_LOCATION = re.compile(r'statusLocation="([^"]+)"')
+FINISHED = re.compile(r'Process(Succeeded|Failed)')
+
+CONFIG = """
+[server]
+url = http://localhost:{port}/wps
+outputurl = http://localhost:{port}/outputs
+outputpath = {tmpdir}/outputs
+workdir = {tmpdir}/workdir
+maxprocesses = 10000
+parallelprocesses = {parallel}
+
+[logging]
+level = WARN
+file = {tmpdir}/pywps.log
+database = sqlite:///{tmpdir}/pywps-logs.sqlite
+
+[copernicus]
+state_dir = {tmpdir}/state
+"""
+
+
+class Connection(object):
+    """Keep-alive connection, reconnected after errors."""
+
+    def __init__(self, url):
+        self.host = urlparse(url).hostname
+        self.port = urlparse(url).port or 80
+        self.conn = None
+
+    def get(self, path):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = HTTPConnection(self.host, self.port, timeout=120)
+            try:
+                self.conn.request('GET', path)
+                resp = self.conn.getresponse()
+                return resp.status, resp.read().decode('utf-8', 'replace')
+            except (IOError, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+def client(args):
+    """Send requests of the mix until the end time, return the timings."""
+    url, mix, end, drain, delay, poll_interval, identical, seed = args
+    rnd = random.Random(seed)
+    wps_path = urlparse(url).path or '/wps'
+    conn = Connection(url)
+    operations = sorted(mix)
+    weights = [mix[name] for name in operations]
+    timings = dict((name, []) for name in operations + ['status', 'job'])
+    errors = dict((name, 0) for name in operations + ['status', 'job'])
+    jobs = []
+    while time.time() < end:
+        poll(conn, jobs, poll_interval, timings, errors)
+        name = rnd.choices(operations, weights)[0]
+        # distinct delays, unless identical requests should be coalesced
+        request_delay = delay if identical else delay * (1 + rnd.random())
+        start = time.time()
+        status, body = conn.get(wps_path + OPERATIONS[name].format(delay=request_delay))
+        elapsed = time.time() - start
+        if status != 200 or 'ExceptionReport' in body:
+            # like ServerBusy when parallelprocesses sync jobs are running
+            errors[name] += 1
+            continue
+        timings[name].append(elapsed)
+        if name == 'execute_async':
+            match = STATUS_LOCATION.search(body)
+            if match:
+                jobs.append([start, match.group(1), time.time() + poll_interval])
+    # let the jobs finish without new requests, these polls are not timed
+    drain_end = time.time() + drain
+    while jobs and time.time() < drain_end:
+        time.sleep(poll_interval / 10)
+        poll(conn, jobs, poll_interval, dict(timings, status=[]), errors)
+    errors['job'] += len(jobs)
+    return timings, errors
+
+
+def poll(conn, jobs, poll_interval, timings, errors):
+    """Poll the status of the async jobs which are due."""
+    now = time.time()
+    for job in [job for job in jobs if job[2] <= now]:
+        start = time.time()
+        status, body = conn.get(urlparse(job[1]).path)
+        timings['status'].append(time.time() - start)
+        finished = FINISHED.search(body)
+        if finished:
+            timings['job'].append(time.time() - job[0])
+            if finished.group(1) == 'Failed':
+                errors['job'] += 1
+            jobs.remove(job)
+        else:
+            job[2] = time.time() + poll_interval
+
+
+def percentile(values, q):
+    if len(values) < 2:
+        return values[0] if values else 0
+    return statistics.quantiles(values, n=100, method='inclusive')[q - 1]
+
+
+def report(results, elapsed):
+    timings = {}
+    errors = {}
+    for client_timings, client_errors in results:
+        for name, values in client_timings.items():
+            timings.setdefault(name, []).extend(values)
+        for name, count in client_errors.items():
+            errors[name] = errors.get(name, 0) + count
+    print("{0:<14} {1:>8} {2:>9} {3:>9} {4:>9} {5:>9} {6:>7}".format(
+        'operation', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors'))
+    total = 0
+    for name in sorted(timings):
+        values = timings[name]
+        if not values:
+            continue
+        if name != 'job':
+            total += len(values) + errors.get(name, 0)
+        print("{0:<14} {1:>8} {2:>9.1f} {3:>9.1f} {4:>9.1f} {5:>9.1f} {6:>7}".format(
+            name, len(values), len(values) / elapsed,
+            1000 * percentile(values, 50), 1000 * percentile(values, 95), 1000 * percentile(values, 99),
+            errors.get(name, 0)))
+    print("total {0} requests in {1:.1f} s, {2:.1f} req/s, {3} errors".format(
+        total, elapsed, total / elapsed, sum(errors.values())))
+
+
+def wait_for(url, timeout=60):
+    conn = Connection(url)
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            if conn.get((urlparse(url).path or '/wps') + OPERATIONS['capabilities'])[0] == 200:
+                return
+        except (IOError, OSError):
+            pass
+        time.sleep(0.2)
+    raise Exception('service did not start on {0}'.format(url))
+
+
+def start_inprocess(config_file, port):
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    from copernicus import wsgi
+    from copernicus.cli import static_files_app
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    app = static_files_app(wsgi.create_app([config_file]))
+    server = make_server('127.0.0.1', port, app, threaded=True, request_handler=QuietRequestHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server.shutdown
+
+
+def start_service(server, config_file, port, workers, tmpdir):
+    cmd = ['copernicus', 'start', '--server', server, '--port', str(port), '--workers', str(workers),
+           '--log-level', 'WARN', '--log-file', os.path.join(tmpdir, 'pywps.log'),
+           '--database', 'sqlite:///{0}/pywps-logs.sqlite'.format(tmpdir), '-c', config_file]
+    process = subprocess.Popen(cmd, cwd=tmpdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def stop():
+        process.terminate()
+        process.wait()
+    return stop
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed', help='request mix.')
+    parser.add_argument('--clients', type=int, default=8, help='number of concurrent clients.')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load.')
+    parser.add_argument('--drain', type=float, default=60, help='seconds to wait for running jobs after the load.')
+    parser.add_argument('--delay', type=float, default=0.01, help='delay of the sleep process.')
+    parser.add_argument('--identical', action='store_true', help='send identical Execute requests.')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='seconds between status polls of a job.')
+    parser.add_argument('--parallel', type=int, default=4, help='parallelprocesses of the service.')
+    parser.add_argument('--server', choices=['inprocess', 'werkzeug', 'gunicorn'], default='inprocess',
+                        help='how to run the service.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of gunicorn workers.')
+    parser.add_argument('--port', type=int, default=5088, help='port of the started service.')
+    parser.add_argument('--url', help='url of a running service, nothing is started.')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the clients.')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix='bench-http-')
+    stop = None
+    try:
+        url = args.url
+        if not url:
+            config_file = os.path.join(tmpdir, 'bench.cfg')
+            with open(config_file, 'w') as fp:
+                fp.write(CONFIG.format(port=args.port, tmpdir=tmpdir, parallel=args.parallel))
+            for name in ['outputs', 'workdir', 'state']:
+                os.mkdir(os.path.join(tmpdir, name))
+            if args.server == 'inprocess':
+                stop = start_inprocess(config_file, args.port)
+            else:
+                stop = start_service(args.server, config_file, args.port, args.workers, tmpdir)
+            url = 'http://127.0.0.1:{0}/wps'.format(args.port)
+        wait_for(url)
+        print("{0} mix, {1} clients, {2} server".format(args.mix, args.clients, 'external' if args.url else args.server))
+        sys.stdout.flush()
+        # fork the clients before the load starts
+        pool = multiprocessing.get_context('fork').Pool(args.clients)
+        start = time.time()
+        end = start + args.duration
+        results = pool.map(client, [(url, MIXES[args.mix], end, args.drain, args.delay, args.poll_interval,
+                                     args.identical, args.seed + i)
+                                    for i in range(args.clients)])
+        pool.close()
+        report(results, args.duration)
+    finally:
+        if stop:
+            stop()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
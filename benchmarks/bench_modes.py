@@ -0,0 +1,97 @@
+"""Time and memory of the modes of variability engine on a multi-decade daily field::
+
+    $ python benchmarks/bench_modes.py --years 30 --lat 30 --lon 144 --workers 4
+
+The field is generated with four planted regimes. The randomized SVD is
+compared to the SVD of the whole field in memory (``--full-svd``), k-means
+restarts run in one and in ``--workers`` processes. Memory is the peak of
+the arrays allocated in each step, the memory map of the anomalies is
+paged by the kernel.
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+from copernicus import modes
+from copernicus import ncdata
+
+
+def make_field(path, years, nlat, nlon, k=4):
+    rng = np.random.default_rng(0)
+    lat = np.linspace(20, 85, nlat)
+    lon = np.linspace(-80, 40, nlon)
+    patterns = 500 * rng.standard_normal((k, nlat, nlon))
+    steps = 365 * years
+    with ncdata.FieldWriter(path, 'psl', lat, lon, 'days since 1980-01-01', 'noleap', {'units': 'Pa'}) as writer:
+        label = 0
+        for start in range(0, steps, 365):
+            labels = []
+            for _ in range(365):
+                label = label if rng.random() < 0.8 else rng.integers(k)
+                labels.append(label)
+            day = np.arange(start, start + 365)
+            season = 1000 * np.sin(2 * np.pi * day / 365)[:, None, None]
+            writer.write(day + 0.5, 101300 + season + patterns[labels] + 200 * rng.standard_normal((365, nlat, nlon)))
+    return steps * nlat * nlon
+
+
+def peak_mb():
+    """Peak of the memory allocated by numpy since the last call, without the memory map."""
+    peak = tracemalloc.get_traced_memory()[1] / 1024.0 ** 2
+    tracemalloc.reset_peak()
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--years', type=int, default=30, help='years of daily data.')
+    parser.add_argument('--lat', type=int, default=30, help='latitudes.')
+    parser.add_argument('--lon', type=int, default=144, help='longitudes.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes of the k-means restarts.')
+    parser.add_argument('--full-svd', action='store_true', help='also time the SVD of the field in memory.')
+    args = parser.parse_args()
+    tmpdir = tempfile.mkdtemp(prefix='bench-modes-')
+    try:
+        path = os.path.join(tmpdir, 'psl.nc')
+        values = make_field(path, args.years, args.lat, args.lon)
+        print("{0} days of {1}x{2} points, {3:.0f} MB as float64".format(
+            365 * args.years, args.lat, args.lon, values * 8 / 1024.0 ** 2))
+        tracemalloc.start()
+        field = ncdata.Field([path], 'psl', 1980, 1980 + args.years)
+        rng = np.random.default_rng(1)
+
+        start = time.time()
+        anomalies = modes.compute_anomalies(field, os.path.join(tmpdir, 'anomalies.dat'), False, detrend=2)
+        print("anomalies            {0:8.2f} s {1:8.0f} MB".format(time.time() - start, peak_mb()))
+        start = time.time()
+        _, s, _ = modes.randomized_svd(anomalies, modes.MAX_EOFS, rng)
+        print("randomized svd       {0:8.2f} s {1:8.0f} MB".format(time.time() - start, peak_mb()))
+        start = time.time()
+        pcs = modes.principal_components(anomalies, rng)
+        print("principal components {0:8.2f} s {1:8.0f} MB ({2} EOFs)".format(
+            time.time() - start, peak_mb(), pcs.shape[1]))
+        for name, data in [('pcs', pcs), ('anomalies', anomalies)]:
+            for workers in sorted(set([1, args.workers])):
+                start = time.time()
+                modes.cluster(data, 4, seed=1, workers=workers)
+                print("k-means {0:<12} {1:8.2f} s {2:8.0f} MB ({3} restarts, {4} workers)".format(
+                    name, time.time() - start, peak_mb(), modes.RESTARTS, workers))
+        if args.full_svd:
+            start = time.time()
+            full = np.concatenate([block for _, block in anomalies.chunks()])
+            expected = np.linalg.svd(full, compute_uv=False)[:len(s)]
+            print("full svd             {0:8.2f} s {1:8.0f} MB".format(time.time() - start, peak_mb()))
+            print("relative error of the 3 leading singular values {0:.1e}".format(
+                np.abs(s[:3] / expected[:3] - 1).max()))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Time of the RainFARM engine for target grids of 64x64 up to 512x512 cells::
+
+    $ python benchmarks/bench_rainfarm.py --days 365 --members 4 --workers 4
+
+For each target grid the coarse 16x16 field is downscaled with a loop over
+time steps and coarse cells (one FFT per step, like a straightforward port
+of the algorithm), with the batched engine, and to a NetCDF ensemble.
+"""
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+
+from copernicus import ncdata
+from copernicus import rainfarm
+
+COARSE = 16
+TARGETS = [64, 128, 256, 512]
+
+
+def loop_downscale(coarse, nf, amplitude, rng):
+    steps, size = coarse.shape[0], coarse.shape[1]
+    fine = np.empty((steps, size * nf, size * nf))
+    for t in range(steps):
+        noise = rng.standard_normal(amplitude.shape) + 1j * rng.standard_normal(amplitude.shape)
+        field = np.fft.irfft2(noise * amplitude, s=(size * nf, size * nf))
+        field = np.exp((field - field.mean()) / field.std())
+        for i in range(size):
+            for j in range(size):
+                cell = field[i * nf:(i + 1) * nf, j * nf:(j + 1) * nf]
+                fine[t, i * nf:(i + 1) * nf, j * nf:(j + 1) * nf] = cell * coarse[t, i, j] / cell.mean()
+    return fine
+
+
+def timed(func):
+    start = time.time()
+    func()
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=365, help='time steps of the coarse field.')
+    parser.add_argument('--members', type=int, default=4, help='ensemble members.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='processes of the ensemble.')
+    parser.add_argument('--loop-days', type=int, default=30, help='time steps timed with the loop.')
+    args = parser.parse_args()
+    rng = np.random.default_rng(0)
+    tmpdir = tempfile.mkdtemp(prefix='bench-rainfarm-')
+    try:
+        path = os.path.join(tmpdir, 'pr.nc')
+        coarse = rng.gamma(0.5, 1e-4, size=(args.days, COARSE, COARSE)).astype('f4')
+        with ncdata.FieldWriter(path, 'pr', np.arange(COARSE) * 1.5 + 40, np.arange(COARSE) * 1.5,
+                                'days since 2000-01-01', 'standard', {'units': 'kg m-2 s-1'}) as writer:
+            writer.write(np.arange(args.days) + 0.5, coarse)
+        field = ncdata.Field([path], 'pr', 2000, 2100, fill_value=0)
+        print("{0} days of {1}x{1} cells, {2} members, {3} workers".format(
+            args.days, COARSE, args.members, args.workers))
+        print("{0:>8} {1:>14} {2:>14} {3:>9} {4:>16} {5:>16}".format(
+            'target', 'loop ms/step', 'batch ms/step', 'speedup', '1 worker s', '{0} workers s'.format(args.workers)))
+        for target in TARGETS:
+            nf = target // COARSE
+            amplitude = rainfarm.spectral_filter(target, 1.7)
+            sample = coarse[:args.loop_days]
+            loop = timed(lambda: loop_downscale(sample, nf, amplitude, rng)) / len(sample)
+            steps = rainfarm.chunk_steps(target)
+
+            def batched():
+                for start in range(0, len(sample), steps):
+                    rainfarm.downscale(sample[start:start + steps], nf, amplitude, rng)
+            batch = timed(batched) / len(sample)
+            serial = timed(lambda: rainfarm.ensemble(
+                field, tmpdir, args.members, nf, slope=1.7, workers=1, seed=1))
+            parallel = timed(lambda: rainfarm.ensemble(
+                field, tmpdir, args.members, nf, slope=1.7, workers=args.workers, seed=1))
+            print("{0:>8} {1:14.2f} {2:14.2f} {3:9.1f} {4:16.2f} {5:16.2f}".format(
+                '{0}x{0}'.format(target), 1000 * loop, 1000 * batch, loop / batch, serial, parallel))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Request throughput of ``copernicus start`` with the werkzeug and gunicorn servers.
+
+Starts the service in a temporary directory and lets concurrent clients send
+GetCapabilities and DescribeProcess requests over keep-alive connections::
+
+    $ python benchmarks/bench_server.py --clients 16 --duration 10
+"""
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+from http.client import HTTPConnection
+
+REQUESTS = [
+    '/wps?service=wps&request=getcapabilities&version=1.0.0',
+    '/wps?service=wps&request=describeprocess&version=1.0.0&identifier=sleep',
+]
+
+
+def client(args):
+    port, duration = args
+    done = 0
+    conn = HTTPConnection('127.0.0.1', port, timeout=60)
+    end = time.time() + duration
+    while time.time() < end:
+        conn.request('GET', REQUESTS[done % len(REQUESTS)])
+        resp = conn.getresponse()
+        resp.read()
+        assert resp.status == 200
+        done += 1
+    conn.close()
+    return done
+
+
+def wait_for(port, timeout=60):
+    end = time.time() + timeout
+    while time.time() < end:
+        try:
+            conn = HTTPConnection('127.0.0.1', port, timeout=5)
+            conn.request('GET', REQUESTS[0])
+            if conn.getresponse().status == 200:
+                return
+        except (IOError, OSError):
+            time.sleep(0.2)
+    raise Exception('service did not start on port {0}'.format(port))
+
+
+def measure(server, port, clients, duration, workers):
+    workdir = tempfile.mkdtemp(prefix='bench-server-')
+    cmd = ['copernicus', 'start', '--server', server, '--port', str(port), '--workers', str(workers),
+           '--log-level', 'WARN']
+    process = subprocess.Popen(cmd, cwd=workdir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for(port)
+        pool = multiprocessing.Pool(clients)
+        start = time.time()
+        total = sum(pool.map(client, [(port, duration)] * clients))
+        elapsed = time.time() - start
+        pool.close()
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return total / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=16, help='number of concurrent clients.')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per measurement.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of gunicorn workers.')
+    parser.add_argument('--port', type=int, default=5077, help='port of the service.')
+    args = parser.parse_args()
+    for server in ['werkzeug', 'gunicorn']:
+        rate = measure(server, args.port, args.clients, args.duration, args.workers)
+        print("{0:<9} {1:8.1f} requests/s".format(server, rate))
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
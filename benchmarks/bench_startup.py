@@ -0,0 +1,62 @@
+"""Startup time of the WPS application and its first GetCapabilities response.
+
+Each measurement runs in a fresh interpreter, the import of pywps is not
+included. ``eager`` constructs all processes like before the lazy registry,
+``lazy`` uses ``wsgi.create_app`` with persisted process descriptors (the
+second start of a server)::
+
+    $ python benchmarks/bench_startup.py --runs 5
+"""
+
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+SCRIPT = """
+import json, time
+from pywps import Service
+from copernicus import wsgi
+from copernicus.processes import registry
+# pywps itself is imported by both variants and not measured
+start = time.time()
+if {eager}:
+    service = Service(processes=registry.load_all(), cfgfiles=wsgi.get_config_files())
+else:
+    service = wsgi.create_app()
+created = time.time()
+from pywps.tests import WpsClient, WpsTestResponse
+client = WpsClient(service, WpsTestResponse)
+resp = client.get('?service=wps&request=getcapabilities&version=1.0.0')
+assert resp.status_code == 200
+done = time.time()
+print(json.dumps([created - start, done - created]))
+"""
+
+
+def measure(eager, runs):
+    results = []
+    for _ in range(runs):
+        output = subprocess.check_output([sys.executable, '-c', SCRIPT.format(eager=eager)])
+        results.append(json.loads(output.decode('utf-8').strip().splitlines()[-1]))
+    return results
+
+
+def report(name, results):
+    print("{0:<6} create_app={1:8.1f} ms  first GetCapabilities={2:8.1f} ms".format(
+        name, 1000 * statistics.median(r[0] for r in results), 1000 * statistics.median(r[1] for r in results)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='number of runs.')
+    args = parser.parse_args()
+    report('eager', measure(True, args.runs))
+    # the first lazy start persists the descriptors
+    measure(False, 1)
+    report('lazy', measure(False, args.runs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Cold-start and per-request timings of ``runner.generate_recipe``.
+
+The cold start creates a new jinja2 environment without bytecode cache and
+renders every recipe once, like the first request of a fresh worker used to.
+The warm timings use the compiled templates and the memoized config.yml::
+
+    $ python benchmarks/bench_templates.py --requests 200
+"""
+
+import time
+import shutil
+import argparse
+import tempfile
+
+from jinja2 import Environment, PackageLoader, select_autoescape
+
+from copernicus import runner
+
+CONSTRAINTS = dict(model='MPI-ESM-MR', experiment='historical', cmor_table='Amon',
+                   time_frequency='mon', ensemble='r1i1p1')
+RECIPES = [
+    ('zmnam', None),
+    ('consecdrydays', dict(frlim='5', plim='1')),
+    ('ensclus', dict(area='EAT', extreme='75th_percentile', numclus=3, perc=80)),
+]
+
+
+def generate_all(workdir):
+    for diag, options in RECIPES:
+        runner.generate_recipe(diag, constraints=CONSTRAINTS, options=options, workdir=workdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100, help='number of requests per recipe.')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp()
+    try:
+        # cold start: fresh environment without any cache
+        runner.template_env = Environment(
+            loader=PackageLoader('copernicus', 'templates/esmvaltool'),
+            autoescape=select_autoescape(['yml', ]))
+        start = time.time()
+        generate_all(workdir)
+        print("cold start (no cache)       {0:8.2f} ms".format(1000 * (time.time() - start)))
+
+        # cold start with compiled bytecode from a previous start
+        runner.template_env = runner.template_env.overlay(
+            bytecode_cache=runner.FileSystemBytecodeCache(), auto_reload=False, cache_size=-1)
+        runner.compile_templates()
+        runner.template_env.cache.clear()
+        runner._rendered_configs.clear()
+        runner._validated_recipes.clear()
+        start = time.time()
+        runner.compile_templates()
+        print("startup (bytecode cache)    {0:8.2f} ms".format(1000 * (time.time() - start)))
+
+        start = time.time()
+        for _ in range(args.requests):
+            generate_all(workdir)
+        per_request = (time.time() - start) / (args.requests * len(RECIPES))
+        print("per request (warm)          {0:8.3f} ms".format(1000 * per_request))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == '__main__':
+    main()
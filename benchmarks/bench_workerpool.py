@@ -0,0 +1,62 @@
+"""Per-job latency with and without the pre-warmed worker pool.
+
+Without the pool every job runs in a freshly forked process which imports
+ESMValTool and its dependencies (like ``runner.run`` in a PyWPS job process).
+With the pool the job is dispatched to a worker which already imported them.
+Modules which are not installed are skipped::
+
+    $ python benchmarks/bench_workerpool.py --jobs 20
+"""
+
+import time
+import argparse
+import statistics
+import multiprocessing
+
+from copernicus import workerpool
+
+
+def job(modules):
+    workerpool.preload(modules)
+    return len(modules)
+
+
+def cold_job(modules):
+    process = multiprocessing.get_context('fork').Process(target=job, args=(modules,))
+    process.start()
+    process.join()
+
+
+def report(name, latencies):
+    print("{0:<8} mean={1:8.1f} ms  median={2:8.1f} ms  max={3:8.1f} ms".format(
+        name, 1000 * statistics.mean(latencies), 1000 * statistics.median(latencies), 1000 * max(latencies)))
+
+
+def measure(func, *args, jobs=10):
+    latencies = []
+    for _ in range(jobs):
+        start = time.time()
+        func(*args)
+        latencies.append(time.time() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=10, help='number of jobs.')
+    parser.add_argument('--modules', nargs='*', default=workerpool.PRELOAD_MODULES, help='modules to preload.')
+    args = parser.parse_args()
+
+    # cold runs first, before this process has imported the modules itself
+    report('cold', measure(cold_job, args.modules, jobs=args.jobs))
+
+    pool = workerpool.WorkerPool(workers=2, preload_modules=args.modules)
+    pool.start()
+    try:
+        report('pool', measure(pool.call, '__main__.job', args.modules, jobs=args.jobs))
+    finally:
+        pool.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Zip archive builder for the output of a diagnostic.
+
+Files in already compressed formats are stored as they are, all other files
+are deflated. Every file is streamed into the archive in chunks with
+``ZipFile.open``, so large outputs are never held in memory.
+"""
+
+import os
+import time
+import shutil
+import zipfile
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# formats which barely compress
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.pdf', '.nc', '.nc4', '.zip', '.gz', '.bz2')
+
+CHUNK_SIZE = 1024 * 1024
+# seconds between two status updates
+STATUS_INTERVAL = 1.0
+
+
+def list_files(output_dir):
+    files = []
+    for root, dirs, names in os.walk(output_dir):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            files.append((path, os.path.relpath(path, output_dir)))
+    return files
+
+
+def is_stored(path):
+    return os.path.splitext(path)[1].lower() in STORED_EXTENSIONS
+
+
+def write_file(ziph, zinfo, path):
+    """Copy a file into the archive in chunks, stored or deflated by its format."""
+    zinfo.compress_type = zipfile.ZIP_STORED if is_stored(path) else zipfile.ZIP_DEFLATED
+    force_zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT
+    with open(path, 'rb') as src, ziph.open(zinfo, 'w', force_zip64=force_zip64) as dst:
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+class Progress(object):
+    """Report the number of archived bytes with ``response.update_status``."""
+
+    def __init__(self, response, total, start=90, end=99):
+        self.response = response
+        self.total = total
+        self.start = start
+        self.end = end
+        self.done = 0
+        self.last_update = 0
+
+    def update(self, nbytes):
+        self.done += nbytes
+        now = time.time()
+        if self.response is None or now - self.last_update < STATUS_INTERVAL:
+            return
+        self.last_update = now
+        percentage = self.start + (self.end - self.start) * self.done // max(self.total, 1)
+        self.response.update_status(
+            "creating archive of diagnostic result ({0} of {1} MB) ...".format(
+                self.done // 1024 ** 2, self.total // 1024 ** 2),
+            int(percentage))
+
+
+def build_archive(output_dir, archive_file, response=None):
+    """Write all files in ``output_dir`` to the zip file ``archive_file``.
+
+    :param response: optional PyWPS response used to report the progress.
+    """
+    files = list_files(output_dir)
+    progress = Progress(response, total=sum(os.path.getsize(path) for path, _ in files))
+    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as ziph:
+        for path, arcname in files:
+            zinfo = zipfile.ZipInfo.from_file(path, arcname)
+            write_file(ziph, zinfo, path)
+            progress.update(zinfo.file_size)
+    LOGGER.debug("archived %s files of %s bytes", len(files), progress.total)
+    return archive_file
@@ -0,0 +1,243 @@
+"""Content-addressed cache of ESMValTool results.
+
+A cache entry is keyed by a hash of the rendered recipe, the relevant values
+of the rendered ``config.yml`` and the fingerprints (path, size, mtime) of the
+input files the recipe reads. A hit restores the stored output tree into the
+job output directory using hard links, so it is nearly free.
+"""
+
+import os
+import glob
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+
+import yaml
+
+from pywps import configuration
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# config.yml options which do not change the result of a run
+IGNORED_CONFIG_OPTIONS = ['output_dir', 'max_parallel_tasks', 'log_level']
+
+# BADC DRS used for CMIP5 in the generated config.yml
+CMIP5_BADC_PATTERN = os.path.join(
+    '*', '{dataset}', '{exp}', '*', '*', '{mip}', '{ensemble}', 'latest', '{short_name}',
+    '{short_name}_{mip}_{dataset}_{exp}_{ensemble}_*.nc')
+# layout of the observations below obs_root
+OBS_PATTERN = os.path.join('Tier{tier}', '{dataset}', 'OBS_{dataset}_{type}_{version}_*.nc')
+
+INPUT_PATTERNS = {'CMIP5': CMIP5_BADC_PATTERN, 'OBS': OBS_PATTERN}
+
+ENTRY_FILE = 'entry.json'
+# folder of the preprocessed files, see :mod:`copernicus.preproc_cache`
+PREPROC_DIR = 'preproc'
+
+
+def get_cache():
+    """Return the configured result cache or ``None`` if it is disabled."""
+    if configuration.get_config_value('cache', 'enabled', True) is False:
+        return None
+    path = configuration.get_config_value('cache', 'path')
+    path = path or os.path.join(tempfile.gettempdir(), 'copernicus-cache')
+    max_size = configuration.get_config_value('cache', 'max_size') or '10gb'
+    return ResultCache(path, max_size=configuration.get_size_mb(max_size))
+
+
+def read_yaml(filename):
+    with open(filename) as fp:
+        return yaml.safe_load(fp)
+
+
+def read_entry(entry_file):
+    with open(entry_file) as fp:
+        return json.load(fp)
+
+
+def input_files(recipe, config):
+    """Return the input files a recipe reads according to the BADC DRS (CMIP5)
+    and the ``Tier<tier>/<dataset>`` layout (OBS).
+    """
+    rootpath = config.get('rootpath') or {}
+    files = set()
+    for diag in (recipe.get('diagnostics') or {}).values():
+        diag_datasets = list(recipe.get('datasets') or []) + list(diag.get('additional_datasets') or [])
+        for short_name, variable in (diag.get('variables') or {}).items():
+            variable = variable or {}
+            for dataset in diag_datasets + list(variable.get('additional_datasets') or []):
+                project = dataset.get('project')
+                if project == 'OBS':
+                    root = rootpath.get('OBS') or rootpath.get('default')
+                else:
+                    root = rootpath.get(project)
+                if project not in INPUT_PATTERNS or not root:
+                    continue
+                mip = dataset.get('mip') or variable.get('mip')
+                try:
+                    pattern = INPUT_PATTERNS[project].format(**dict(dataset, short_name=short_name, mip=mip))
+                except KeyError:
+                    continue
+                files.update(glob.glob(os.path.join(root, pattern)))
+    return sorted(files)
+
+
+def fingerprint(filename):
+    stat = os.stat(filename)
+    return [filename, stat.st_size, int(stat.st_mtime)]
+
+
+def cache_key(recipe_file, config_file, files=None):
+    """Compute the cache key of a rendered recipe and config file.
+
+    :param files: input files of the recipe. They are looked up in the
+                  CMIP5 archive if not given.
+    """
+    with open(recipe_file, 'rb') as fp:
+        recipe_text = fp.read()
+    config = read_yaml(config_file)
+    for option in IGNORED_CONFIG_OPTIONS:
+        config.pop(option, None)
+    if files is None:
+        files = input_files(yaml.safe_load(recipe_text), config)
+    checksum = hashlib.sha256()
+    checksum.update(recipe_text)
+    checksum.update(json.dumps(config, sort_keys=True).encode('utf-8'))
+    for filename in files:
+        checksum.update(json.dumps(fingerprint(filename)).encode('utf-8'))
+    return checksum.hexdigest()
+
+
+def link_tree(src, dst):
+    """Recreate the directory tree ``src`` at ``dst`` using hard links.
+
+    Files are copied when hard links are not supported, for example across
+    file systems. Symbolic links, like the links to the input data, are
+    recreated as symbolic links.
+    """
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for name in dirs + files:
+            src_file = os.path.join(root, name)
+            dst_file = os.path.join(target, name)
+            if os.path.islink(src_file):
+                os.symlink(os.readlink(src_file), dst_file)
+                continue
+            if name in dirs:
+                continue
+            try:
+                os.link(src_file, dst_file)
+            except OSError:
+                shutil.copy2(src_file, dst_file)
+
+
+def tree_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            # links to the input data do not count
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+class ResultCache(object):
+    """Size-bounded LRU store of ESMValTool output trees.
+
+    :param path: directory of the cache.
+    :param max_size: maximum size of the cache in megabytes.
+    """
+
+    def __init__(self, path, max_size=10240):
+        self.path = path
+        self.max_size = max_size
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def entries(self):
+        for entry_file in glob.glob(os.path.join(self.path, '*', '*', ENTRY_FILE)):
+            try:
+                entry = read_entry(entry_file)
+            except (IOError, OSError, ValueError):
+                continue
+            entry['path'] = os.path.dirname(entry_file)
+            entry['last_used'] = os.path.getmtime(entry_file)
+            yield entry
+
+    def lookup(self, key, output_dir):
+        """Restore a cached result into ``output_dir``.
+
+        :returns: tuple ``(logfile, plot_dir, work_dir, run_dir)`` like
+                  :func:`copernicus.runner.run` or ``None`` on a cache miss.
+        """
+        entry_file = os.path.join(self.entry_path(key), ENTRY_FILE)
+        try:
+            entry = read_entry(entry_file)
+        except (IOError, OSError, ValueError):
+            return None
+        session_dir = os.path.join(output_dir, entry['session'])
+        try:
+            link_tree(os.path.join(self.entry_path(key), 'output'), session_dir)
+        except (IOError, OSError):
+            LOGGER.exception("could not restore cached result %s", key)
+            shutil.rmtree(session_dir, ignore_errors=True)
+            return None
+        # mark entry as recently used
+        os.utime(entry_file, None)
+        LOGGER.info("result cache hit %s", key)
+        return tuple(os.path.join(session_dir, entry[name])
+                     for name in ('logfile', 'plot_dir', 'work_dir', 'run_dir'))
+
+    def store(self, key, logfile, plot_dir, work_dir, run_dir):
+        """Store the output of a finished run in the cache."""
+        session_dir = os.path.dirname(run_dir)
+        entry = dict(
+            session=os.path.basename(session_dir),
+            logfile=os.path.relpath(logfile, session_dir),
+            plot_dir=os.path.relpath(plot_dir, session_dir),
+            work_dir=os.path.relpath(work_dir, session_dir),
+            run_dir=os.path.relpath(run_dir, session_dir),
+            size=tree_size(session_dir),
+            created=time.time(),
+        )
+        if entry['size'] > self.max_size * 1024 ** 2:
+            LOGGER.info("result too large for cache: %s bytes", entry['size'])
+            return
+        parent = os.path.dirname(self.entry_path(key))
+        if not os.path.isdir(parent):
+            os.makedirs(parent)
+        tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=parent)
+        try:
+            link_tree(session_dir, os.path.join(tmp_path, 'output'))
+            with open(os.path.join(tmp_path, ENTRY_FILE), 'w') as fp:
+                json.dump(entry, fp)
+            # atomic publish, an existing entry from a concurrent run wins
+            os.rename(tmp_path, self.entry_path(key))
+        except (IOError, OSError):
+            LOGGER.debug("could not store result %s", key)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits its size."""
+        entries = sorted(self.entries(), key=lambda entry: entry['last_used'])
+        total = sum(entry['size'] for entry in entries)
+        while entries and total > self.max_size * 1024 ** 2:
+            entry = entries.pop(0)
+            LOGGER.info("evicting cached result %s", os.path.basename(entry['path']))
+            shutil.rmtree(entry['path'], ignore_errors=True)
+            total -= entry['size']
+
+    def invalidate(self):
+        """Remove all entries and preprocessed files, for example after the
+        data archive changed.
+        """
+        for entry in list(self.entries()):
+            shutil.rmtree(entry['path'], ignore_errors=True)
+        shutil.rmtree(os.path.join(self.path, PREPROC_DIR), ignore_errors=True)
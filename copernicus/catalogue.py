@@ -0,0 +1,364 @@
+"""Catalogue of the data in ``archive_root`` and ``obs_root``.
+
+The files are found with the directory layouts ESMValTool reads:
+
+* CMIP5 in the BADC DRS below ``archive_root``::
+
+    <institute>/<dataset>/<exp>/<frequency>/<realm>/<mip>/<ensemble>/latest/<short_name>/
+        <short_name>_<mip>_<dataset>_<exp>_<ensemble>_<start>-<end>.nc
+
+* OBS below ``obs_root``::
+
+    Tier<tier>/<dataset>/OBS_<dataset>_<type>_<version>_<mip>_<short_name>_<start>-<end>.nc
+
+The catalogue records the years covered by each dataset, variable and mip.
+It is persisted in the state directory with the modification times of the
+scanned directories. An update only lists the directories whose
+modification time changed, so new or removed files are found without
+reading the whole tree again.
+
+Lookups are dictionary accesses on the in-memory index, cheap enough for
+every request. One process of the service updates the catalogue, the others
+read it again when the persisted file changes. Each new index gets a new
+``generation``, so the service knows when to construct its processes again.
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import itertools
+import threading
+
+from pywps import configuration
+
+from copernicus import util
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# facets of the index keys
+KEY_FACETS = ['project', 'dataset', 'exp', 'ensemble', 'mip', 'short_name']
+TIME_RANGE = re.compile(r'^(\d{4})\d*-(\d{4})\d*$')
+FORMAT_VERSION = 1
+# seconds between two checks of the persisted catalogue for updates of other processes
+RELOAD_INTERVAL = 10
+
+_catalogue = None
+_refresher = None
+_lock = threading.Lock()
+_generations = itertools.count(1)
+
+
+def time_range(value):
+    match = TIME_RANGE.match(value)
+    if match:
+        return int(match.group(1)), int(match.group(2))
+    return None, None
+
+
+def parse_cmip5(parts, name):
+    """Return the facets of a CMIP5 file from its directory parts below the root."""
+    if len(parts) != 9 or not name.endswith('.nc'):
+        return None
+    _, dataset, exp, frequency, _, mip, ensemble, _, short_name = parts
+    fields = name[:-3].split('_')
+    if fields[:5] != [short_name, mip, dataset, exp, ensemble]:
+        return None
+    start, end = time_range(fields[5]) if len(fields) > 5 else (None, None)
+    return ['CMIP5', dataset, exp, ensemble, mip, frequency, short_name, start, end]
+
+
+def parse_obs(parts, name):
+    """Return the facets of an OBS file from its directory parts below the root."""
+    if len(parts) != 2 or not name.startswith('OBS_') or not name.endswith('.nc'):
+        return None
+    fields = name[:-3].split('_')
+    if len(fields) < 6 or fields[1] != parts[1]:
+        return None
+    start, end = time_range(fields[6]) if len(fields) > 6 else (None, None)
+    return ['OBS', fields[1], None, None, fields[4], None, fields[5], start, end]
+
+
+def merge(ranges):
+    """Merge ``(start, end)`` year ranges, ``(None, None)`` covers all years."""
+    if any(start is None for start, _ in ranges):
+        return [[None, None]]
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class Catalogue(object):
+    """Index of the datasets below the data roots.
+
+    :param roots: dict of projects (``CMIP5``, ``OBS``) to their root directory.
+    :param path: json file the catalogue is persisted in.
+    """
+
+    PARSERS = {'CMIP5': parse_cmip5, 'OBS': parse_obs}
+
+    def __init__(self, roots, path=None):
+        self.roots = dict((project, root) for project, root in roots.items() if root)
+        self.path = path
+        # directory to [mtime, subdirectories, file records]
+        self.dirs = {}
+        self.index = {}
+        self.frequencies = {}
+        self.memo = {}
+        self.updated = None
+        # changes with every new index
+        self.generation = 0
+        # modification time of the persisted file and time it was last checked
+        self.mtime = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the persisted catalogue, return False when there is none."""
+        try:
+            with open(self.path) as fp:
+                mtime = os.fstat(fp.fileno()).st_mtime
+                data = json.load(fp)
+        except (IOError, OSError, ValueError, TypeError):
+            return False
+        self.mtime = mtime
+        if data.get('version') != FORMAT_VERSION or data.get('roots') != self.roots:
+            return False
+        self.dirs = data['dirs']
+        self.updated = data.get('updated')
+        self.build_index()
+        return True
+
+    def save(self):
+        if not self.path:
+            return
+        tmp_path = '{0}.{1}'.format(self.path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as fp:
+                json.dump(dict(version=FORMAT_VERSION, roots=self.roots, updated=self.updated, dirs=self.dirs), fp)
+            os.rename(tmp_path, self.path)
+            self.mtime = os.stat(self.path).st_mtime
+        except (IOError, OSError):
+            LOGGER.warning("could not persist the data catalogue in %s", self.path)
+
+    def reload(self):
+        """Read the persisted catalogue again when another process has updated it."""
+        now = time.time()
+        if not self.path or now - self.checked < RELOAD_INTERVAL:
+            return False
+        self.checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        return mtime != self.mtime and self.load()
+
+    def scan(self, project, root, path, dirs, stats):
+        """Refresh ``path`` and its subdirectories, listing only changed directories."""
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return
+        stats['dirs'] += 1
+        entry = self.dirs.get(path)
+        if entry is None or entry[0] != mtime:
+            stats['listed'] += 1
+            subdirs = []
+            records = []
+            parts = os.path.relpath(path, root).split(os.sep) if path != root else []
+            try:
+                entries = list(os.scandir(path))
+            except OSError:
+                entries = []
+            for item in entries:
+                if item.is_dir():
+                    subdirs.append(item.name)
+                else:
+                    record = self.PARSERS[project](parts, item.name)
+                    if record is not None:
+                        records.append(record)
+            entry = [mtime, sorted(subdirs), records]
+        dirs[path] = entry
+        for name in entry[1]:
+            self.scan(project, root, os.path.join(path, name), dirs, stats)
+
+    def update(self):
+        """Update the catalogue from the changed directories and persist it.
+
+        Returns the number of scanned and listed directories.
+        """
+        stats = {'dirs': 0, 'listed': 0}
+        dirs = {}
+        for project, root in sorted(self.roots.items()):
+            root = os.path.abspath(root)
+            self.scan(project, root, root, dirs, stats)
+        changed = stats['listed'] > 0 or set(dirs) != set(self.dirs)
+        self.dirs = dirs
+        self.updated = time.time()
+        if changed:
+            self.build_index()
+            self.save()
+        return stats
+
+    def build_index(self):
+        ranges = {}
+        frequencies = {}
+        for _, _, records in self.dirs.values():
+            for record in records:
+                key = tuple(record[:5]) + (record[6],)
+                ranges.setdefault(key, []).append((record[7], record[8]))
+                if record[5]:
+                    frequencies[record[4]] = record[5]
+        with self.lock:
+            self.index = dict((key, merge(values)) for key, values in ranges.items())
+            self.frequencies = frequencies
+            self.memo = {}
+            self.generation = next(_generations)
+
+    def __len__(self):
+        return len(self.index)
+
+    def values(self, facet, **filters):
+        """Return the sorted values of a facet of the datasets matching the filters."""
+        memo_key = (facet, tuple(sorted(filters.items())))
+        with self.lock:
+            if memo_key not in self.memo:
+                values = set()
+                for key in self.index:
+                    record = dict(zip(KEY_FACETS, key), frequency=self.frequencies.get(key[4]))
+                    if all(record[name] == value for name, value in filters.items()):
+                        values.add(record[facet])
+                self.memo[memo_key] = sorted(value for value in values if value is not None)
+            return self.memo[memo_key]
+
+    def coverage(self, project, dataset, exp, ensemble, mip, short_name):
+        """Return the merged ``[start, end]`` year ranges of a variable of a dataset."""
+        return self.index.get((project, dataset, exp, ensemble, mip, short_name), [])
+
+    def missing(self, datasets, short_names, start_year, end_year):
+        """Return messages about the variables not covering the years.
+
+        :param datasets: list of dicts with ``project``, ``dataset``, ``exp``,
+                         ``ensemble`` and ``mip`` like the datasets of a recipe.
+        """
+        messages = []
+        for dataset in datasets:
+            key = [dataset.get(name) for name in KEY_FACETS[:5]]
+            for short_name in short_names:
+                ranges = self.coverage(*(key + [short_name]))
+                name = ' '.join(str(value) for value in key[1:] + [short_name] if value)
+                message = coverage_problem(name, ranges, start_year, end_year)
+                if message:
+                    messages.append(message)
+        return messages
+
+
+def coverage_problem(name, ranges, start_year, end_year):
+    """Return a message when the merged year ranges of the data do not cover the years."""
+    if not ranges:
+        return 'no data for {0}'.format(name)
+    if not any(start is None or (start <= int(start_year) and int(end_year) <= end) for start, end in ranges):
+        return '{0} is available for {1}, not {2}-{3}'.format(
+            name, ', '.join('{0}-{1}'.format(start, end) for start, end in ranges), start_year, end_year)
+    return None
+
+
+def catalogue_path(roots):
+    digest = hashlib.sha256(json.dumps(roots, sort_keys=True).encode('utf-8')).hexdigest()
+    return os.path.join(util.state_directory(), 'catalogue-{0}.json'.format(digest[:16]))
+
+
+def is_enabled():
+    return configuration.get_config_value('catalogue', 'enabled') is not False
+
+
+def get_catalogue():
+    """Return the catalogue of the configured data roots, read from its
+    persisted state. Returns None if disabled.
+    """
+    global _catalogue
+    if not is_enabled():
+        return None
+    roots = {
+        'CMIP5': configuration.get_config_value('data', 'archive_root'),
+        'OBS': configuration.get_config_value('data', 'obs_root'),
+    }
+    with _lock:
+        if _catalogue is None or _catalogue.roots != dict((key, value) for key, value in roots.items() if value):
+            _catalogue = Catalogue(roots, catalogue_path(roots))
+            _catalogue.load()
+    _catalogue.reload()
+    return _catalogue
+
+
+def generation():
+    """Return a value which changes when the catalogue has a new index."""
+    catalogue = get_catalogue()
+    return catalogue.generation if catalogue is not None else None
+
+
+def allowed_values(facet, fallback, **filters):
+    """Return the values of a facet in the catalogue or ``fallback`` when
+    the catalogue has no matching datasets.
+    """
+    catalogue = get_catalogue()
+    values = catalogue.values(facet, **filters) if catalogue else []
+    return values or fallback
+
+
+def default(values, value):
+    """Return the default value of an input, or the first allowed value."""
+    return value if value in values else values[0]
+
+
+def check_request(constraints, short_names, start_year, end_year):
+    """Raise an exception when the catalogue lacks data for the request of a process."""
+    catalogue = get_catalogue()
+    if not catalogue:
+        # nothing is known about the data
+        return
+    dataset = dict(project='CMIP5', dataset=constraints['model'], exp=constraints['experiment'],
+                   ensemble=constraints['ensemble'], mip=constraints['cmor_table'])
+    messages = catalogue.missing([dataset], short_names, start_year, end_year)
+    if messages:
+        raise Exception('Data is not available: {0}.'.format('; '.join(messages)))
+
+
+def refresh(interval):
+    while True:
+        try:
+            stats = get_catalogue().update()
+            LOGGER.debug("catalogue checked %s directories, listed %s", stats['dirs'], stats['listed'])
+        except Exception:
+            LOGGER.exception("could not update the data catalogue")
+        time.sleep(interval)
+
+
+def start_refresh():
+    """Start the thread updating the catalogue every ``refresh_interval`` seconds."""
+    global _refresher
+    if _refresher is not None or not is_enabled():
+        return
+    interval = float(configuration.get_config_value('catalogue', 'refresh_interval') or 600)
+    _refresher = threading.Thread(target=refresh, args=(interval,), name='catalogue')
+    _refresher.daemon = True
+    _refresher.start()
+
+
+def _after_fork():
+    # the refresh thread is not forked and its locks may be held
+    global _lock, _refresher
+    _lock = threading.Lock()
+    _refresher = None
+    if _catalogue is not None:
+        _catalogue.lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
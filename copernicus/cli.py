@@ -6,12 +6,18 @@
 ###########################################################
 
 import os
+import signal
 import psutil
 import click
 from jinja2 import Environment, PackageLoader
 from pywps import configuration
 
 from . import wsgi
+from . import cache
+from . import workerpool
+from . import fileserver
+from . import reaper
+from . import catalogue
 from six.moves.urllib.parse import urlparse
 
 
@@ -61,6 +67,9 @@ def run_process_action(action=None):
             if action == 'stop':
                 p.terminate()
                 msg = "pid={}, status=terminated".format(p.pid)
+            elif action == 'reload':
+                p.send_signal(signal.SIGHUP)
+                msg = "pid={}, status=reloading".format(p.pid)
             else:
                 from psutil import _pprint_secs
                 msg = "pid={}, status={}, created={}".format(
@@ -74,26 +83,68 @@ def run_process_action(action=None):
     click.echo(msg)
 
 
+def static_files_app(application):
+    """Wrap the application to also serve the static files and the wps outputs."""
+    return fileserver.FileServer(application, {
+        '/static': (os.path.join(os.path.dirname(__file__), 'static'), False),
+        # the outputs of a job don't change
+        '/outputs': (configuration.get_config_value('server', 'outputpath'), True),
+    }, on_access=reaper.mark_used)
+
+
 def _run(application, bind_host=None, daemon=False):
     from werkzeug.serving import run_simple
     # call this *after* app is initialized ... needs pywps config.
     host, port = get_host()
     bind_host = bind_host or host
-    # need to serve the wps outputs
-    static_files = {
-        '/static': os.path.join(os.path.dirname(__file__), 'static'),
-        '/outputs': configuration.get_config_value('server', 'outputpath')
-    }
     run_simple(
         hostname=bind_host,
         port=port,
-        application=application,
+        # need to serve the wps outputs
+        application=static_files_app(application),
         use_debugger=False,
         use_reloader=False,
         threaded=True,
         # processes=2,
-        use_evalex=not daemon,
-        static_files=static_files)
+        use_evalex=not daemon)
+
+
+def _run_gunicorn(cfgfiles, bind_host=None, workers=4, threads=4, keep_alive=5, graceful_timeout=30):
+    """Run the service with pre-forked gunicorn workers.
+
+    Each worker creates its own application. The ESMValTool worker pool, the
+    updates of the data catalogue and the reaper run in the gunicorn master
+    and are shared by all workers. Send ``SIGHUP`` to the master (``copernicus
+    reload``) to gracefully replace the workers with new ones reading the
+    current configuration. The workers are forked from the master, which has
+    imported the service, so new code needs a restart.
+    """
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise click.ClickException("gunicorn is not installed: pip install gunicorn")
+
+    class Application(BaseApplication):
+
+        def load_config(self):
+            host, port = get_host()
+            self.cfg.set('bind', '{}:{}'.format(bind_host or host, port))
+            self.cfg.set('workers', workers)
+            # threaded workers keep connections alive, sync workers don't
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', threads)
+            self.cfg.set('keepalive', keep_alive)
+            self.cfg.set('graceful_timeout', graceful_timeout)
+            self.cfg.set('proc_name', 'copernicus')
+
+        def load(self):
+            return static_files_app(wsgi.create_app(cfgfiles, background_tasks=False))
+
+    configuration.load_configuration(wsgi.get_config_files(cfgfiles))
+    workerpool.start_pool()
+    catalogue.start_refresh()
+    reaper.start_reaper()
+    Application().run()
 
 
 @click.group(context_settings=CONTEXT_SETTINGS)
@@ -120,6 +171,60 @@ def stop():
     run_process_action(action='stop')
 
 
+@cli.command()
+def reload():
+    """Gracefully restart the workers of a PyWPS service started with --server=gunicorn
+    with the current configuration. New code needs a restart.
+    """
+    run_process_action(action='reload')
+
+
+@cli.command('clear-cache')
+@click.option('--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+def clear_cache(config):
+    """Clear the ESMValTool result cache and the preprocessed files.
+    Use it when the data in archive_root or obs_root has changed.
+    """
+    configuration.load_configuration(wsgi.get_config_files([config] if config else None))
+    result_cache = cache.get_cache()
+    if result_cache:
+        result_cache.invalidate()
+        click.echo("cleared result cache {}".format(result_cache.path))
+    else:
+        click.echo("result cache is disabled.")
+
+
+@cli.command('update-catalogue')
+@click.option('--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+def update_catalogue(config):
+    """Update the catalogue of the data in archive_root and obs_root.
+    Only directories which have changed since the last update are listed.
+    """
+    configuration.load_configuration(wsgi.get_config_files([config] if config else None))
+    data_catalogue = catalogue.get_catalogue()
+    if data_catalogue is None:
+        click.echo("catalogue is disabled.")
+        return
+    stats = data_catalogue.update()
+    click.echo("checked {} directories, listed {}, {} variables of {} datasets in {}".format(
+        stats['dirs'], stats['listed'], len(data_catalogue), len(data_catalogue.values('dataset')),
+        data_catalogue.path))
+
+
+@cli.command()
+@click.option('--config', '-c', metavar='PATH', help='path to pywps configuration file.')
+@click.option('--dry-run', is_flag=True, help='only list what would be removed.')
+def reap(config, dry_run):
+    """Remove old job outputs and working directories.
+    Enforces the quotas of the [reaper] section, like the reaper of the service.
+    """
+    configuration.load_configuration(wsgi.get_config_files([config] if config else None))
+    removed = reaper.reap(dry_run=dry_run)
+    for path, size in removed:
+        click.echo("{} {} ({} bytes)".format('would remove' if dry_run else 'removed', path, size))
+    click.echo("{} entries, {} bytes".format(len(removed), sum(size for _, size in removed)))
+
+
 @cli.command()
 @click.option('--config', '-c', metavar='PATH', help='path to pywps configuration file.')
 @click.option('--bind-host', '-b', metavar='IP-ADDRESS', default='127.0.0.1',
@@ -133,9 +238,17 @@ def stop():
 @click.option('--log-level', metavar='LEVEL', default='INFO', help='log level in PyWPS configuration.')
 @click.option('--log-file', metavar='PATH', default='pywps.log', help='log file in PyWPS configuration.')
 @click.option('--database', default='sqlite:///pywps-logs.sqlite', help='database in PyWPS configuration')
+@click.option('--server', type=click.Choice(['werkzeug', 'gunicorn']), default='werkzeug',
+              help='werkzeug development server or gunicorn with pre-forked workers.')
+@click.option('--workers', metavar='INT', default=4, help='number of gunicorn worker processes.')
+@click.option('--threads', metavar='INT', default=4, help='number of threads per gunicorn worker.')
+@click.option('--keep-alive', metavar='SECONDS', default=5, help='keep-alive timeout of gunicorn connections.')
+@click.option('--graceful-timeout', metavar='SECONDS', default=30,
+              help='time gunicorn workers get to finish their requests on reload and stop.')
 def start(config, bind_host, daemon, hostname, port,
           maxsingleinputsize, maxprocesses, parallelprocesses,
-          log_level, log_file, database):
+          log_level, log_file, database,
+          server, workers, threads, keep_alive, graceful_timeout):
     """Start PyWPS service.
     This service is by default available at http://localhost:5000/wps
     """
@@ -152,7 +265,15 @@ def start(config, bind_host, daemon, hostname, port,
     ))
     if config:
         cfgfiles.append(config)
-    app = wsgi.create_app(cfgfiles)
+
+    def serve():
+        if server == 'gunicorn':
+            _run_gunicorn(cfgfiles, bind_host=bind_host, workers=workers, threads=threads,
+                          keep_alive=keep_alive, graceful_timeout=graceful_timeout)
+        else:
+            # the app (and its worker pool) is created in the serving process
+            app = wsgi.create_app(cfgfiles)
+            _run(app, bind_host=bind_host, daemon=daemon)
     # let's start the service ...
     # See:
     # * https://github.com/geopython/pywps-flask/blob/master/demo.py
@@ -171,9 +292,9 @@ def start(config, bind_host, daemon, hostname, port,
 
         if pid == 0:
             os.setsid()
-            _run(app, bind_host=bind_host, daemon=True)
+            serve()
         else:
             os._exit(0)
     else:
         # no daemon
-        _run(app, bind_host=bind_host)
+        serve()
@@ -0,0 +1,209 @@
+"""Coalescing of identical in-flight Execute requests.
+
+An async Execute request is identified by a hash of the process identifier,
+its normalized inputs and the requested outputs. When a job with the same
+hash is queued or running, the new request attaches to it instead of
+starting another ESMValTool run. The status document of the running job
+(the leader) is also written for all attached requests, so they get the
+same status updates and the same outputs.
+
+The leaders and attached requests are kept in ``jobs.sqlite`` in the state
+directory, shared by all server processes. Only requests to the processes
+listed in ``coalesce`` are attached, as the outputs of stochastic processes
+like ``rainfarm`` differ between identical requests::
+
+    [scheduler]
+    coalesce = cvdp, ensclus, zonal_mean_nam
+
+A leader without attached jobs looks them up at most every
+``FOLLOWERS_INTERVAL`` seconds, so most status updates do not touch the
+database.
+
+An attached request also keeps its failed status document. It is written
+when the leader crashed (PyWPS marks it failed without a last status
+update) or was not queued, which is found by the next attaching request.
+"""
+
+import os
+import json
+import time
+import hashlib
+import sqlite3
+
+from pywps import configuration, dblog
+from pywps.inout.formats import FORMATS
+from pywps.inout.storage.builder import StorageBuilder
+from pywps.response.status import WPS_STATUS
+
+from copernicus import util
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# seconds between the lookups of the jobs attached to a leader without any
+FOLLOWERS_INTERVAL = 5
+# leaders without attached jobs and the time they were looked up
+_no_followers = {}
+
+
+def is_enabled(identifier):
+    """Check whether the requests to the process are coalesced."""
+    value = configuration.get_config_value('scheduler', 'coalesce') or ''
+    return identifier in [item.strip() for item in value.split(',') if item.strip()]
+
+
+def normalize(inpt):
+    if hasattr(inpt, 'data_type'):
+        # literal values are already converted to their data type
+        return repr(inpt.data)
+    if getattr(inpt, 'as_reference', False) and inpt.url:
+        return inpt.url
+    data = inpt.data
+    if not isinstance(data, bytes):
+        data = str(data).encode('utf-8')
+    return hashlib.sha256(data).hexdigest()
+
+
+def request_key(identifier, wps_request):
+    """Return the canonical hash of an Execute request."""
+    canonical = dict(
+        identifier=identifier,
+        inputs=[[name, [normalize(inpt) for inpt in wps_request.inputs[name]]]
+                for name in sorted(wps_request.inputs)],
+        outputs=wps_request.outputs,
+    )
+    return hashlib.sha256(json.dumps(canonical, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def jobs_database():
+    return os.path.join(util.state_directory(), 'jobs.sqlite')
+
+
+def connect(database=None):
+    conn = sqlite3.connect(database or jobs_database(), timeout=30, isolation_level=None)
+    conn.execute("CREATE TABLE IF NOT EXISTS jobs "
+                 "(uuid TEXT PRIMARY KEY, key TEXT, leader TEXT, created REAL, failed_doc TEXT)")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key)")
+    return conn
+
+
+def crashed(uuid):
+    """Check in the PyWPS database that the job has failed or is gone.
+
+    A job which has succeeded still writes the status of its attached jobs.
+    """
+    session = dblog.get_session()
+    try:
+        job = session.query(dblog.ProcessInstance).filter_by(uuid=str(uuid)).first()
+        return job is None or job.status == WPS_STATUS.FAILED
+    finally:
+        session.close()
+
+
+def remove_leader(conn, leader):
+    """Forget the leader, return the uuids and failed documents of its attached jobs."""
+    docs = conn.execute("SELECT uuid, failed_doc FROM jobs WHERE leader = ? AND uuid != leader",
+                        (leader,)).fetchall()
+    conn.execute("DELETE FROM jobs WHERE leader = ?", (leader,))
+    return docs
+
+
+def write_failed(docs):
+    store = StorageBuilder.buildStorage()
+    for uuid, doc in docs:
+        if not doc:
+            continue
+        try:
+            store.write(doc, '{0}.xml'.format(uuid), data_format=FORMATS.XML)
+        except Exception:
+            LOGGER.exception("could not write the failed status of job %s", uuid)
+
+
+def attach(key, uuid, database=None):
+    """Attach the job to the in-flight job with the same key.
+
+    Returns the uuid of the leader, which is ``uuid`` when the job has to run.
+    """
+    uuid = str(uuid)
+    docs = []
+    conn = connect(database)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for crashed_leader, in conn.execute("SELECT leader FROM jobs WHERE uuid = leader").fetchall():
+            if crashed(crashed_leader):
+                docs.extend(remove_leader(conn, crashed_leader))
+        row = conn.execute("SELECT leader FROM jobs WHERE key = ? AND uuid = leader", (key,)).fetchone()
+        leader = row[0] if row else uuid
+        conn.execute("INSERT INTO jobs VALUES (?, ?, ?, ?, NULL)", (uuid, key, leader, time.time()))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    write_failed(docs)
+    return leader
+
+
+def set_failed_doc(uuid, doc, database=None):
+    """Keep the status document an attached job gets when its leader crashes."""
+    conn = connect(database)
+    try:
+        conn.execute("UPDATE jobs SET failed_doc = ? WHERE uuid = ?", (doc, str(uuid)))
+    finally:
+        conn.close()
+
+
+def release(leader, database=None):
+    """Forget a leader which will not run, its attached jobs fail."""
+    conn = connect(database)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        docs = remove_leader(conn, str(leader))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    write_failed(docs)
+
+
+def followers(leader, finished=False, database=None):
+    """Return the jobs attached to the leader, and forget them when it has finished."""
+    conn = connect(database)
+    try:
+        if finished:
+            conn.execute("BEGIN IMMEDIATE")
+        uuids = [uuid for uuid, in conn.execute(
+            "SELECT uuid FROM jobs WHERE leader = ? AND uuid != leader", (str(leader),))]
+        if finished:
+            conn.execute("DELETE FROM jobs WHERE leader = ?", (str(leader),))
+            conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return uuids
+
+
+def write_status(wps_response, uuid, doc):
+    wps_response.process.status_store.write(doc, '{0}.xml'.format(uuid), data_format=FORMATS.XML)
+
+
+def propagate(wps_response):
+    """Write the status of a leader job for its attached jobs."""
+    finished = wps_response.status in (WPS_STATUS.SUCCEEDED, WPS_STATUS.FAILED)
+    leader = str(wps_response.uuid)
+    now = time.time()
+    if not finished and now - _no_followers.get(leader, -FOLLOWERS_INTERVAL) < FOLLOWERS_INTERVAL:
+        return
+    try:
+        uuids = followers(leader, finished)
+    except sqlite3.Error:
+        LOGGER.exception("could not read the jobs attached to %s", leader)
+        return
+    if finished or uuids:
+        _no_followers.pop(leader, None)
+    else:
+        _no_followers[leader] = now
+    for uuid in uuids:
+        try:
+            write_status(wps_response, uuid, wps_response.doc.replace(
+                '{0}.xml'.format(leader), '{0}.xml'.format(uuid)))
+            if finished:
+                dblog.store_status(uuid, wps_response.status, wps_response.message, 100)
+        except Exception:
+            LOGGER.exception("could not update the status of job %s attached to %s", uuid, leader)
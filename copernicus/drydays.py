@@ -0,0 +1,90 @@
+"""Consecutive dry days of daily precipitation without ESMValTool.
+
+Computes the maps of the ``droughtindex/diag_cdd.py`` diagnostic of the
+``consecdrydays`` recipe: ``drymax`` is the largest number of consecutive
+days with less than ``plim`` mm of precipitation, ``dryfreq`` the number of
+dry spells of at least ``frlim`` days. Like the diagnostic, ``dryfreq`` only
+counts spells that end with a wet day within the period.
+
+The daily fields are read in time chunks and the days of a chunk are added
+one at a time, with array operations on all grid points at once. The length
+of the running spell is the only state, so spells cross chunk boundaries.
+A cumulative maximum along time over a whole chunk was ten times slower.
+"""
+
+import os
+import time
+
+import numpy as np
+
+from copernicus import ncdata
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+SECONDS_PER_DAY = 86400.0
+
+
+class DrySpells(object):
+    """Running statistics of the dry spells of a grid.
+
+    :param plim: precipitation of a dry day in mm/day.
+    :param frlim: dry spells of at least this number of days are counted.
+    """
+
+    def __init__(self, shape, plim, frlim):
+        # pr is a flux in kg m-2 s-1, which is mm/s
+        self.plim = float(plim) / SECONDS_PER_DAY
+        self.frlim = float(frlim)
+        self.current = np.zeros(shape, dtype=np.int32)
+        self.drymax = np.zeros(shape, dtype=np.int32)
+        self.dryfreq = np.zeros(shape, dtype=np.int32)
+
+    def update(self, pr):
+        """Add the days of ``pr`` with shape ``(time, ...)``, missing values are wet."""
+        for dry in pr < self.plim:
+            # a spell ends on a wet day
+            self.dryfreq += (self.current >= self.frlim) & ~dry
+            self.current += 1
+            self.current *= dry
+            np.maximum(self.drymax, self.current, out=self.drymax)
+
+    def finish(self):
+        """Return ``drymax`` and ``dryfreq``, a spell running at the end only counts in ``drymax``."""
+        return self.drymax, self.dryfreq
+
+
+def compute(field, plim, frlim, progress=None):
+    """Return the ``drymax`` and ``dryfreq`` maps of a :class:`copernicus.ncdata.Field` of ``pr``.
+
+    :param progress: called with the fraction of the days read.
+    """
+    spells = DrySpells((len(field.lat), len(field.lon)), plim, frlim)
+    days = 0
+    for _, pr in field.chunks():
+        spells.update(pr)
+        days += len(pr)
+        if progress:
+            progress(float(days) / len(field))
+    return spells.finish()
+
+
+def run(files, start_year, end_year, plim, frlim, work_dir, prefix, progress=None):
+    """Write the ``drymax`` and ``dryfreq`` maps of the files like the recipe does.
+
+    :returns: the paths of the ``drymax`` and ``dryfreq`` files.
+    """
+    start = time.time()
+    field = ncdata.Field(files, 'pr', start_year, end_year)
+    drymax, dryfreq = compute(field, plim, frlim, progress=progress)
+    if not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+    paths = []
+    for name, values, long_name in [
+            ('drymax', drymax, 'Maximum number of consecutive days with less than {0} mm/day'.format(plim)),
+            ('dryfreq', dryfreq, 'Number of dry periods of at least {0} days'.format(frlim))]:
+        path = os.path.join(work_dir, '{0}_{1}.nc'.format(prefix, name))
+        ncdata.write_map(path, name, values, field.lat, field.lon, {'long_name': long_name, 'units': '1'})
+        paths.append(path)
+    LOGGER.info("counted the dry days of %s days of %s files in %.1f s", len(field), len(files), time.time() - start)
+    return paths
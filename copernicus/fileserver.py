@@ -0,0 +1,132 @@
+"""Serving of the WPS outputs and static files.
+
+Files (and ranges up to their end) are handed to the ``wsgi.file_wrapper``
+of the server, which lets servers like gunicorn send them with zero-copy
+``sendfile``. Range requests
+(for resuming downloads), conditional requests with ETag and Last-Modified
+and cache headers are supported.
+
+The outputs of a job (``/outputs/<uuid>/...``) never change and are cached
+by clients. Files directly in the outputs directory, like the status
+documents of running jobs, are always revalidated.
+"""
+
+import os
+import mimetypes
+from datetime import datetime, timezone
+
+from werkzeug.http import http_date, is_resource_modified, parse_range_header, unquote_etag
+from werkzeug.security import safe_join
+
+CHUNK_SIZE = 64 * 1024
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+STATIC = 'public, max-age=3600'
+
+
+class FileServer(object):
+    """WSGI middleware serving files below the mounted directories.
+
+    :param application: WSGI application for all other requests.
+    :param mounts: dict of url prefixes to ``(directory, immutable)``, with
+                   ``immutable`` true when files in subdirectories never change.
+    :param on_access: optional function called with the filename of served
+                      files in immutable mounts.
+    """
+
+    def __init__(self, application, mounts, on_access=None):
+        self.application = application
+        self.mounts = sorted(mounts.items(), reverse=True)
+        self.on_access = on_access
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        for prefix, (directory, immutable) in self.mounts:
+            if directory and path.startswith(prefix + '/'):
+                filename = safe_join(directory, path[len(prefix) + 1:])
+                if filename and os.path.isfile(filename):
+                    if not immutable:
+                        cache_control = STATIC
+                    elif os.path.dirname(filename) == os.path.abspath(directory):
+                        cache_control = REVALIDATE
+                    else:
+                        cache_control = IMMUTABLE
+                    if immutable and self.on_access:
+                        self.on_access(filename)
+                    return serve_file(environ, start_response, filename, cache_control)
+        return self.application(environ, start_response)
+
+
+def make_etag(stat):
+    return '{0:x}-{1:x}-{2:x}'.format(stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def limited(fp, length):
+    """Read ``length`` bytes of the file in chunks."""
+    try:
+        while length > 0:
+            data = fp.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        fp.close()
+
+
+def serve_file(environ, start_response, filename, cache_control=REVALIDATE):
+    if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+        start_response('405 Method Not Allowed', [('Allow', 'GET, HEAD'), ('Content-Length', '0')])
+        return []
+    stat = os.stat(filename)
+    etag = make_etag(stat)
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+    headers = [
+        ('ETag', '"{0}"'.format(etag)),
+        ('Last-Modified', http_date(last_modified)),
+        ('Cache-Control', cache_control),
+        ('Accept-Ranges', 'bytes'),
+    ]
+    if not is_resource_modified(environ, etag=etag, last_modified=last_modified):
+        start_response('304 Not Modified', headers)
+        return []
+
+    size = stat.st_size
+    start, stop = 0, size
+    status = '200 OK'
+    byte_range = parse_range_header(environ.get('HTTP_RANGE'))
+    if_range = environ.get('HTTP_IF_RANGE')
+    if if_range and unquote_etag(if_range)[0] != etag and if_range != http_date(last_modified):
+        # the file has changed, send all of it
+        byte_range = None
+    if byte_range is not None:
+        # multiple ranges are not supported, these get the whole file
+        range_for_length = byte_range.range_for_length(size)
+        if range_for_length is None and len(byte_range.ranges) == 1:
+            start_response('416 Range Not Satisfiable', headers + [
+                ('Content-Range', 'bytes */{0}'.format(size)), ('Content-Length', '0')])
+            return []
+        if range_for_length is not None:
+            start, stop = range_for_length
+            status = '206 Partial Content'
+            headers.append(('Content-Range', 'bytes {0}-{1}/{2}'.format(start, stop - 1, size)))
+
+    content_type, encoding = mimetypes.guess_type(filename)
+    if encoding:
+        # compressed files are downloaded as they are
+        content_type = None
+    headers.append(('Content-Type', content_type or 'application/octet-stream'))
+    headers.append(('Content-Length', str(stop - start)))
+    start_response(status, headers)
+    if environ['REQUEST_METHOD'] == 'HEAD':
+        return []
+
+    fp = open(filename, 'rb')
+    fp.seek(start)
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    if file_wrapper is not None and stop == size:
+        # the server sends the file from the current position to its end,
+        # using sendfile when it can
+        return file_wrapper(fp, CHUNK_SIZE)
+    return limited(fp, stop - start)
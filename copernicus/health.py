@@ -0,0 +1,124 @@
+"""Liveness and readiness endpoints for load balancers.
+
+``/health`` answers as long as the server process handles requests.
+``/ready`` answers ``200`` when the service can take jobs and ``503``
+otherwise. It checks
+
+* the ESMValTool worker pool is alive (when configured),
+* the job queue is below ``max_queue`` jobs,
+* ``archive_root`` and ``obs_root`` are mounted (not empty),
+* the outputs directory has ``min_free_space`` left.
+
+The state is refreshed at most every ``check_interval`` seconds, so probes
+never run a WPS request or ESMValTool and cost one query of the job queue
+per interval.
+"""
+
+import os
+import json
+import time
+import shutil
+import threading
+
+from pywps import configuration, dblog
+
+from copernicus import workerpool
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+
+def config_value(option, default):
+    value = configuration.get_config_value('health', option)
+    return default if value in (None, '') else value
+
+
+def check_pool():
+    pool = workerpool.get_pool()
+    if pool is None:
+        return True, 'no worker pool'
+    if pool.is_alive():
+        return True, '{0} workers'.format(len(pool.worker_pids()))
+    return False, 'worker pool is not running'
+
+
+def check_queue():
+    max_queue = int(config_value('max_queue', configuration.get_config_value('server', 'maxprocesses')))
+    running, stored = dblog.get_process_counts()
+    message = '{0} running, {1} queued'.format(running, stored)
+    return max_queue == -1 or stored < max_queue, message
+
+
+def check_data():
+    missing = []
+    for option in ['archive_root', 'obs_root']:
+        path = configuration.get_config_value('data', option)
+        try:
+            with os.scandir(path) as entries:
+                if next(entries, None) is None:
+                    missing.append(path)
+        except OSError:
+            missing.append(path)
+    if missing:
+        return False, 'not mounted: {0}'.format(', '.join(missing))
+    return True, 'mounted'
+
+
+def check_disk():
+    outputpath = configuration.get_config_value('server', 'outputpath')
+    min_free = int(configuration.get_size_mb(config_value('min_free_space', '1gb')) * 1024 ** 2)
+    free = shutil.disk_usage(outputpath).free
+    return free >= min_free, '{0} bytes free'.format(free)
+
+
+CHECKS = [('workers', check_pool), ('queue', check_queue), ('data', check_data), ('disk', check_disk)]
+
+
+class HealthApp(object):
+    """WSGI middleware answering ``/health`` and ``/ready`` and passing all
+    other requests on.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.state = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # like processes of the wrapped service
+        return getattr(self.application, name)
+
+    def check(self):
+        """Return the ready flag and the results of the checks, cached for ``check_interval``."""
+        with self.lock:
+            if self.state is None or time.time() - self.checked > float(config_value('check_interval', 5)):
+                results = {}
+                for name, check in CHECKS:
+                    try:
+                        ok, message = check()
+                    except Exception as e:
+                        LOGGER.exception("health check %s failed", name)
+                        ok, message = False, str(e)
+                    results[name] = {'ok': ok, 'message': message}
+                self.state = all(result['ok'] for result in results.values()), results
+                self.checked = time.time()
+            return self.state
+
+    def respond(self, start_response, ok, data):
+        body = json.dumps(data, sort_keys=True).encode('utf-8')
+        start_response('200 OK' if ok else '503 Service Unavailable', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Cache-Control', 'no-store')])
+        return [body]
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO')
+        if path not in ('/health', '/ready') or configuration.get_config_value('health', 'enabled') is False:
+            return self.application(environ, start_response)
+        if path == '/health':
+            return self.respond(start_response, True, {'status': 'ok'})
+        ready, results = self.check()
+        return self.respond(start_response, ready, {'status': 'ready' if ready else 'unavailable',
+                                                    'checks': results})
@@ -0,0 +1,221 @@
+"""Per-stage resource usage of diagnostic handlers.
+
+A :class:`StageRecorder` measures wall time, CPU time (including child
+processes), peak RSS and bytes read/written for each stage of a job like
+``generate_recipe``, ``preflight``, ``run``, ``collect_outputs`` and
+``archive``. When a stage runs in the ESMValTool worker pool, the usage of the worker is added.
+
+The stages of a job are written to ``stages.json`` next to the job outputs
+and to the ``stages`` table of the statistics database in the state
+directory. The database also keeps the bytes of the outputs of each job and
+counters like the hits of the caches, which are exported by
+:mod:`copernicus.metrics`.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import resource
+import threading
+
+import psutil
+
+from pywps import configuration
+
+from copernicus import util
+from copernicus import cache
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+COUNTERS = ['wall_time', 'cpu_time', 'read_bytes', 'write_bytes']
+# seconds between two samples of the RSS
+RSS_INTERVAL = 0.2
+
+_active = threading.local()
+# databases which have the statistics tables
+_schema_created = set()
+
+
+def snapshot():
+    """Return the current resource counters of this process and its children."""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    counters = dict(
+        wall_time=time.time(),
+        cpu_time=own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime,
+        read_bytes=0,
+        write_bytes=0,
+    )
+    try:
+        io = psutil.Process().io_counters()
+        counters.update(read_bytes=io.read_bytes, write_bytes=io.write_bytes)
+    except (AttributeError, psutil.Error):
+        # io counters are not available on all platforms
+        pass
+    return counters
+
+
+def usage(before, after):
+    """Return the resource usage between two snapshots."""
+    return dict((name, after[name] - before[name]) for name in COUNTERS)
+
+
+def rss():
+    """Return the RSS of this process and its children in bytes."""
+    process = psutil.Process()
+    total = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            total += child.memory_info().rss
+        except psutil.Error:
+            # the child has exited
+            pass
+    return total
+
+
+class PeakRSS(threading.Thread):
+    """Sample the RSS of this process and its children until stopped.
+
+    ``ru_maxrss`` is the peak of the whole process lifetime, so it cannot
+    tell the peak of a stage.
+    """
+
+    def __init__(self, interval=None):
+        super(PeakRSS, self).__init__(name='rss-sampler')
+        self.daemon = True
+        self.interval = interval or RSS_INTERVAL
+        self.peak = rss()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, rss())
+
+    def stop(self):
+        """Stop sampling and return the peak RSS in bytes."""
+        self._stopped.set()
+        self.join()
+        self.peak = max(self.peak, rss())
+        return self.peak
+
+
+def add_usage(remote_usage):
+    """Add the usage of another process, like a pool worker, to the
+    active stage of this thread.
+    """
+    recorder = getattr(_active, 'recorder', None)
+    if recorder is not None:
+        recorder.remote.append(remote_usage)
+
+
+def stats_database():
+    return os.path.join(util.state_directory(), 'stats.sqlite')
+
+
+def connect(database=None):
+    database = database or stats_database()
+    conn = sqlite3.connect(database, timeout=30)
+    if database not in _schema_created:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS stages ("
+            "uuid TEXT, process TEXT, stage TEXT, started REAL, wall_time REAL, cpu_time REAL, "
+            "max_rss INTEGER, read_bytes INTEGER, write_bytes INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS outputs (uuid TEXT, process TEXT, finished REAL, bytes INTEGER)")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL)")
+        _schema_created.add(database)
+    return conn
+
+
+def increment(name, value=1, database=None):
+    """Add ``value`` to the counter ``name``."""
+    try:
+        conn = connect(database)
+        with conn:
+            conn.execute(
+                "INSERT INTO counters VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", (name, value))
+        conn.close()
+    except sqlite3.Error:
+        LOGGER.exception("could not increment counter %s", name)
+
+
+def record_outputs(process, uuid, database=None):
+    """Store the size of the outputs of a finished job."""
+    job_dir = os.path.join(configuration.get_config_value('server', 'outputpath'), str(uuid))
+    try:
+        conn = connect(database)
+        with conn:
+            conn.execute("INSERT INTO outputs VALUES (?, ?, ?, ?)",
+                         (str(uuid), process, time.time(), cache.tree_size(job_dir)))
+        conn.close()
+    except sqlite3.Error:
+        LOGGER.exception("could not store the outputs of job %s", uuid)
+
+
+class StageRecorder(object):
+    """Record the resource usage of consecutive stages of a job.
+
+    :param process: identifier of the process.
+    :param uuid: uuid of the job.
+    """
+
+    def __init__(self, process, uuid=None):
+        self.process = process
+        self.uuid = str(uuid) if uuid else None
+        self.stages = []
+        self.current = None
+        self.before = None
+        self.peak_rss = None
+        self.remote = []
+
+    def start(self, name):
+        """Finish the current stage and start the stage ``name``."""
+        self.finish()
+        self.current = name
+        self.remote = []
+        self.before = snapshot()
+        self.peak_rss = PeakRSS()
+        self.peak_rss.start()
+        _active.recorder = self
+
+    def finish(self):
+        if self.current is None:
+            return
+        stage = usage(self.before, snapshot())
+        stage['max_rss'] = self.peak_rss.stop()
+        for remote_usage in self.remote:
+            stage['cpu_time'] += remote_usage['cpu_time']
+            stage['read_bytes'] += remote_usage['read_bytes']
+            stage['write_bytes'] += remote_usage['write_bytes']
+            stage['max_rss'] = max(stage['max_rss'], remote_usage['max_rss'])
+        stage.update(stage=self.current, started=self.before['wall_time'])
+        self.stages.append(stage)
+        self.current = None
+        _active.recorder = None
+
+    def save(self, database=None):
+        """Finish the current stage and write all stages of the job."""
+        self.finish()
+        LOGGER.info("stages of %s %s: %s", self.process, self.uuid, json.dumps(self.stages))
+        if self.uuid:
+            job_dir = os.path.join(configuration.get_config_value('server', 'outputpath'), self.uuid)
+            try:
+                if not os.path.isdir(job_dir):
+                    os.makedirs(job_dir)
+                with open(os.path.join(job_dir, 'stages.json'), 'w') as fp:
+                    json.dump(dict(process=self.process, uuid=self.uuid, stages=self.stages), fp, indent=2)
+            except (IOError, OSError):
+                LOGGER.exception("could not write stages of job %s", self.uuid)
+        try:
+            conn = connect(database)
+            with conn:
+                conn.executemany(
+                    "INSERT INTO stages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(self.uuid, self.process, stage['stage'], stage['started'], stage['wall_time'],
+                      stage['cpu_time'], stage['max_rss'], stage['read_bytes'], stage['write_bytes'])
+                     for stage in self.stages])
+            conn.close()
+        except sqlite3.Error:
+            LOGGER.exception("could not store stages of job %s", self.uuid)
@@ -0,0 +1,99 @@
+"""Manifest of the output tree of an ESMValTool run.
+
+The output tree is walked once with ``os.scandir`` and indexed by directory
+(``plots/<diagnostic>/<script>``) and file extension. All outputs requested
+by a process are then resolved against the manifest instead of globbing the
+file system again.
+"""
+
+import os
+import fnmatch
+import threading
+import collections
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# number of manifests kept in memory
+MAX_MANIFESTS = 32
+
+_manifests = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def scan(root):
+    """Yield ``(directory, filename)`` of all files below ``root``."""
+    stack = [root]
+    while stack:
+        path = stack.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            else:
+                yield path, entry.name
+
+
+def has_magic(pattern):
+    return any(char in pattern for char in '*?[')
+
+
+class OutputManifest(object):
+    """Index of all files below ``root``."""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        # {relative directory: {extension: [filename, ...]}}
+        self.index = collections.defaultdict(lambda: collections.defaultdict(list))
+        for path, name in scan(self.root):
+            ext = os.path.splitext(name)[1].lstrip('.')
+            self.index[os.path.relpath(path, self.root)][ext].append(name)
+
+    def find(self, output_dir, path_filter, name_filter='*', output_format='pdf'):
+        """Return all files matching the ``glob`` pattern
+        ``<output_dir>/<path_filter>/<name_filter>.<output_format>``.
+        """
+        dir_filter = os.path.normpath(
+            os.path.relpath(os.path.join(os.path.abspath(output_dir), path_filter), self.root))
+        pattern = '{0}.{1}'.format(name_filter, output_format)
+        matches = []
+        for directory in sorted(self.index):
+            # like glob a wildcard does not match the path separator
+            if directory.count(os.sep) != dir_filter.count(os.sep):
+                continue
+            if not fnmatch.fnmatchcase(directory, dir_filter):
+                continue
+            if has_magic(output_format):
+                names = [name for names in self.index[directory].values() for name in names]
+            else:
+                names = self.index[directory].get(output_format, [])
+            matches.extend(os.path.join(self.root, directory, name)
+                           for name in sorted(names) if fnmatch.fnmatchcase(name, pattern))
+        return matches
+
+
+def register(root):
+    """Build the manifest of ``root`` and keep it for later lookups."""
+    manifest = OutputManifest(root)
+    with _lock:
+        _manifests[manifest.root] = manifest
+        while len(_manifests) > MAX_MANIFESTS:
+            _manifests.popitem(last=False)
+    return manifest
+
+
+def get_manifest(output_dir):
+    """Return the manifest covering ``output_dir``, build it if there is none."""
+    path = os.path.abspath(output_dir)
+    with _lock:
+        while True:
+            if path in _manifests:
+                return _manifests[path]
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+    return register(output_dir)
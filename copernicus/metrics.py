@@ -0,0 +1,197 @@
+"""Operational metrics in the Prometheus text format.
+
+``/metrics`` exports
+
+* running and queued jobs per process (from the PyWPS database),
+* a histogram of the duration of finished jobs per process and status,
+* time and CPU time per handler stage and the bytes of the job outputs
+  (from the statistics database, see :mod:`copernicus.instrument`),
+* hits and misses of the result and preprocessor caches,
+* the resident memory of the ESMValTool pool workers and the server process.
+"""
+
+import datetime
+import threading
+
+import psutil
+
+from pywps import configuration, dblog
+from pywps.response.status import WPS_STATUS
+
+from copernicus import instrument
+from copernicus import scheduler
+from copernicus import workerpool
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# buckets of the job duration histogram in seconds
+DURATION_BUCKETS = [1, 10, 60, 300, 900, 1800, 3600, 7200, 21600, 86400]
+# jobs finishing this long before the last seen one are still counted
+SLACK = datetime.timedelta(minutes=10)
+COUNTERS = ['result_cache_hits', 'result_cache_misses', 'preproc_cache_hits', 'preproc_cache_misses']
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def sample(name, value, **labels):
+    if labels:
+        name = '{0}{{{1}}}'.format(name, ','.join(
+            '{0}="{1}"'.format(key, escape(labels[key])) for key in sorted(labels)))
+    return '{0} {1}'.format(name, repr(float(value)))
+
+
+class Metric(object):
+    """Lines of one metric family."""
+
+    def __init__(self, name, kind, help_text):
+        self.name = name
+        self.lines = ['# HELP {0} {1}'.format(name, help_text), '# TYPE {0} {1}'.format(name, kind)]
+
+    def add(self, value, suffix='', **labels):
+        self.lines.append(sample(self.name + suffix, value, **labels))
+
+
+class DurationHistogram(object):
+    """Histogram of the job durations, read incrementally from the PyWPS database."""
+
+    def __init__(self, buckets=None):
+        self.buckets = buckets or DURATION_BUCKETS
+        self.counts = {}
+        # finished jobs after the watermark - SLACK with their end time
+        self.seen = {}
+        self.watermark = None
+        self.lock = threading.Lock()
+
+    def update(self):
+        session = dblog.get_session()
+        try:
+            jobs = (session.query(dblog.ProcessInstance.uuid, dblog.ProcessInstance.identifier,
+                                  dblog.ProcessInstance.status, dblog.ProcessInstance.time_start,
+                                  dblog.ProcessInstance.time_end)
+                    .filter(dblog.ProcessInstance.operation == 'execute')
+                    .filter(dblog.ProcessInstance.percent_done >= 100))
+            with self.lock:
+                if self.watermark is not None:
+                    jobs = jobs.filter(dblog.ProcessInstance.time_end > self.watermark - SLACK)
+                for uuid, identifier, status, time_start, time_end in jobs:
+                    if uuid in self.seen or time_end is None:
+                        continue
+                    self.seen[uuid] = time_end
+                    self.watermark = max(self.watermark or time_end, time_end)
+                    self.observe(identifier, status, (time_end - time_start).total_seconds())
+                if self.watermark is not None:
+                    self.seen = dict((uuid, time_end) for uuid, time_end in self.seen.items()
+                                     if time_end > self.watermark - SLACK)
+        finally:
+            session.close()
+
+    def observe(self, identifier, status, duration):
+        status = 'succeeded' if status == WPS_STATUS.SUCCEEDED else 'failed'
+        counts = self.counts.setdefault((identifier, status), [0] * len(self.buckets) + [0, 0.0])
+        for i, bucket in enumerate(self.buckets):
+            if duration <= bucket:
+                counts[i] += 1
+        counts[-2] += 1
+        counts[-1] += duration
+
+    def metric(self):
+        metric = Metric('copernicus_job_duration_seconds', 'histogram', 'Duration of finished jobs.')
+        with self.lock:
+            for (identifier, status), counts in sorted(self.counts.items()):
+                for bucket, count in zip(self.buckets, counts):
+                    metric.add(count, '_bucket', process=identifier, status=status, le=bucket)
+                metric.add(counts[-2], '_bucket', process=identifier, status=status, le='+Inf')
+                metric.add(counts[-2], '_count', process=identifier, status=status)
+                metric.add(counts[-1], '_sum', process=identifier, status=status)
+        return metric
+
+
+def job_metrics():
+    queue, running = scheduler.get_queue()
+    queued = {}
+    for _, identifier, _ in queue:
+        queued[identifier] = queued.get(identifier, 0) + 1
+    running_metric = Metric('copernicus_jobs_running', 'gauge', 'Running jobs.')
+    for identifier, count in sorted(running.items()):
+        running_metric.add(count, process=identifier)
+    queued_metric = Metric('copernicus_jobs_queued', 'gauge', 'Jobs waiting in the queue.')
+    for identifier, count in sorted(queued.items()):
+        queued_metric.add(count, process=identifier)
+    return [running_metric, queued_metric]
+
+
+def stats_metrics(database=None):
+    """Metrics from the statistics database."""
+    wall = Metric('copernicus_stage_seconds', 'summary', 'Wall time of the handler stages.')
+    cpu = Metric('copernicus_stage_cpu_seconds', 'summary', 'CPU time of the handler stages.')
+    output = Metric('copernicus_output_bytes', 'counter', 'Bytes of the job outputs.')
+    jobs = Metric('copernicus_output_jobs', 'counter', 'Jobs with stored outputs.')
+    counters = Metric('copernicus_cache_lookups', 'counter', 'Lookups in the caches.')
+    conn = instrument.connect(database)
+    try:
+        for process, stage, count, wall_time, cpu_time in conn.execute(
+                "SELECT process, stage, COUNT(*), SUM(wall_time), SUM(cpu_time) "
+                "FROM stages GROUP BY process, stage ORDER BY process, stage"):
+            wall.add(count, '_count', process=process, stage=stage)
+            wall.add(wall_time, '_sum', process=process, stage=stage)
+            cpu.add(count, '_count', process=process, stage=stage)
+            cpu.add(cpu_time, '_sum', process=process, stage=stage)
+        for process, count, size in conn.execute(
+                "SELECT process, COUNT(*), SUM(bytes) FROM outputs GROUP BY process ORDER BY process"):
+            output.add(size, '_total', process=process)
+            jobs.add(count, '_total', process=process)
+        values = dict(conn.execute("SELECT name, value FROM counters"))
+    finally:
+        conn.close()
+    for name in COUNTERS:
+        cache_name, _, result = name.rpartition('_')
+        counters.add(values.get(name, 0), '_total', cache=cache_name.replace('_cache', ''),
+                     result='hit' if result == 'hits' else 'miss')
+    return [wall, cpu, output, jobs, counters]
+
+
+def memory_metrics():
+    metric = Metric('copernicus_memory_bytes', 'gauge', 'Resident memory of the server and pool workers.')
+    metric.add(psutil.Process().memory_info().rss, kind='server')
+    pool = workerpool.get_pool()
+    for pid in pool.worker_pids() if pool else []:
+        try:
+            metric.add(psutil.Process(pid).memory_info().rss, kind='esmvaltool_worker', pid=pid)
+        except psutil.Error:
+            pass
+    return [metric]
+
+
+class MetricsApp(object):
+    """WSGI middleware answering ``/metrics`` and passing all other requests on."""
+
+    def __init__(self, application, path='/metrics'):
+        self.application = application
+        self.path = path
+        self.durations = DurationHistogram()
+
+    def __getattr__(self, name):
+        # like processes of the wrapped service
+        return getattr(self.application, name)
+
+    def render(self):
+        metrics = []
+        for collect in [job_metrics, self.durations.update, stats_metrics, memory_metrics]:
+            try:
+                metrics.extend(collect() or [])
+            except Exception:
+                LOGGER.exception("could not collect metrics of %s", collect.__name__)
+        metrics.append(self.durations.metric())
+        return '\n'.join(line for metric in metrics for line in metric.lines) + '\n'
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self.path or configuration.get_config_value(
+                'copernicus', 'metrics') is False:
+            return self.application(environ, start_response)
+        body = self.render().encode('utf-8')
+        start_response('200 OK', [('Content-Type', CONTENT_TYPE), ('Content-Length', str(len(body)))])
+        return [body]
@@ -0,0 +1,412 @@
+"""Modes of variability of a model compared to observations (Fučkar et al. 2016).
+
+The anomalies of a variable in a region are classified into ``k`` clusters
+for the model and for the observations. The model clusters are matched to
+the observed ones and compared by the RMSE of their patterns and the bias of
+their frequency of occurrence and persistence.
+
+The pipeline works on time chunks, so multi-decade daily fields only need
+memory for a chunk and a few arrays of the size of the grid:
+
+1. The seasonal cycle and a polynomial trend of order ``detrend`` are fitted
+   per grid point with normal equations accumulated in one pass over the
+   data, which is copied to a single precision memory map in the work
+   directory. A second pass replaces the data by the anomalies.
+2. EOFs are computed with a randomized truncated SVD (Halko et al. 2011),
+   which only needs products of the anomalies with thin matrices.
+3. k-means clusters the principal components, or the anomalies themselves,
+   with restarts running in parallel processes. Distances of a chunk to all
+   centres are one matrix product.
+4. The patterns of the clusters are the composites of their anomalies.
+"""
+
+import os
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from copernicus import ncdata
+from copernicus import runner
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# regions as (lon_min, lon_max, lat_min, lat_max)
+REGIONS = {
+    'Arctic': (0, 360, 60, 90),
+    'North-Atlantic': (-80, 40, 20, 85),
+}
+# mip and reference observations of the variables
+VARIABLES = {
+    'sic': dict(mip='OImon', monthly=True,
+                reference=dict(project='OBS', dataset='HadISST', tier=2, type='reanaly', version=1)),
+    'psl': dict(mip='day', monthly=False,
+                reference=dict(project='OBS', dataset='ERA-Interim', tier=3, type='reanaly', version=1)),
+}
+# bytes of the anomalies read at once
+CHUNK_BYTES = 16 * 1024 ** 2
+MAX_EOFS = 30
+OVERSAMPLING = 10
+POWER_ITERATIONS = 2
+# EOFs are kept until they explain this fraction of the variance
+EXPLAINED_VARIANCE = 0.8
+RESTARTS = 8
+MAX_ITERATIONS = 100
+MAX_CENTERS = 8
+
+
+def chunk_steps(points):
+    return max(1, CHUNK_BYTES // (points * 8))
+
+
+class Anomalies(object):
+    """Anomalies of ``steps`` time steps and ``points`` grid points in a
+    memory map, with the area weights applied when they are read.
+    """
+
+    def __init__(self, path, steps, points, weights):
+        self.path = path
+        self.steps = steps
+        self.points = points
+        self.weights = weights
+        # grid points without missing values
+        self.valid = None
+
+    @property
+    def shape(self):
+        return self.steps, self.points
+
+    def array(self, mode='r'):
+        return np.memmap(self.path, dtype=np.float32, mode=mode, shape=self.shape)
+
+    def chunks(self, steps=None):
+        """Yield ``(start, weighted anomalies)`` of the time chunks."""
+        data = self.array()
+        steps = steps or chunk_steps(self.points)
+        for start in range(0, self.steps, steps):
+            block = data[start:start + steps].astype(np.float64)
+            block *= self.weights
+            yield start, block
+
+    def rows(self, index):
+        return self.array()[np.sort(index)].astype(np.float64) * self.weights
+
+
+def season_index(dates, monthly):
+    """Return the index of the month or day of the year (0-364) of the dates."""
+    if monthly:
+        return np.array([date.month - 1 for date in dates])
+    return np.array([min(date.timetuple().tm_yday, 365) - 1 for date in dates])
+
+
+def design(season, scaled_time, seasons, detrend):
+    """Return the design matrix of the seasonal cycle and the trend."""
+    columns = [np.eye(seasons)[season]]
+    columns.extend(scaled_time[:, None] ** order for order in range(1, detrend + 1))
+    return np.hstack(columns)
+
+
+def compute_anomalies(field, path, monthly, detrend=0):
+    """Write the anomalies of a field to the memory map ``path``.
+
+    Grid points with missing values are set to zero.
+
+    :returns: :class:`Anomalies`.
+    """
+    netCDF4 = ncdata.netcdf4()
+    steps, shape = len(field), (len(field.lat), len(field.lon))
+    points = shape[0] * shape[1]
+    seasons = 12 if monthly else 365
+    weights = np.repeat(np.sqrt(np.maximum(np.cos(np.radians(field.lat)), 0)), shape[1])
+    anomalies = Anomalies(path, steps, points, weights)
+    data = anomalies.array('w+')
+    xtx = np.zeros((seasons + detrend, seasons + detrend))
+    xta = np.zeros((seasons + detrend, points))
+    valid = np.ones(points, dtype=bool)
+    seasons_index = []
+    start = 0
+    for times, values in field.chunks(chunk_steps(points)):
+        values = values.reshape(len(times), points)
+        finite = np.isfinite(values)
+        valid &= finite.all(axis=0)
+        values[~finite] = 0
+        season = season_index(netCDF4.num2date(times, field.time_units, field.calendar), monthly)
+        scaled_time = 2.0 * (start + np.arange(len(times))) / max(steps - 1, 1) - 1
+        x = design(season, scaled_time, seasons, detrend)
+        xtx += x.T @ x
+        xta += x.T @ values
+        data[start:start + len(times)] = values
+        seasons_index.append(season)
+        start += len(times)
+    coefficients = np.linalg.pinv(xtx) @ xta
+    coefficients[:, ~valid] = 0
+    season = np.concatenate(seasons_index)
+    for start in range(0, steps, chunk_steps(points)):
+        end = min(start + chunk_steps(points), steps)
+        scaled_time = 2.0 * np.arange(start, end) / max(steps - 1, 1) - 1
+        x = design(season[start:end], scaled_time, seasons, detrend)
+        block = data[start:end].astype(np.float64)
+        block -= x @ coefficients
+        block[:, ~valid] = 0
+        data[start:end] = block
+    data.flush()
+    anomalies.valid = valid
+    return anomalies
+
+
+def orthonormal(matrix):
+    return np.linalg.qr(matrix)[0]
+
+
+def left_product(anomalies, matrix):
+    """Return ``A @ matrix`` of the anomalies ``A``."""
+    result = np.empty((anomalies.steps, matrix.shape[1]))
+    for start, block in anomalies.chunks():
+        result[start:start + len(block)] = block @ matrix
+    return result
+
+
+def right_product(anomalies, matrix):
+    """Return ``A.T @ matrix`` of the anomalies ``A``."""
+    result = np.zeros((anomalies.points, matrix.shape[1]))
+    for start, block in anomalies.chunks():
+        result += block.T @ matrix[start:start + len(block)]
+    return result
+
+
+def randomized_svd(anomalies, rank, rng, oversampling=OVERSAMPLING, power_iterations=POWER_ITERATIONS):
+    """Return the truncated SVD ``u, s, vt`` of rank ``rank`` of the anomalies."""
+    size = min(rank + oversampling, anomalies.steps, anomalies.points)
+    y = left_product(anomalies, rng.standard_normal((anomalies.points, size)))
+    for _ in range(power_iterations):
+        z = orthonormal(right_product(anomalies, orthonormal(y)))
+        y = left_product(anomalies, z)
+    q = orthonormal(y)
+    u, s, vt = np.linalg.svd(right_product(anomalies, q).T, full_matrices=False)
+    rank = min(rank, size)
+    return (q @ u)[:, :rank], s[:rank], vt[:rank]
+
+
+def principal_components(anomalies, rng, max_eofs=MAX_EOFS, explained=EXPLAINED_VARIANCE):
+    """Return the principal components of the leading EOFs explaining ``explained`` of the variance."""
+    total = sum(np.einsum('ij,ij->', block, block) for _, block in anomalies.chunks())
+    u, s, _ = randomized_svd(anomalies, max_eofs, rng)
+    if total == 0:
+        return u[:, :1] * 0
+    fraction = np.cumsum(s ** 2) / total
+    neofs = min(int(np.searchsorted(fraction, explained)) + 1, len(s))
+    LOGGER.debug("%s EOFs explain %.0f%% of the variance", neofs, 100 * fraction[neofs - 1])
+    return u[:, :neofs] * s[:neofs]
+
+
+def data_chunks(data):
+    if isinstance(data, Anomalies):
+        for chunk in data.chunks():
+            yield chunk
+    else:
+        yield 0, data
+
+
+def initial_centers(data, k, rng, sample_size=5000):
+    """k-means++ seeding on a sample of the time steps, at most a chunk of them."""
+    sample_size = min(sample_size, data.shape[0], chunk_steps(data.shape[1]))
+    index = rng.choice(data.shape[0], min(max(sample_size, k), data.shape[0]), replace=False)
+    sample = data.rows(index) if isinstance(data, Anomalies) else data[index]
+    centers = [sample[rng.integers(len(sample))]]
+    distances = ((sample - centers[0]) ** 2).sum(axis=1)
+    for _ in range(1, k):
+        total = distances.sum()
+        choice = rng.choice(len(sample), p=distances / total) if total > 0 else rng.integers(len(sample))
+        centers.append(sample[choice])
+        distances = np.minimum(distances, ((sample - centers[-1]) ** 2).sum(axis=1))
+    return np.array(centers)
+
+
+def assign(data, centers):
+    """Return the labels of the nearest centres, the sums of the clusters and the inertia."""
+    labels = np.empty(data.shape[0], dtype=int)
+    sums = np.zeros_like(centers)
+    inertia = 0.0
+    center_norms = (centers ** 2).sum(axis=1)
+    for start, block in data_chunks(data):
+        distances = center_norms - 2 * block @ centers.T
+        chunk_labels = distances.argmin(axis=1)
+        labels[start:start + len(block)] = chunk_labels
+        inertia += (distances[np.arange(len(block)), chunk_labels] + np.einsum('ij,ij->i', block, block)).sum()
+        sums += np.eye(len(centers))[chunk_labels].T @ block
+    return labels, sums, inertia
+
+
+def kmeans(data, k, seed, max_iterations=MAX_ITERATIONS):
+    """Lloyd's k-means from one k-means++ seeding.
+
+    :param data: an array of time steps or :class:`Anomalies`.
+    :returns: ``(inertia, centers, labels)``.
+    """
+    rng = np.random.default_rng(seed)
+    centers = initial_centers(data, k, rng)
+    labels = None
+    for _ in range(max_iterations):
+        new_labels, sums, inertia = assign(data, centers)
+        if labels is not None and (new_labels == labels).all():
+            break
+        labels = new_labels
+        counts = np.bincount(labels, minlength=k)
+        # an empty cluster keeps its centre
+        filled = counts > 0
+        centers[filled] = sums[filled] / counts[filled, None]
+    return inertia, centers, new_labels
+
+
+def cluster(data, k, restarts=RESTARTS, seed=None, workers=None):
+    """Return the labels of the best of ``restarts`` k-means runs."""
+    seeds = np.random.SeedSequence(seed).spawn(restarts)
+    workers = min(restarts, workers or runner.max_workers('rmse'))
+    if workers == 1:
+        results = [kmeans(data, k, restart_seed) for restart_seed in seeds]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            results = list(executor.map(kmeans, [data] * restarts, [k] * restarts, seeds))
+    inertia, _, labels = min(results, key=lambda result: result[0])
+    LOGGER.debug("k-means: inertia %s of %s restarts", inertia, restarts)
+    return labels
+
+
+def composites(anomalies, labels, k):
+    """Return the mean anomalies (without area weights) of the clusters."""
+    sums = np.zeros((k, anomalies.points))
+    data = anomalies.array()
+    for start in range(0, anomalies.steps, chunk_steps(anomalies.points)):
+        block = data[start:start + chunk_steps(anomalies.points)].astype(np.float64)
+        sums += np.eye(k)[labels[start:start + len(block)]].T @ block
+    counts = np.bincount(labels, minlength=k)
+    return sums / np.maximum(counts, 1)[:, None]
+
+
+def frequency(labels, k):
+    """Return the percentage of the time steps in each cluster."""
+    return 100.0 * np.bincount(labels, minlength=k) / len(labels)
+
+
+def persistence(labels, k):
+    """Return the mean number of consecutive time steps in each cluster."""
+    starts = np.concatenate([[True], labels[1:] != labels[:-1]])
+    runs = np.bincount(labels[starts], minlength=k)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.bincount(labels, minlength=k) / runs
+
+
+def axis_weights(values, new_values):
+    order = np.argsort(values)
+    position = np.interp(new_values, values[order], np.arange(len(values)))
+    lower = np.minimum(position.astype(int), max(len(values) - 2, 0))
+    upper = np.minimum(lower + 1, len(values) - 1)
+    return order[lower], order[upper], position - lower
+
+
+def regrid(patterns, lat, lon, new_lat, new_lon):
+    """Bilinear interpolation of ``(k, lat, lon)`` patterns to another grid."""
+    lower, upper, weight = axis_weights(lat, new_lat)
+    patterns = patterns[:, lower] * (1 - weight)[:, None] + patterns[:, upper] * weight[:, None]
+    lower, upper, weight = axis_weights(lon, new_lon)
+    return patterns[:, :, lower] * (1 - weight) + patterns[:, :, upper] * weight
+
+
+def match(model, reference, weights):
+    """Return the order of the model clusters which best matches the reference clusters."""
+    k = len(reference)
+    errors = np.array([[np.sqrt((weights * (m - r) ** 2).sum() / weights.sum()) for r in reference] for m in model])
+    return min(itertools.permutations(range(k)), key=lambda order: errors[list(order), range(k)].sum())
+
+
+class Modes(object):
+    """The clusters of the anomalies of a field."""
+
+    def __init__(self, field, workdir, name, k, monthly, detrend=0, eofs=False, seed=None, workers=None):
+        rng = np.random.default_rng(seed)
+        self.lat, self.lon = field.lat, field.lon
+        anomalies = compute_anomalies(field, os.path.join(workdir, '{0}_anomalies.dat'.format(name)),
+                                      monthly, detrend)
+        data = principal_components(anomalies, rng) if eofs else anomalies
+        self.labels = cluster(data, k, seed=rng.integers(2 ** 32), workers=workers)
+        shape = (k, len(self.lat), len(self.lon))
+        self.patterns = composites(anomalies, self.labels, k).reshape(shape)
+        self.valid = anomalies.valid.reshape(shape[1:])
+        self.frequency = frequency(self.labels, k)
+        self.persistence = persistence(self.labels, k)
+        os.remove(anomalies.path)
+
+
+def compare(model, reference):
+    """Order the model clusters like the matching reference clusters.
+
+    :returns: dict of the RMSE of the patterns and the frequency and
+              persistence bias in percent of each cluster.
+    """
+    patterns = regrid(model.patterns, model.lat, model.lon, reference.lat, reference.lon)
+    valid = reference.valid & (regrid(model.valid[None].astype(float), model.lat, model.lon,
+                                      reference.lat, reference.lon)[0] > 0.999)
+    weights = np.cos(np.radians(reference.lat))[:, None] * valid
+    order = list(match(patterns, reference.patterns, weights))
+    patterns = patterns[order]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return {
+            'order': order,
+            'patterns': patterns,
+            'rmse': np.sqrt((weights * (patterns - reference.patterns) ** 2).sum(axis=(1, 2)) / weights.sum()),
+            'frequency_bias': 100.0 * (model.frequency[order] - reference.frequency) / reference.frequency,
+            'persistence_bias': 100.0 * (model.persistence[order] - reference.persistence) / reference.persistence,
+        }
+
+
+def write_results(path, model, reference, result, short_name, units=None, seed=None):
+    """Write the patterns and the statistics of the clusters to NetCDF,
+    with the seed of the clustering.
+    """
+    netCDF4 = ncdata.netcdf4()
+    with netCDF4.Dataset(path, 'w') as ds:
+        if seed is not None:
+            ds.seed = seed
+        ds.createDimension('cluster', len(reference.patterns))
+        ds.createDimension('lat', len(reference.lat))
+        ds.createDimension('lon', len(reference.lon))
+        ds.createVariable('cluster', 'i4', ('cluster',))[:] = np.arange(1, len(reference.patterns) + 1)
+        for name, values, units_ in [('lat', reference.lat, 'degrees_north'), ('lon', reference.lon, 'degrees_east')]:
+            variable = ds.createVariable(name, 'f8', (name,))
+            variable.units = units_
+            variable[:] = values
+        for name, values in [('model_pattern', result['patterns']), ('reference_pattern', reference.patterns)]:
+            variable = ds.createVariable(name, 'f4', ('cluster', 'lat', 'lon'))
+            variable.long_name = '{0} anomaly of the cluster'.format(short_name)
+            if units:
+                variable.units = units
+            variable[:] = values
+        variables = [
+            ('rmse', result['rmse'], units, 'RMSE of the model pattern'),
+            ('model_frequency', model.frequency[result['order']], '%', 'frequency of occurrence'),
+            ('reference_frequency', reference.frequency, '%', 'frequency of occurrence'),
+            ('frequency_bias', result['frequency_bias'], '%', 'relative bias of the frequency'),
+            ('model_persistence', model.persistence[result['order']], 'time steps', 'mean persistence'),
+            ('reference_persistence', reference.persistence, 'time steps', 'mean persistence'),
+            ('persistence_bias', result['persistence_bias'], '%', 'relative bias of the persistence'),
+        ]
+        for name, values, units_, long_name in variables:
+            variable = ds.createVariable(name, 'f8', ('cluster',))
+            variable.long_name = long_name
+            if units_:
+                variable.units = units_
+            variable[:] = values
+
+
+def write_table(path, model, reference, result):
+    """Write the statistics of the clusters as CSV."""
+    with open(path, 'w') as fp:
+        fp.write('cluster,rmse,model_frequency,reference_frequency,frequency_bias,'
+                 'model_persistence,reference_persistence,persistence_bias\n')
+        for i in range(len(reference.patterns)):
+            fp.write('{0},{1:.6g},{2:.2f},{3:.2f},{4:.2f},{5:.3f},{6:.3f},{7:.2f}\n'.format(
+                i + 1, result['rmse'][i], model.frequency[result['order'][i]], reference.frequency[i],
+                result['frequency_bias'][i], model.persistence[result['order'][i]], reference.persistence[i],
+                result['persistence_bias'][i]))
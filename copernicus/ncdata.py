@@ -0,0 +1,210 @@
+"""Model data of the archive for the native diagnostic engines.
+
+Files are found in the BADC DRS below ``archive_root`` like ESMValTool finds
+them. A variable is read in time chunks of a lat/lon box, so fields of many
+years are never held in memory at once, and results are written to NetCDF
+in time chunks as well.
+"""
+
+import os
+import glob
+
+import numpy as np
+
+from pywps import configuration
+
+from copernicus import cache
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# time steps read at once
+CHUNK_STEPS = 365
+
+
+def netcdf4():
+    try:
+        import netCDF4
+    except ImportError:
+        raise Exception("netCDF4 is not installed: conda install netcdf4")
+    return netCDF4
+
+
+def find_files(dataset, exp, ensemble, mip, short_name, root=None):
+    """Return the CMIP5 files of a variable in the archive."""
+    root = root or configuration.get_config_value('data', 'archive_root')
+    pattern = cache.CMIP5_BADC_PATTERN.format(
+        dataset=dataset, exp=exp, ensemble=ensemble, mip=mip, short_name=short_name)
+    return sorted(glob.glob(os.path.join(root, pattern)))
+
+
+def parse_bbox(value):
+    """Return ``(lon_min, lon_max, lat_min, lat_max)`` of a bounding box like ``4,13,44,53``."""
+    try:
+        bbox = [float(part) for part in value.split(',')]
+    except ValueError:
+        bbox = []
+    if len(bbox) != 4 or bbox[2] > bbox[3]:
+        raise Exception("Invalid bounding box {0}, expected lon_min,lon_max,lat_min,lat_max.".format(value))
+    return tuple(bbox)
+
+
+def box_indices(lat, lon, bbox):
+    """Return the indices of the latitudes and longitudes in a bounding box.
+
+    Longitudes are ordered eastwards from ``lon_min``, across the date line
+    if the box spans it.
+    """
+    lon_min, lon_max, lat_min, lat_max = bbox
+    lat_index = np.nonzero((lat >= lat_min) & (lat <= lat_max))[0]
+    offset = (lon - lon_min) % 360
+    width = 360 if lon_max - lon_min >= 360 else (lon_max - lon_min) % 360
+    lon_index = np.nonzero(offset <= width)[0]
+    lon_index = lon_index[np.argsort(offset[lon_index], kind='stable')]
+    if lat_index.size == 0 or lon_index.size == 0:
+        raise Exception("The bounding box {0} contains no grid cells.".format(','.join(str(v) for v in bbox)))
+    return lat_index, lon_index
+
+
+def index_or_slice(index):
+    """Return a slice for increasing consecutive indices, else the indices."""
+    if len(index) and (np.diff(index) == 1).all():
+        return slice(int(index[0]), int(index[-1]) + 1)
+    return index
+
+
+class Field(object):
+    """A variable of a list of files in a lat/lon box and a range of years.
+
+    :param files: files of the variable, in time order.
+    :param bbox: ``(lon_min, lon_max, lat_min, lat_max)`` or None for the whole grid.
+    """
+
+    def __init__(self, files, short_name, start_year, end_year, bbox=None, fill_value=np.nan):
+        netCDF4 = netcdf4()
+        self.short_name = short_name
+        self.fill_value = fill_value
+        # list of (filename, time indexes, times)
+        self.parts = []
+        with netCDF4.Dataset(files[0]) as ds:
+            time = ds.variables['time']
+            self.time_units = time.units
+            self.calendar = getattr(time, 'calendar', 'standard')
+            lat = ds.variables['lat'][:]
+            lon = ds.variables['lon'][:]
+            if lat.ndim != 1 or lon.ndim != 1:
+                raise Exception("{0} is not on a regular lat/lon grid.".format(os.path.basename(files[0])))
+            if bbox is None:
+                self.lat_index, self.lon_index = np.arange(lat.size), np.arange(lon.size)
+            else:
+                self.lat_index, self.lon_index = box_indices(lat, lon, bbox)
+            self.lat = np.asarray(lat[self.lat_index])
+            self.lon = np.asarray(lon[self.lon_index])
+            # increasing across the date line
+            self.lon = self.lon[0] + (self.lon - self.lon[0]) % 360
+            self.attributes = dict((name, ds.variables[short_name].getncattr(name))
+                                   for name in ['standard_name', 'long_name', 'units']
+                                   if name in ds.variables[short_name].ncattrs())
+        for filename in files:
+            with netCDF4.Dataset(filename) as ds:
+                time = ds.variables['time']
+                dates = netCDF4.num2date(time[:], time.units, getattr(time, 'calendar', 'standard'))
+                years = np.array([date.year for date in dates])
+                index = np.nonzero((years >= int(start_year)) & (years <= int(end_year)))[0]
+                if index.size:
+                    times = netCDF4.date2num(dates[index], self.time_units, self.calendar)
+                    self.parts.append((filename, index, np.asarray(times)))
+        if not self.parts:
+            raise Exception("No {0} data for {1}-{2}.".format(short_name, start_year, end_year))
+
+    def __len__(self):
+        return sum(len(index) for _, index, _ in self.parts)
+
+    def chunks(self, steps=CHUNK_STEPS):
+        """Yield ``(times, data)`` of at most ``steps`` time steps.
+
+        Masked values are replaced by ``fill_value``.
+        """
+        netCDF4 = netcdf4()
+        lat_order = np.argsort(self.lat_index)
+        lon_order = np.argsort(self.lon_index)
+        # netCDF4 wants increasing indices, and reads slices much faster than index arrays
+        lat_read, lon_read = index_or_slice(self.lat_index[lat_order]), index_or_slice(self.lon_index[lon_order])
+        for filename, index, times in self.parts:
+            with netCDF4.Dataset(filename) as ds:
+                variable = ds.variables[self.short_name]
+                variable.set_auto_mask(True)
+                for start in range(0, len(index), steps):
+                    step_index = index[start:start + steps]
+                    # read a contiguous time slab
+                    data = variable[step_index[0]:step_index[-1] + 1, lat_read, lon_read]
+                    if step_index[-1] - step_index[0] + 1 != len(step_index):
+                        data = data[step_index - step_index[0]]
+                    data = np.ma.filled(data, self.fill_value)
+                    if (np.diff(lat_order) < 0).any():
+                        data = data[:, np.argsort(lat_order)]
+                    if (np.diff(lon_order) < 0).any():
+                        data = data[:, :, np.argsort(lon_order)]
+                    yield times[start:start + steps], data
+
+    def read(self):
+        """Return the times and data of all time steps."""
+        chunks = list(self.chunks())
+        return np.concatenate([times for times, _ in chunks]), np.concatenate([data for _, data in chunks])
+
+
+def write_map(path, short_name, values, lat, lon, attributes=None):
+    """Write a lat/lon map to a NetCDF file."""
+    netCDF4 = netcdf4()
+    with netCDF4.Dataset(path, 'w', format='NETCDF4') as ds:
+        ds.createDimension('lat', len(lat))
+        ds.createDimension('lon', len(lon))
+        for name, coordinate, units in [('lat', lat, 'degrees_north'), ('lon', lon, 'degrees_east')]:
+            variable = ds.createVariable(name, 'f8', (name,))
+            variable.setncatts({'standard_name': {'lat': 'latitude', 'lon': 'longitude'}[name], 'units': units})
+            variable[:] = coordinate
+        variable = ds.createVariable(short_name, 'f4', ('lat', 'lon'))
+        variable.setncatts(attributes or {})
+        variable[:] = values
+
+
+class FieldWriter(object):
+    """Write a lat/lon field to a NetCDF file, a chunk of time steps at a time.
+
+    Compression with ``zlib`` takes about three times as long as the
+    computation of fine stochastic fields and saves a fifth of their size.
+    """
+
+    def __init__(self, path, short_name, lat, lon, time_units, calendar, attributes=None,
+                 global_attributes=None, zlib=False):
+        netCDF4 = netcdf4()
+        self.ds = netCDF4.Dataset(path, 'w', format='NETCDF4')
+        self.ds.createDimension('time', None)
+        self.ds.createDimension('lat', len(lat))
+        self.ds.createDimension('lon', len(lon))
+        time = self.ds.createVariable('time', 'f8', ('time',))
+        time.setncatts({'standard_name': 'time', 'units': time_units, 'calendar': calendar})
+        for name, values, units in [('lat', lat, 'degrees_north'), ('lon', lon, 'degrees_east')]:
+            variable = self.ds.createVariable(name, 'f8', (name,))
+            variable.setncatts({'standard_name': {'lat': 'latitude', 'lon': 'longitude'}[name], 'units': units})
+            variable[:] = values
+        self.variable = self.ds.createVariable(
+            short_name, 'f4', ('time', 'lat', 'lon'), zlib=zlib, complevel=1,
+            chunksizes=(1, len(lat), len(lon)))
+        self.variable.setncatts(attributes or {})
+        self.ds.setncatts(global_attributes or {})
+        self.steps = 0
+
+    def write(self, times, data):
+        self.ds.variables['time'][self.steps:self.steps + len(times)] = times
+        self.variable[self.steps:self.steps + len(times)] = data
+        self.steps += len(times)
+
+    def close(self):
+        self.ds.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
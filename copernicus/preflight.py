@@ -0,0 +1,167 @@
+"""Pre-flight check of the input data of a rendered recipe.
+
+Every dataset entry of the recipe is resolved to its files for every
+variable of the diagnostics, like ESMValTool will look them up (BADC DRS for
+CMIP5, ``Tier<tier>/<dataset>`` for OBS). The file names are read with the
+parsers of :mod:`copernicus.catalogue`. A request whose files are missing
+or do not cover the years of the entry is rejected before ESMValTool starts.
+
+The resolved files are written to ``input_files.json`` next to the recipe.
+:func:`copernicus.runner.run` uses them for the result cache key and the
+ESMValTool run reads them from a tree of links in ``input_data``, instead of
+searching the data roots again.
+"""
+
+import os
+import glob
+import json
+
+from copernicus import cache
+from copernicus import catalogue
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+INPUT_FILES = 'input_files.json'
+# links to the input files of the run, next to the recipe
+INPUT_DIR = 'input_data'
+
+# input files of a dataset entry below the root of its project
+FILE_PATTERNS = {
+    'CMIP5': os.path.join('*', '{dataset}', '{exp}', '*', '*', '{mip}', '{ensemble}', 'latest', '{short_name}', '*.nc'),
+    'OBS': cache.OBS_PATTERN,
+}
+
+# mip of the legacy field types of the variables
+FIELD_MIPS = {'T2Ms': 'Amon', 'T2Mz': 'Amon', 'T3M': 'Amon', 'T2Ds': 'day', 'T3D': 'day', 'T2Dz': 'day'}
+
+
+def variable_datasets(recipe):
+    """Yield ``(short_name, variable, dataset)`` of all dataset entries of the variables."""
+    for diag in (recipe.get('diagnostics') or {}).values():
+        diag_datasets = list(recipe.get('datasets') or []) + list(diag.get('additional_datasets') or [])
+        for short_name, variable in (diag.get('variables') or {}).items():
+            variable = variable or {}
+            for dataset in diag_datasets + list(variable.get('additional_datasets') or []):
+                yield short_name, variable, dataset
+
+
+def project_root(project, rootpath):
+    if project == 'OBS':
+        return rootpath.get('OBS') or rootpath.get('default')
+    return rootpath.get(project)
+
+
+def find_records(dataset, short_name, mip, rootpath):
+    """Return ``(filename, start_year, end_year)`` of the files of a dataset
+    entry or None when its layout is unknown.
+    """
+    project = dataset.get('project')
+    root = project_root(project, rootpath)
+    if project not in FILE_PATTERNS or not root:
+        # left to ESMValTool
+        return None
+    try:
+        pattern = FILE_PATTERNS[project].format(**dict(dataset, short_name=short_name, mip=mip))
+    except KeyError:
+        return None
+    records = []
+    for filename in sorted(glob.glob(os.path.join(root, pattern))):
+        parts = os.path.relpath(os.path.dirname(filename), root).split(os.sep)
+        record = catalogue.Catalogue.PARSERS[project](parts, os.path.basename(filename))
+        if record and record[1] == dataset['dataset'] and record[4] == mip and record[6] == short_name:
+            records.append((filename, record[7], record[8]))
+    return records
+
+
+def find_files(dataset, short_name, mip, rootpath):
+    """Return the files of a dataset entry or None when its layout is unknown."""
+    records = find_records(dataset, short_name, mip, rootpath)
+    return None if records is None else [filename for filename, _, _ in records]
+
+
+def resolve(recipe, config):
+    """Return the input files of a recipe, the problems found and the
+    projects whose dataset entries were all resolved.
+
+    :param recipe: the rendered recipe.
+    :param config: the rendered ``config.yml``.
+    """
+    rootpath = config.get('rootpath') or {}
+    files = set()
+    problems = []
+    projects = set()
+    unresolved = set()
+    for short_name, variable, dataset in variable_datasets(recipe):
+        mip = dataset.get('mip') or variable.get('mip') or FIELD_MIPS.get(variable.get('field'))
+        records = find_records(dataset, short_name, mip, rootpath)
+        if records is None:
+            unresolved.add(dataset.get('project'))
+            continue
+        projects.add(dataset['project'])
+        name = ' '.join(str(dataset[key]) for key in ['project', 'dataset', 'exp', 'ensemble'] if key in dataset)
+        name = '{0} {1} {2}'.format(name, mip, short_name)
+        start_year, end_year = int(dataset['start_year']), int(dataset['end_year'])
+        problem = catalogue.coverage_problem(
+            name, catalogue.merge([(start, end) for _, start, end in records]), start_year, end_year)
+        if problem:
+            problems.append(problem)
+        else:
+            files.update(filename for filename, start, end in records
+                         if start is None or (start <= end_year and end >= start_year))
+    return sorted(files), problems, sorted(projects - unresolved)
+
+
+def check(recipe_file, config_file):
+    """Resolve the input files of a recipe, raise an exception when data is missing.
+
+    Returns the files, which are also written to ``input_files.json``.
+    """
+    files, problems, projects = resolve(cache.read_yaml(recipe_file), cache.read_yaml(config_file))
+    if problems:
+        raise Exception('Input data is not available: {0}.'.format('; '.join(problems)))
+    with open(os.path.join(os.path.dirname(recipe_file), INPUT_FILES), 'w') as fp:
+        json.dump(dict(files=files, projects=projects), fp)
+    LOGGER.debug("resolved %s input files of %s", len(files), recipe_file)
+    return files
+
+
+def read_resolved(recipe_file):
+    try:
+        with open(os.path.join(os.path.dirname(recipe_file), INPUT_FILES)) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def cached_files(recipe_file):
+    """Return the input files resolved by :func:`check` or None."""
+    resolved = read_resolved(recipe_file)
+    return resolved['files'] if resolved else None
+
+
+def link_inputs(recipe_file, rootpath):
+    """Link the input files resolved by :func:`check` below ``input_data``.
+
+    Returns the ``rootpath`` of ESMValTool with the roots of the resolved
+    projects replaced by the trees of links, or ``rootpath`` when the
+    recipe was not checked.
+    """
+    resolved = read_resolved(recipe_file)
+    if not resolved:
+        return rootpath
+    rootpath = dict(rootpath)
+    for project in resolved['projects']:
+        root = project_root(project, rootpath)
+        input_dir = os.path.join(os.path.dirname(recipe_file), INPUT_DIR, project)
+        for filename in resolved['files']:
+            relpath = os.path.relpath(filename, root)
+            if relpath.startswith(os.pardir):
+                continue
+            link = os.path.join(input_dir, relpath)
+            if not os.path.isdir(os.path.dirname(link)):
+                os.makedirs(os.path.dirname(link))
+            if not os.path.lexists(link):
+                os.symlink(os.path.abspath(filename), link)
+        rootpath[project] = input_dir
+    return rootpath
@@ -0,0 +1,147 @@
+"""Persistent store of preprocessed ESMValTool cubes shared by all recipes.
+
+Every output file of an ESMValTool preprocessing task is stored by a key of
+the dataset facets (dataset, project, mip, exp, ensemble, years, variable),
+the preprocessor settings and the input file fingerprints. When all outputs
+of a preprocessing task are in the store they are restored into the preproc
+dir of the run and the task is skipped. This works across recipes and
+parameter variations of a diagnostic which share a dataset/preprocessor.
+"""
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+import tempfile
+
+from pywps import configuration
+
+from copernicus import cache
+from copernicus import instrument
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+FACETS = ['dataset', 'project', 'mip', 'exp', 'ensemble', 'start_year', 'end_year', 'short_name', 'field']
+# preprocessor steps with run specific paths or callbacks which do not change the result
+IGNORED_STEPS = ['load', 'save', 'cleanup', 'fix_file']
+
+
+def get_store():
+    """Return the configured preprocessor store or ``None`` if it is disabled."""
+    result_cache = cache.get_cache()
+    if result_cache is None or configuration.get_config_value('cache', 'preproc_enabled', True) is False:
+        return None
+    max_size = configuration.get_config_value('cache', 'preproc_max_size') or '20gb'
+    return PreprocStore(os.path.join(result_cache.path, cache.PREPROC_DIR),
+                        max_size=configuration.get_size_mb(max_size))
+
+
+def product_key(attributes, settings, input_files=None):
+    """Compute the key of a preprocessed file."""
+    facets = dict((name, attributes.get(name)) for name in FACETS)
+    steps = dict((step, args) for step, args in settings.items() if step not in IGNORED_STEPS)
+    checksum = hashlib.sha256()
+    checksum.update(json.dumps(facets, sort_keys=True, default=str).encode('utf-8'))
+    checksum.update(json.dumps(steps, sort_keys=True, default=str).encode('utf-8'))
+    for filename in sorted(input_files or []):
+        if os.path.isfile(filename):
+            # the same key for the linked input files of the pre-flight check
+            checksum.update(json.dumps(cache.fingerprint(os.path.realpath(filename))).encode('utf-8'))
+    return checksum.hexdigest()
+
+
+class PreprocStore(object):
+    """Size-bounded LRU store of preprocessed NetCDF files.
+
+    :param path: directory of the store.
+    :param max_size: maximum size of the store in megabytes.
+    """
+
+    def __init__(self, path, max_size=20480):
+        self.path = path
+        self.max_size = max_size
+
+    def filename(self, key):
+        return os.path.join(self.path, key[:2], key + '.nc')
+
+    def __contains__(self, key):
+        return os.path.isfile(self.filename(key))
+
+    def restore(self, key, filename):
+        """Hard link (or copy) the stored file to ``filename``."""
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        try:
+            os.link(self.filename(key), filename)
+        except OSError:
+            shutil.copy2(self.filename(key), filename)
+        # mark as recently used
+        os.utime(self.filename(key), None)
+
+    def put(self, key, filename):
+        if key in self or not os.path.isfile(filename):
+            return
+        if not os.path.isdir(os.path.dirname(self.filename(key))):
+            os.makedirs(os.path.dirname(self.filename(key)))
+        fd, tmp_file = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(self.filename(key)))
+        os.close(fd)
+        try:
+            shutil.copy2(filename, tmp_file)
+            os.utime(tmp_file, None)
+            os.rename(tmp_file, self.filename(key))
+        except (IOError, OSError):
+            LOGGER.debug("could not store preprocessed file %s", filename)
+            os.remove(tmp_file)
+
+    def evict(self):
+        """Remove least recently used files until the store fits its size."""
+        files = sorted(glob.glob(os.path.join(self.path, '*', '*.nc')), key=os.path.getmtime)
+        total = sum(os.path.getsize(filename) for filename in files)
+        while files and total > self.max_size * 1024 ** 2:
+            filename = files.pop(0)
+            total -= os.path.getsize(filename)
+            os.remove(filename)
+
+
+def cached_run(run, store, write_metadata):
+    """Wrap ``PreprocessingTask._run`` to consult and fill ``store``."""
+
+    def _run(task, input_files):
+        keys = [product_key(product.attributes, product.settings, getattr(product, 'files', None))
+                for product in task.products]
+        if keys and all(key in store for key in keys):
+            try:
+                for key, product in zip(keys, task.products):
+                    store.restore(key, product.filename)
+                LOGGER.info("restored %s preprocessed files of task %s", len(keys), task.name)
+                instrument.increment('preproc_cache_hits', len(keys))
+                return write_metadata(task.products, task.write_ncl_interface)
+            except Exception:
+                LOGGER.exception("could not restore preprocessed files, running task %s", task.name)
+        result = run(task, input_files)
+        instrument.increment('preproc_cache_misses', len(keys))
+        for key, product in zip(keys, task.products):
+            store.put(key, product.filename)
+        store.evict()
+        return result
+
+    _run.wrapped = run
+    return _run
+
+
+def install(store):
+    """Patch the ESMValTool preprocessing task to use ``store``.
+
+    :returns: ``False`` if ESMValTool does not provide the needed API.
+    """
+    try:
+        from esmvaltool.preprocessor import PreprocessingTask
+        from esmvaltool.preprocessor._io import write_metadata
+    except ImportError:
+        LOGGER.warning("esmvaltool preprocessor API not found, preprocessor cache disabled.")
+        return False
+    run = getattr(PreprocessingTask._run, 'wrapped', PreprocessingTask._run)
+    PreprocessingTask._run = cached_run(run, store, write_metadata)
+    return True
@@ -1,24 +1,24 @@
-from .wps_sleep import Sleep
-from .wps_python_example import PythonExample
-from .wps_consecdrydays import ConsecDryDays
-from .wps_cvdp import CVDP
-from .wps_ensclus import EnsClus
-from .wps_shapeselect import ShapeSelect
-from .wps_zmnam import ZonalMeanNAM
-from .wps_perfmetrics import Perfmetrics
-from .wps_rainfarm import RainFarm
-from .wps_rmse import RMSE
+from copernicus.registry import ProcessRegistry
 
 #Disabled for now
-# MyDiag(),
-# Perfmetrics(),
+# ('mydiag', 'copernicus.processes.wps_mydiag:MyDiag'),
+# ('perfmetrics', 'copernicus.processes.wps_perfmetrics:Perfmetrics'),
 
-processes = [
-    Sleep(),
-    PythonExample(),
-    ConsecDryDays(),
-    CVDP(),
-    EnsClus(),
-    ShapeSelect(),
-    ZonalMeanNAM(),
-]
+registry = ProcessRegistry([
+    ('sleep', 'copernicus.processes.wps_sleep:Sleep'),
+    ('esmvaltool_preprocessor', 'copernicus.processes.wps_python_example:PythonExample'),
+    ('consecdrydays', 'copernicus.processes.wps_consecdrydays:ConsecDryDays'),
+    ('cvdp', 'copernicus.processes.wps_cvdp:CVDP'),
+    ('ensclus', 'copernicus.processes.wps_ensclus:EnsClus'),
+    ('shape_select', 'copernicus.processes.wps_shapeselect:ShapeSelect'),
+    ('zonal_mean_nam', 'copernicus.processes.wps_zmnam:ZonalMeanNAM'),
+    ('rainfarm', 'copernicus.processes.wps_rainfarm:RainFarm'),
+    ('rmse', 'copernicus.processes.wps_rmse:RMSE'),
+])
+
+
+def __getattr__(name):
+    # the list of all constructed processes, like before the lazy registry
+    if name == 'processes':
+        return registry.load_all()
+    raise AttributeError(name)
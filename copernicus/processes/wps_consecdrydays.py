@@ -1,11 +1,15 @@
 import os
 
-from pywps import Process
 from pywps import LiteralInput, LiteralOutput
 from pywps import ComplexInput, ComplexOutput
 from pywps import Format, FORMATS
 from pywps.app.Common import Metadata
 
+from copernicus.scheduler import ScheduledProcess
+from copernicus import catalogue
+from copernicus import drydays
+from copernicus import instrument
+from copernicus import ncdata
 from copernicus import runner
 from copernicus import util
 
@@ -13,26 +17,33 @@ import logging
 LOGGER = logging.getLogger("PYWPS")
 
 
-class ConsecDryDays(Process):
+class ConsecDryDays(ScheduledProcess):
     def __init__(self):
+        # choices from the data archive, or these defaults
+        models = catalogue.allowed_values(
+            'dataset', ['bcc-csm1-1-m', 'bcc-csm1-1'], project='CMIP5', mip='day', short_name='pr')
+        experiments = catalogue.allowed_values(
+            'exp', ['historical'], project='CMIP5', mip='day', short_name='pr')
+        ensembles = catalogue.allowed_values(
+            'ensemble', ['r1i1p1'], project='CMIP5', mip='day', short_name='pr')
         inputs = [
             LiteralInput('model', 'Model',
                          abstract='Choose a model like MPI-ESM-LR.',
                          data_type='string',
-                         allowed_values=['bcc-csm1-1-m', 'bcc-csm1-1'],
-                         default='bcc-csm1-1-m',
+                         allowed_values=models,
+                         default=catalogue.default(models, 'bcc-csm1-1-m'),
 			 min_occurs=1,
 			 max_occurs=1),
             LiteralInput('experiment', 'Experiment',
                          abstract='Choose an experiment like historical.',
                          data_type='string',
-                         allowed_values=['historical'],
-                         default='historical'),
+                         allowed_values=experiments,
+                         default=catalogue.default(experiments, 'historical')),
             LiteralInput('ensemble', 'Ensemble',
                          abstract='Choose an ensemble like r1i1p1.',
                          data_type='string',
-                         allowed_values=['r1i1p1'],
-                         default='r1i1p1'),
+                         allowed_values=ensembles,
+                         default=catalogue.default(ensembles, 'r1i1p1')),
             LiteralInput('start_year', 'Start year (from 1850)', data_type='integer',
                          abstract='Start year of model data.',
                          default="2001"),
@@ -49,6 +60,11 @@ class ConsecDryDays(Process):
                          data_type='string',
                          allowed_values=['0.5', '1', '2'],
                          default='1'),
+            LiteralInput('mode', 'Mode',
+                         abstract='Run the ESMValTool recipe or count the dry days natively, which is faster.',
+                         data_type='string',
+                         allowed_values=['esmvaltool', 'native'],
+                         default='esmvaltool'),
         ]
         outputs = [
             ComplexOutput('recipe', 'recipe',
@@ -101,73 +117,125 @@ class ConsecDryDays(Process):
 
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
-
-        # build esgf search constraints
-        constraints = dict(
-            model=request.inputs['model'][0].data,
-            experiment=request.inputs['experiment'][0].data,
-            time_frequency='day',
-            cmor_table='day',
-            ensemble=request.inputs['ensemble'][0].data,
-        )
-
-        #build options
-        options = dict(
-            frlim=request.inputs['frlim'][0].data,
-            plim=request.inputs['plim'][0].data,
-        )
-
-        # generate recipe
-        response.update_status("generate recipe ...", 10)
-        recipe_file, config_file = runner.generate_recipe(
-            workdir=self.workdir,
-            diag='consecdrydays',
-            constraints=constraints,
-            start_year=request.inputs['start_year'][0].data,
-            end_year=request.inputs['end_year'][0].data,
-	    options=options,
-            output_format='png',
-        )
-
-        # run diag
-        response.update_status("running diagnostic ...", 20)
-        logfile, plot_dir, work_dir, run_dir = runner.run(recipe_file, config_file)
-
-        # recipe output
-        response.outputs['recipe'].output_format = FORMATS.TEXT
-        response.outputs['recipe'].file = recipe_file
-
-        # log output
-        response.outputs['log'].output_format = FORMATS.TEXT
-        response.outputs['log'].file = logfile
-
-        # result plot
-        response.update_status("collecting output ...", 80)
-#        response.outputs['plot'].output_format = Format('application/png')
-#        response.outputs['plot'].file = runner.get_output(
-#            plot_dir,
-#            path_filter=os.path.join('diagnostic1', 'script1'),
-#            name_filter="CMIP5*",
-#            output_format="png")
-
-        response.outputs['drymax'].output_format = FORMATS.NETCDF
-        response.outputs['drymax'].file = runner.get_output(
-            work_dir,
-            path_filter=os.path.join('diagnostic1', 'script1'),
-            name_filter="CMIP5*drymax",
-            output_format="nc")
-
-        response.outputs['dryfreq'].output_format = FORMATS.NETCDF
-        response.outputs['dryfreq'].file = runner.get_output(
-            work_dir,
-            path_filter=os.path.join('diagnostic1', 'script1'),
-            name_filter="CMIP5*dryfreq",
-            output_format="nc")
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
-
+        stages = instrument.StageRecorder(self.identifier, self.uuid)
+        try:
+            # build esgf search constraints
+            constraints = dict(
+                model=request.inputs['model'][0].data,
+                experiment=request.inputs['experiment'][0].data,
+                time_frequency='day',
+                cmor_table='day',
+                ensemble=request.inputs['ensemble'][0].data,
+            )
+
+            #build options
+            options = dict(
+                frlim=request.inputs['frlim'][0].data,
+                plim=request.inputs['plim'][0].data,
+            )
+
+            # fail early when the archive lacks the data
+            catalogue.check_request(constraints, ['pr'], request.inputs['start_year'][0].data,
+                                    request.inputs['end_year'][0].data)
+
+            # generate recipe
+            stages.start('generate_recipe')
+            response.update_status("generate recipe ...", 10)
+            recipe_file, config_file = runner.generate_recipe(
+                workdir=self.workdir,
+                diag='consecdrydays',
+                constraints=constraints,
+                start_year=request.inputs['start_year'][0].data,
+                end_year=request.inputs['end_year'][0].data,
+    	    options=options,
+                output_format='png',
+            )
+
+            # check the input data before esmvaltool is started
+            stages.start('preflight')
+            response.update_status("checking input data ...", 15)
+            runner.preflight(recipe_file, config_file)
+
+            # run diag
+            stages.start('run')
+            response.update_status("running diagnostic ...", 20)
+            if request.inputs['mode'][0].data == 'native':
+                logfile, work_dir = self._run_native(request, response, constraints, options)
+            else:
+                logfile, plot_dir, work_dir, run_dir = runner.run(recipe_file, config_file, response=response)
+
+            # recipe output
+            response.outputs['recipe'].output_format = FORMATS.TEXT
+            response.outputs['recipe'].file = recipe_file
+
+            # log output
+            response.outputs['log'].output_format = FORMATS.TEXT
+            response.outputs['log'].file = logfile
+
+            # result plot
+            stages.start('collect_outputs')
+            response.update_status("collecting output ...", 80)
+            # response.outputs['plot'].output_format = Format('application/png')
+            # response.outputs['plot'].file = runner.get_output(
+            #     plot_dir,
+            #     path_filter=os.path.join('diagnostic1', 'script1'),
+            #     name_filter="CMIP5*",
+            #     output_format="png")
+
+            response.outputs['drymax'].output_format = FORMATS.NETCDF
+            response.outputs['drymax'].file = runner.get_output(
+                work_dir,
+                path_filter=os.path.join('diagnostic1', 'script1'),
+                name_filter="CMIP5*drymax",
+                output_format="nc")
+
+            response.outputs['dryfreq'].output_format = FORMATS.NETCDF
+            response.outputs['dryfreq'].file = runner.get_output(
+                work_dir,
+                path_filter=os.path.join('diagnostic1', 'script1'),
+                name_filter="CMIP5*dryfreq",
+                output_format="nc")
+
+            stages.start('archive')
+            response.update_status("creating archive of diagnostic result ...", 90)
+
+            response.outputs['archive'].output_format = Format('application/zip')
+            response.outputs['archive'].file = runner.compress_output(
+                os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'),
+                response=response)
+        finally:
+            stages.save()
         response.update_status("done.", 100)
         return response
+
+    def _run_native(self, request, response, constraints, options):
+        """Count the dry days without ESMValTool into the output tree of the recipe.
+
+        Returns the log file and the work directory.
+        """
+        start_year = request.inputs['start_year'][0].data
+        end_year = request.inputs['end_year'][0].data
+        files = ncdata.find_files(constraints['model'], constraints['experiment'], constraints['ensemble'],
+                                  'day', 'pr')
+        if not files:
+            raise Exception('Input data is not available: no files for CMIP5 {model} {experiment} '
+                            '{ensemble} day pr.'.format(**constraints))
+
+        def progress(fraction):
+            response.update_status("counting dry days ...", 20 + int(60 * fraction))
+
+        output_dir = os.path.join(self.workdir, 'output')
+        work_dir = os.path.join(output_dir, 'work')
+        paths = drydays.run(
+            files, start_year, end_year, float(options['plim']), float(options['frlim']),
+            work_dir=os.path.join(work_dir, 'diagnostic1', 'script1'),
+            prefix='CMIP5_{model}_day_{experiment}_{ensemble}_pr_{0}-{1}'.format(
+                start_year, end_year, **constraints),
+            progress=progress)
+        run_dir = os.path.join(output_dir, 'run')
+        os.makedirs(run_dir)
+        logfile = os.path.join(run_dir, 'main_log.txt')
+        with open(logfile, 'w') as fp:
+            fp.write('consecdrydays in native mode, plim={plim} frlim={frlim}\n'.format(**options))
+            fp.writelines('{0}\n'.format(path) for path in files + paths)
+        return logfile, work_dir
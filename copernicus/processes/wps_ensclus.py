@@ -1,11 +1,12 @@
 import os
 
-from pywps import Process
 from pywps import LiteralInput, LiteralOutput
 from pywps import ComplexInput, ComplexOutput
 from pywps import Format, FORMATS
 from pywps.app.Common import Metadata
 
+from copernicus.scheduler import ScheduledProcess
+from copernicus import instrument
 from copernicus import runner
 from copernicus import util
 
@@ -13,7 +14,7 @@ import logging
 LOGGER = logging.getLogger("PYWPS")
 
 
-class EnsClus(Process):
+class EnsClus(ScheduledProcess):
     def __init__(self):
         inputs = [
             LiteralInput('model', 'Model',
@@ -113,75 +114,88 @@ class EnsClus(Process):
 
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
-
-        # build esgf search constraints
-        constraints = dict(
-            model=request.inputs['model'][0].data,
-            experiment=request.inputs['experiment'][0].data,
-            time_frequency='mon',
-            cmor_table='Amon',
-            ensemble=request.inputs['ensemble'][0].data,
-        )
-
-        options = dict(
-            area=request.inputs['area'][0].data,
-	    extreme=request.inputs['extreme'][0].data,
-            numclus=request.inputs['numclus'][0].data,
-            perc=request.inputs['perc'][0].data,
-        )
-
-        # generate recipe
-        response.update_status("generate recipe ...", 10)
-        recipe_file, config_file = runner.generate_recipe(
-            workdir=self.workdir,
-            diag='ensclus',
-            constraints=constraints,
-            start_year=request.inputs['start_year'][0].data,
-            end_year=request.inputs['end_year'][0].data,
-            output_format='png',
-            options=options,
-        )
-
-        # run diag
-        response.update_status("running diagnostic ...", 20)
-        logfile, plot_dir, work_dir, run_dir = runner.run(recipe_file, config_file)
-
-        # recipe output
-        response.outputs['recipe'].output_format = FORMATS.TEXT
-        response.outputs['recipe'].file = recipe_file
-
-        # log output
-        response.outputs['log'].output_format = FORMATS.TEXT
-        response.outputs['log'].file = logfile
-
-        # result plot
-        response.update_status("collecting output ...", 80)
-        response.outputs['plot'].output_format = Format('application/eps')
-        response.outputs['plot'].file = runner.get_output(
-            plot_dir,
-            path_filter=os.path.join('EnsClus', 'main'),
-            name_filter="*",
-            output_format="eps")
-
-        response.outputs['data'].output_format = FORMATS.NETCDF
-        response.outputs['data'].file = runner.get_output(
-            work_dir,
-            path_filter=os.path.join('EnsClus', 'main'),
-            name_filter="ens*",
-            output_format="nc")
-
-        response.outputs['statistics'].output_format = FORMATS.TEXT
-        response.outputs['statistics'].file = runner.get_output(
-            work_dir,
-            path_filter=os.path.join('EnsClus', 'main'),
-            name_filter="statistics*",
-            output_format="txt")
-
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
-
+        stages = instrument.StageRecorder(self.identifier, self.uuid)
+        try:
+            # build esgf search constraints
+            constraints = dict(
+                model=request.inputs['model'][0].data,
+                experiment=request.inputs['experiment'][0].data,
+                time_frequency='mon',
+                cmor_table='Amon',
+                ensemble=request.inputs['ensemble'][0].data,
+            )
+
+            options = dict(
+                area=request.inputs['area'][0].data,
+    	    extreme=request.inputs['extreme'][0].data,
+                numclus=request.inputs['numclus'][0].data,
+                perc=request.inputs['perc'][0].data,
+            )
+
+            # generate recipe
+            stages.start('generate_recipe')
+            response.update_status("generate recipe ...", 10)
+            recipe_file, config_file = runner.generate_recipe(
+                workdir=self.workdir,
+                diag='ensclus',
+                constraints=constraints,
+                start_year=request.inputs['start_year'][0].data,
+                end_year=request.inputs['end_year'][0].data,
+                output_format='png',
+                options=options,
+            )
+
+            # check the input data before esmvaltool is started
+            stages.start('preflight')
+            response.update_status("checking input data ...", 15)
+            runner.preflight(recipe_file, config_file)
+
+            # run diag
+            stages.start('run')
+            response.update_status("running diagnostic ...", 20)
+            logfile, plot_dir, work_dir, run_dir = runner.run(recipe_file, config_file, response=response)
+
+            # recipe output
+            response.outputs['recipe'].output_format = FORMATS.TEXT
+            response.outputs['recipe'].file = recipe_file
+
+            # log output
+            response.outputs['log'].output_format = FORMATS.TEXT
+            response.outputs['log'].file = logfile
+
+            # result plot
+            stages.start('collect_outputs')
+            response.update_status("collecting output ...", 80)
+            response.outputs['plot'].output_format = Format('application/eps')
+            response.outputs['plot'].file = runner.get_output(
+                plot_dir,
+                path_filter=os.path.join('EnsClus', 'main'),
+                name_filter="*",
+                output_format="eps")
+
+            response.outputs['data'].output_format = FORMATS.NETCDF
+            response.outputs['data'].file = runner.get_output(
+                work_dir,
+                path_filter=os.path.join('EnsClus', 'main'),
+                name_filter="ens*",
+                output_format="nc")
+
+            response.outputs['statistics'].output_format = FORMATS.TEXT
+            response.outputs['statistics'].file = runner.get_output(
+                work_dir,
+                path_filter=os.path.join('EnsClus', 'main'),
+                name_filter="statistics*",
+                output_format="txt")
+
+
+            stages.start('archive')
+            response.update_status("creating archive of diagnostic result ...", 90)
+
+            response.outputs['archive'].output_format = Format('application/zip')
+            response.outputs['archive'].file = runner.compress_output(
+                os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'),
+                response=response)
+        finally:
+            stages.save()
         response.update_status("done.", 100)
         return response
@@ -1,11 +1,11 @@
 import os
 
-from pywps import Process
 from pywps import LiteralInput, LiteralOutput
 from pywps import ComplexInput, ComplexOutput
 from pywps import Format, FORMATS
 from pywps.app.Common import Metadata
 
+from copernicus.scheduler import ScheduledProcess
 from copernicus import runner
 from copernicus import util
 
@@ -13,7 +13,7 @@ import logging
 LOGGER = logging.getLogger("PYWPS")
 
 
-class MyDiag(Process):
+class MyDiag(ScheduledProcess):
     def __init__(self):
         inputs = [
             LiteralInput('model', 'Model',
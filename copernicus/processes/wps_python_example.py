@@ -1,11 +1,13 @@
 import os
 
-from pywps import Process
 from pywps import LiteralInput, LiteralOutput
 from pywps import ComplexInput, ComplexOutput
 from pywps import Format, FORMATS
 from pywps.app.Common import Metadata
 
+from copernicus.scheduler import ScheduledProcess
+from copernicus import catalogue
+from copernicus import instrument
 from copernicus import runner
 from copernicus import util
 
@@ -13,26 +15,33 @@ import logging
 LOGGER = logging.getLogger("PYWPS")
 
 
-class PythonExample(Process):
+class PythonExample(ScheduledProcess):
     def __init__(self):
+        # choices from the data archive, or these defaults
+        models = catalogue.allowed_values(
+            'dataset', ['bcc-csm1-1', 'MPI-ESM-LR', 'GFDL-ESM2G'], project='CMIP5', mip='Amon', short_name='ta')
+        experiments = catalogue.allowed_values(
+            'exp', ['historical'], project='CMIP5', mip='Amon', short_name='ta')
+        ensembles = catalogue.allowed_values(
+            'ensemble', ['r1i1p1'], project='CMIP5', mip='Amon', short_name='ta')
         inputs = [
             LiteralInput('model', 'Model',
                          abstract='Choose a model like MPI-ESM-LR.',
                          data_type='string',
-                         allowed_values=['bcc-csm1-1', 'MPI-ESM-LR', 'GFDL-ESM2G'],
-                         default='MPI-ESM-LR',
+                         allowed_values=models,
+                         default=catalogue.default(models, 'MPI-ESM-LR'),
 			 min_occurs=1,
 			 max_occurs=1),
             LiteralInput('experiment', 'Experiment',
                          abstract='Choose an experiment like historical.',
                          data_type='string',
-                         allowed_values=['historical'],
-                         default='historical'),
+                         allowed_values=experiments,
+                         default=catalogue.default(experiments, 'historical')),
             LiteralInput('ensemble', 'Ensemble',
                          abstract='Choose an ensemble like r1i1p1.',
                          data_type='string',
-                         allowed_values=['r1i1p1'],
-                         default='r1i1p1'),
+                         allowed_values=ensembles,
+                         default=catalogue.default(ensembles, 'r1i1p1')),
             LiteralInput('start_year', 'Start year (from 1979)', data_type='integer',
                          abstract='Start year of model data.',
                          default="2000"),
@@ -89,59 +98,76 @@ class PythonExample(Process):
 
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
-
-        # build esgf search constraints
-        constraints = dict(
-            model=request.inputs['model'][0].data,
-            experiment=request.inputs['experiment'][0].data,
-            time_frequency='mon',
-            cmor_table='Amon',
-            ensemble=request.inputs['ensemble'][0].data,
-        )
-
-        # generate recipe
-        response.update_status("generate recipe ...", 10)
-        recipe_file, config_file = runner.generate_recipe(
-            workdir=self.workdir,
-            diag='python',
-            constraints=constraints,
-            start_year=request.inputs['start_year'][0].data,
-            end_year=request.inputs['end_year'][0].data,
-            output_format='png',
-        )
-
-        # run diag
-        response.update_status("running diagnostic ...", 20)
-        logfile, plot_dir, work_dir, run_dir = runner.run(recipe_file, config_file)
-
-        # recipe output
-        response.outputs['recipe'].output_format = FORMATS.TEXT
-        response.outputs['recipe'].file = recipe_file
-
-        # log output
-        response.outputs['log'].output_format = FORMATS.TEXT
-        response.outputs['log'].file = logfile
-
-        # result plot
-        response.update_status("collecting output ...", 80)
-        response.outputs['plot'].output_format = Format('application/png')
-        response.outputs['plot'].file = runner.get_output(
-            plot_dir,
-            path_filter=os.path.join('diagnostic1', 'script1'),
-            name_filter="CMIP5*",
-            output_format="png")
-
-        response.outputs['data'].output_format = FORMATS.NETCDF
-        response.outputs['data'].file = runner.get_output(
-            work_dir,
-            path_filter=os.path.join('diagnostic1', 'script1'),
-            name_filter="CMIP5*",
-            output_format="nc")
-
-        response.update_status("creating archive of diagnostic result ...", 90)
-
-        response.outputs['archive'].output_format = Format('application/zip')
-        response.outputs['archive'].file = runner.compress_output(os.path.join(self.workdir, 'output'), 'diagnostic_result.zip')
-
+        stages = instrument.StageRecorder(self.identifier, self.uuid)
+        try:
+            # build esgf search constraints
+            constraints = dict(
+                model=request.inputs['model'][0].data,
+                experiment=request.inputs['experiment'][0].data,
+                time_frequency='mon',
+                cmor_table='Amon',
+                ensemble=request.inputs['ensemble'][0].data,
+            )
+
+            # fail early when the archive lacks the data
+            catalogue.check_request(constraints, ['ta'], request.inputs['start_year'][0].data,
+                                    request.inputs['end_year'][0].data)
+
+            # generate recipe
+            stages.start('generate_recipe')
+            response.update_status("generate recipe ...", 10)
+            recipe_file, config_file = runner.generate_recipe(
+                workdir=self.workdir,
+                diag='python',
+                constraints=constraints,
+                start_year=request.inputs['start_year'][0].data,
+                end_year=request.inputs['end_year'][0].data,
+                output_format='png',
+            )
+
+            # check the input data before esmvaltool is started
+            stages.start('preflight')
+            response.update_status("checking input data ...", 15)
+            runner.preflight(recipe_file, config_file)
+
+            # run diag
+            stages.start('run')
+            response.update_status("running diagnostic ...", 20)
+            logfile, plot_dir, work_dir, run_dir = runner.run(recipe_file, config_file, response=response)
+
+            # recipe output
+            response.outputs['recipe'].output_format = FORMATS.TEXT
+            response.outputs['recipe'].file = recipe_file
+
+            # log output
+            response.outputs['log'].output_format = FORMATS.TEXT
+            response.outputs['log'].file = logfile
+
+            # result plot
+            stages.start('collect_outputs')
+            response.update_status("collecting output ...", 80)
+            response.outputs['plot'].output_format = Format('application/png')
+            response.outputs['plot'].file = runner.get_output(
+                plot_dir,
+                path_filter=os.path.join('diagnostic1', 'script1'),
+                name_filter="CMIP5*",
+                output_format="png")
+
+            response.outputs['data'].output_format = FORMATS.NETCDF
+            response.outputs['data'].file = runner.get_output(
+                work_dir,
+                path_filter=os.path.join('diagnostic1', 'script1'),
+                name_filter="CMIP5*",
+                output_format="nc")
+
+            stages.start('archive')
+            response.update_status("creating archive of diagnostic result ...", 90)
+
+            response.outputs['archive'].output_format = Format('application/zip')
+            response.outputs['archive'].file = runner.compress_output(
+                os.path.join(self.workdir, 'output'), os.path.join(self.workdir, 'diagnostic_result.zip'),
+                response=response)
+        finally:
+            stages.save()
         response.update_status("done.", 100)
         return response
@@ -1,11 +1,15 @@
 import os
 
-from pywps import Process
 from pywps import LiteralInput, LiteralOutput
 from pywps import ComplexInput, ComplexOutput
 from pywps import Format, FORMATS
 from pywps.app.Common import Metadata
 
+from copernicus.scheduler import ScheduledProcess
+from copernicus import catalogue
+from copernicus import instrument
+from copernicus import ncdata
+from copernicus import rainfarm
 from copernicus import runner
 from copernicus import util
 
@@ -13,19 +17,24 @@ import logging
 LOGGER = logging.getLogger("PYWPS")
 
 
-class RainFarm(Process):
+class RainFarm(ScheduledProcess):
     def __init__(self):
+        # choices from the data archive, or these defaults
+        models = catalogue.allowed_values(
+            'dataset', ['ACCESS1-0'], project='CMIP5', mip='day', short_name='pr')
+        experiments = catalogue.allowed_values(
+            'exp', ['historical'], project='CMIP5', mip='day', short_name='pr')
         inputs = [
             LiteralInput('model', 'Model',
                          abstract='Choose a model like MPI-ESM-LR.',
                          data_type='string',
-                         allowed_values=['ACCESS1-0', ],
-                         default='ACCESS1-0'),
+                         allowed_values=models,
+                         default=catalogue.default(models, 'ACCESS1-0')),
             LiteralInput('experiment', 'Experiment',
                          abstract='Choose an experiment like historical.',
                          data_type='string',
-                         allowed_values=['historical', ],
-                         default='historical'),
+                         allowed_values=experiments,
+                         default=catalogue.default(experiments, 'historical')),
             LiteralInput('start_year', 'Start year', data_type='integer',
                          abstract='Start year of model data.',
                          default="1997"),
@@ -37,11 +46,11 @@ class RainFarm(Process):
                          data_type='string',
                          default='4,13,44,53'),
             LiteralInput('regridding', 'Regridding',
-                         abstract='Flag for regridding.',
+                         abstract='Interpolate the subset to a square grid instead of cropping it.',
                          data_type='boolean',
                          default='0'),
             LiteralInput('slope', 'Slope',
-                         abstract='Flag for slope.',
+                         abstract='Use the fixed spectral slope 1.7 instead of fitting it on the large scales.',
                          data_type='boolean',
                          default='0'),
             LiteralInput('num_ens_members', 'Number of ensemble members',
@@ -54,10 +63,14 @@ class RainFarm(Process):
                          default='8'),
         ]
         outputs = [
-            ComplexOutput('output', 'Output plot',
-                          abstract='Generated output plot of ESMValTool processing.',
+            ComplexOutput('output', 'Downscaled ensemble',
+                          abstract='The downscaled precipitation of the ensemble members, '
+                                   'one NetCDF file per member, as a zip archive.',
                           as_reference=True,
-                          supported_formats=[Format('image/png')]),
+                          supported_formats=[Format('application/zip')]),
+            LiteralOutput('slope', 'Spectral slope',
+                          abstract='The spectral slope of the generated small scales.',
+                          data_type='float'),
         ]
 
         super(RainFarm, self).__init__(
@@ -89,11 +102,61 @@ class RainFarm(Process):
 
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
-        # run diag
-        response.update_status("running diag ...", 20)
-        # result plot
-        response.update_status("collect output plot ...", 90)
-        response.outputs['output'].output_format = Format('image/png')
-        response.outputs['output'].file = util.diagdata_file(os.path.join('rainfarm', 'RainFARM_example_64x64.png'))
+        stages = instrument.StageRecorder(self.identifier, self.uuid)
+        try:
+            constraints = dict(
+                model=request.inputs['model'][0].data,
+                experiment=request.inputs['experiment'][0].data,
+                ensemble='r1i1p1',
+                cmor_table='day',
+            )
+            start_year = request.inputs['start_year'][0].data
+            end_year = request.inputs['end_year'][0].data
+            members = request.inputs['num_ens_members'][0].data
+            nf = request.inputs['num_subdivs'][0].data
+            if not 1 <= members <= rainfarm.MAX_MEMBERS:
+                raise Exception("The number of ensemble members must be between 1 and {0}.".format(
+                    rainfarm.MAX_MEMBERS))
+            if not 1 <= nf <= rainfarm.MAX_SUBDIVS:
+                raise Exception("The number of subdivisions must be between 1 and {0}.".format(rainfarm.MAX_SUBDIVS))
+            bbox = ncdata.parse_bbox(request.inputs['subset'][0].data)
+
+            # fail early when the archive lacks the data
+            catalogue.check_request(constraints, ['pr'], start_year, end_year)
+
+            stages.start('read_data')
+            response.update_status("reading precipitation ...", 10)
+            files = ncdata.find_files(constraints['model'], constraints['experiment'], constraints['ensemble'],
+                                      'day', 'pr')
+            if not files:
+                raise Exception('Input data is not available: no files for CMIP5 {model} {experiment} '
+                                '{ensemble} day pr.'.format(**constraints))
+            field = ncdata.Field(files, 'pr', start_year, end_year, bbox=bbox, fill_value=0)
+
+            # run diag
+            stages.start('downscale')
+            response.update_status("downscaling ...", 20)
+            output_dir = os.path.join(self.workdir, 'output')
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+
+            def progress(done):
+                response.update_status("downscaled {0} of {1} ensemble members ...".format(done, members),
+                                       20 + 60 * done // members)
+
+            _, slope = rainfarm.ensemble(
+                field, output_dir, members, nf,
+                slope=rainfarm.DEFAULT_SLOPE if request.inputs['slope'][0].data else None,
+                regrid=request.inputs['regridding'][0].data,
+                progress=progress)
+
+            stages.start('archive')
+            response.update_status("creating archive of the ensemble ...", 90)
+            response.outputs['output'].output_format = Format('application/zip')
+            response.outputs['output'].file = runner.compress_output(
+                output_dir, os.path.join(self.workdir, 'rainfarm_ensemble.zip'), response=response)
+            response.outputs['slope'].data = slope
+        finally:
+            stages.save()
         response.update_status("done.", 100)
         return response
@@ -1,11 +1,19 @@
 import os
+import itertools
 
-from pywps import Process
 from pywps import LiteralInput, LiteralOutput
 from pywps import ComplexInput, ComplexOutput
 from pywps import Format, FORMATS
+from pywps import configuration
 from pywps.app.Common import Metadata
 
+from copernicus.scheduler import ScheduledProcess
+from copernicus import catalogue
+from copernicus import coalesce
+from copernicus import instrument
+from copernicus import modes
+from copernicus import ncdata
+from copernicus import preflight
 from copernicus import runner
 from copernicus import util
 
@@ -13,23 +21,27 @@ import logging
 LOGGER = logging.getLogger("PYWPS")
 
 
-class RMSE(Process):
+class RMSE(ScheduledProcess):
     def __init__(self):
+        # choices from the data archive, or these defaults
+        models = sorted(set(itertools.chain.from_iterable(
+            catalogue.allowed_values('dataset', ['NASA'], project='CMIP5', mip=variable['mip'], short_name=name)
+            for name, variable in modes.VARIABLES.items())))
         inputs = [
             LiteralInput('region', 'Region',
                          abstract='Choose a region like Arctic.',
                          data_type='string',
-                         allowed_values=['Arctic', ],
+                         allowed_values=sorted(modes.REGIONS),
                          default='Arctic'),
             LiteralInput('model', 'Model',
                          abstract='Choose a model like NASA.',
                          data_type='string',
-                         allowed_values=['NASA', ],
-                         default='NASA'),
+                         allowed_values=models,
+                         default=catalogue.default(models, 'NASA')),
             LiteralInput('variable', 'Variable',
                          abstract='Choose a variable like sic.',
                          data_type='string',
-                         allowed_values=['sic', ],
+                         allowed_values=sorted(modes.VARIABLES),
                          default='sic'),
             LiteralInput('ncenters', 'Number of Centers',
                          abstract='Choose a number of centers.',
@@ -41,11 +53,11 @@ class RMSE(Process):
                          allowed_values=['kmeans', ],
                          default='kmeans'),
             LiteralInput('eofs', 'EOFS',
-                         abstract='Choose EOFS.',
+                         abstract='Cluster the principal components of the leading EOFs instead of the anomalies.',
                          data_type='boolean',
                          default='0'),
             LiteralInput('detrend', 'detrend',
-                         abstract='Choose a detrend.',
+                         abstract='Order of the polynomial trend removed from the anomalies (0, 1 or 2).',
                          data_type='integer',
                          default='2'),
             LiteralInput('experiment', 'Experiment',
@@ -53,12 +65,29 @@ class RMSE(Process):
                          data_type='string',
                          allowed_values=['historical', 'rcp26', 'rcp85'],
                          default='historical'),
+            LiteralInput('start_year', 'Start year', data_type='integer',
+                         abstract='Start year of model data.',
+                         default="1990"),
+            LiteralInput('end_year', 'End year', data_type='integer',
+                         abstract='End year of model data.',
+                         default="2005"),
+            LiteralInput('ref_start_year', 'Reference start year', data_type='integer',
+                         abstract='Start year of the observations.',
+                         default="1990"),
+            LiteralInput('ref_end_year', 'Reference end year', data_type='integer',
+                         abstract='End year of the observations.',
+                         default="2005"),
         ]
         outputs = [
-            ComplexOutput('output', 'Output plot',
-                          abstract='Generated output plot of ESMValTool processing.',
+            ComplexOutput('output', 'Modes of variability',
+                          abstract='Patterns of the model and observed clusters with their RMSE, frequency '
+                                   'and persistence bias.',
                           as_reference=True,
-                          supported_formats=[Format('image/png')]),
+                          supported_formats=[FORMATS.NETCDF]),
+            ComplexOutput('table', 'Statistics',
+                          abstract='RMSE, frequency and persistence bias of the clusters.',
+                          as_reference=True,
+                          supported_formats=[Format('text/csv')]),
         ]
 
         super(RMSE, self).__init__(
@@ -91,12 +120,71 @@ class RMSE(Process):
 
     def _handler(self, request, response):
         response.update_status("starting ...", 0)
-        # run diag
-        response.update_status("running diag ...", 20)
-        # result plot
-        response.update_status("collect output plot ...", 90)
-        response.outputs['output'].output_format = Format('image/png')
-        response.outputs['output'].file = util.diagdata_file(
-            os.path.join('modes_of_variability', 'era_interim_1990-01-2010-01_clusters.png'))
+        stages = instrument.StageRecorder(self.identifier, self.uuid)
+        try:
+            short_name = request.inputs['variable'][0].data
+            variable = modes.VARIABLES[short_name]
+            constraints = dict(
+                model=request.inputs['model'][0].data,
+                experiment=request.inputs['experiment'][0].data,
+                ensemble='r1i1p1',
+                cmor_table=variable['mip'],
+            )
+            start_year = request.inputs['start_year'][0].data
+            end_year = request.inputs['end_year'][0].data
+            ncenters = request.inputs['ncenters'][0].data
+            detrend = request.inputs['detrend'][0].data
+            if not 2 <= ncenters <= modes.MAX_CENTERS:
+                raise Exception("The number of centers must be between 2 and {0}.".format(modes.MAX_CENTERS))
+            if detrend not in (0, 1, 2):
+                raise Exception("detrend must be 0, 1 or 2.")
+            if request.inputs['cluster_method'][0].data != 'kmeans':
+                raise Exception("Only the kmeans cluster method is supported.")
+            bbox = modes.REGIONS[request.inputs['region'][0].data]
+
+            # fail early when the archive lacks the data
+            catalogue.check_request(constraints, [short_name], start_year, end_year)
+
+            stages.start('read_data')
+            response.update_status("reading data ...", 10)
+            files = ncdata.find_files(constraints['model'], constraints['experiment'], constraints['ensemble'],
+                                      variable['mip'], short_name)
+            ref_files = preflight.find_files(variable['reference'], short_name, variable['mip'],
+                                             {'OBS': configuration.get_config_value('data', 'obs_root')})
+            for name, found in [('CMIP5 {model} {experiment} {ensemble}'.format(**constraints), files),
+                                ('OBS {dataset}'.format(**variable['reference']), ref_files)]:
+                if not found:
+                    raise Exception('Input data is not available: no files for {0} {1} {2}.'.format(
+                        name, variable['mip'], short_name))
+            field = ncdata.Field(files, short_name, start_year, end_year, bbox=bbox)
+            ref_field = ncdata.Field(ref_files, short_name, request.inputs['ref_start_year'][0].data,
+                                     request.inputs['ref_end_year'][0].data, bbox=bbox)
+
+            # run diag
+            stages.start('cluster')
+            # identical requests give the same clusters, so they may be coalesced
+            seed = int(coalesce.request_key(self.identifier, request)[:8], 16)
+            options = dict(k=ncenters, monthly=variable['monthly'], detrend=detrend,
+                           eofs=request.inputs['eofs'][0].data, seed=seed)
+            response.update_status("clustering the observations ...", 20)
+            reference = modes.Modes(ref_field, self.workdir, 'reference', **options)
+            response.update_status("clustering the model ...", 50)
+            model = modes.Modes(field, self.workdir, 'model', **options)
+
+            stages.start('collect_outputs')
+            response.update_status("comparing the modes ...", 80)
+            result = modes.compare(model, reference)
+            output_file = os.path.join(self.workdir, 'modes_of_variability.nc')
+            modes.write_results(output_file, model, reference, result, short_name, field.attributes.get('units'),
+                                seed=seed)
+            table_file = os.path.join(self.workdir, 'modes_of_variability.csv')
+            modes.write_table(table_file, model, reference, result)
+
+            response.outputs['output'].output_format = FORMATS.NETCDF
+            response.outputs['output'].file = output_file
+            response.outputs['table'].output_format = Format('text/csv')
+            response.outputs['table'].file = table_file
+        finally:
+            stages.save()
         response.update_status("done.", 100)
         return response
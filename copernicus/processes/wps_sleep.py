@@ -1,8 +1,10 @@
-from pywps import Process, LiteralInput, LiteralOutput
+from pywps import LiteralInput, LiteralOutput
 from pywps.app.Common import Metadata
 
+from copernicus.scheduler import ScheduledProcess
 
-class Sleep(Process):
+
+class Sleep(ScheduledProcess):
     def __init__(self):
         inputs = [
             LiteralInput('delay', 'Delay between every update',
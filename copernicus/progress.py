@@ -0,0 +1,122 @@
+"""Progress reporting parsed from the ESMValTool run log.
+
+The ``main_log.txt`` of a running recipe is tailed in a background thread.
+Task start and finish events are mapped to status updates of the PyWPS
+response between a start and end percentage. Updates are rate-limited, the
+last one is always sent when the progress is stopped.
+"""
+
+import os
+import re
+import glob
+import time
+import threading
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# seconds between two status updates
+STATUS_INTERVAL = 2.0
+# seconds between two reads of the log when there are no new lines
+POLL_INTERVAL = 0.5
+
+PATTERNS = [
+    ('tasks', re.compile(r'Running (\d+) tasks')),
+    ('start', re.compile(r'Starting task (\S+) in process')),
+    ('done', re.compile(r'Successfully completed task (\S+)')),
+]
+
+
+def parse_line(line):
+    """Return the event ``(name, value)`` of a log line or ``None``."""
+    for name, pattern in PATTERNS:
+        match = pattern.search(line)
+        if match:
+            return name, match.group(1)
+    return None
+
+
+class LogProgress(threading.Thread):
+    """Tail ``<output_dir>/*/run/main_log.txt`` and report the progress.
+
+    :param response: PyWPS response used for ``update_status``.
+    """
+
+    def __init__(self, output_dir, response, start=20, end=80, interval=STATUS_INTERVAL):
+        super(LogProgress, self).__init__(name='esmvaltool-progress')
+        self.daemon = True
+        self.output_dir = output_dir
+        self.response = response
+        self.start_percentage = start
+        self.end_percentage = end
+        self.interval = interval
+        self.total = 0
+        self.done = 0
+        self.last_update = 0
+        # message held back by the rate limit
+        self.pending = None
+        self._stopped = threading.Event()
+
+    def find_logfile(self):
+        logfiles = glob.glob(os.path.join(self.output_dir, '*', 'run', 'main_log.txt'))
+        return logfiles[0] if logfiles else None
+
+    def run(self):
+        logfile = None
+        while logfile is None:
+            stopped = self._stopped.wait(POLL_INTERVAL)
+            logfile = self.find_logfile()
+            if logfile is None and stopped:
+                return
+        with open(logfile) as fp:
+            while not self._stopped.is_set():
+                line = fp.readline()
+                if not line:
+                    self._stopped.wait(POLL_INTERVAL)
+                    continue
+                self.handle_line(line)
+            # the lines written before the run ended
+            for line in fp:
+                self.handle_line(line)
+
+    def handle_line(self, line):
+        event = parse_line(line)
+        if event:
+            self.handle(*event)
+
+    def handle(self, name, value):
+        if name == 'tasks':
+            self.total = int(value)
+            message = "running diagnostic: {0} tasks ...".format(self.total)
+        elif name == 'start':
+            message = "running diagnostic: started task {0} ({1}/{2} done) ...".format(
+                value, self.done, self.total or '?')
+        else:
+            self.done += 1
+            message = "running diagnostic: completed task {0} ({1}/{2} done) ...".format(
+                value, self.done, self.total or '?')
+        self.update(message)
+
+    def percentage(self):
+        if not self.total:
+            return self.start_percentage
+        done = min(self.done, self.total)
+        return self.start_percentage + (self.end_percentage - self.start_percentage) * done // self.total
+
+    def update(self, message, force=False):
+        now = time.time()
+        if not force and now - self.last_update < self.interval:
+            self.pending = message
+            return
+        self.last_update = now
+        self.pending = None
+        try:
+            self.response.update_status(message, self.percentage())
+        except Exception:
+            LOGGER.exception("could not update status")
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        if self.pending:
+            self.update(self.pending, force=True)
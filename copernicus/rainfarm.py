@@ -0,0 +1,196 @@
+"""RainFARM stochastic precipitation downscaling (Rebora et al. 2006).
+
+A coarse precipitation field of ``n x n`` cells is downscaled to ``n * nf``
+cells: a Gaussian random field with the power law spectrum of the large
+scales is generated by filtering white noise in Fourier space, transformed to
+a lognormal field and rescaled so that every coarse cell keeps its value.
+
+The fields of a chunk of time steps are generated with one batched inverse
+FFT and rescaled with array operations, without a loop over time steps or
+cells. Ensemble members are independent and run in a process pool, each
+writing its NetCDF file a chunk of time steps at a time.
+"""
+
+import os
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from copernicus import ncdata
+from copernicus import runner
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# spectral slope of the large scales used when it is not fitted
+DEFAULT_SLOPE = 1.7
+# memory of the fine fields generated at once, per worker
+CHUNK_BYTES = 64 * 1024 ** 2
+# limits of a request, a time step of the largest fine grid takes about 130 MB per worker
+MAX_MEMBERS = 50
+MAX_SUBDIVS = 64
+MAX_FINE_SIZE = 2048
+
+
+def power_spectrum(fields):
+    """Return the isotropic power spectrum of square fields averaged over time.
+
+    The power is summed over rings of wavenumber ``k = 1 .. n / 2``.
+    """
+    size = fields.shape[-1]
+    power = (np.abs(np.fft.fft2(fields)) ** 2).mean(axis=0)
+    k = np.fft.fftfreq(size) * size
+    ring = np.rint(np.hypot(k[:, None], k[None, :])).astype(int)
+    return np.bincount(ring.ravel(), weights=power.ravel())[1:size // 2 + 1]
+
+
+def fit_slope(fields):
+    """Return the spectral slope of the fields, fitted on the wavenumbers they resolve."""
+    fields = fields[fields.reshape(len(fields), -1).any(axis=1)]
+    if len(fields) == 0 or fields.shape[-1] < 4:
+        return DEFAULT_SLOPE
+    spectrum = power_spectrum(fields)
+    k = np.arange(1, len(spectrum) + 1)
+    valid = spectrum > 0
+    return float(-np.polyfit(np.log(k[valid]), np.log(spectrum[valid]), 1)[0])
+
+
+def spectral_filter(size, slope):
+    """Return the amplitudes of the ``rfft2`` modes of a field with spectral slope ``slope``."""
+    k = np.hypot((np.fft.fftfreq(size) * size)[:, None], (np.fft.rfftfreq(size) * size)[None, :])
+    k[0, 0] = 1
+    # the modes of a ring grow with k, so each has the power k^-(slope + 1)
+    amplitude = k ** (-(slope + 1) / 2.0)
+    amplitude[0, 0] = 0
+    return amplitude.astype(np.float32)
+
+
+def gaussian_fields(rng, amplitude, steps):
+    """Return ``steps`` Gaussian random fields with zero mean and unit variance."""
+    size = amplitude.shape[0]
+    # single precision, like the output, halves the time of the random numbers and FFTs
+    noise = rng.standard_normal((steps,) + amplitude.shape + (2,), dtype=np.float32).view(np.complex64)[..., 0]
+    noise *= amplitude
+    fields = np.fft.irfft2(noise, s=(size, size))
+    fields -= fields.mean(axis=(1, 2), keepdims=True)
+    fields /= fields.std(axis=(1, 2), keepdims=True)
+    return fields
+
+
+def downscale(coarse, nf, amplitude, rng):
+    """Downscale coarse fields ``(time, n, n)`` to ``(time, n * nf, n * nf)``.
+
+    The mean of the fine cells of each coarse cell equals its value.
+    """
+    steps, size = coarse.shape[0], coarse.shape[1]
+    fine = gaussian_fields(rng, amplitude, steps)
+    np.exp(fine, out=fine)
+    blocks = fine.reshape(steps, size, nf, size, nf)
+    means = blocks.mean(axis=(2, 4), dtype=np.float64)
+    blocks *= (np.maximum(coarse, 0) / means)[:, :, None, :, None]
+    return fine
+
+
+def fine_coordinates(values, nf):
+    """Return the coordinates of the fine cells of evenly spaced cell centres."""
+    step = (values[-1] - values[0]) / (len(values) - 1)
+    return values[0] - step / 2.0 + step * (np.arange(len(values) * nf) + 0.5) / nf
+
+
+def interpolate(data, axis, values, size):
+    """Linearly interpolate ``data`` along ``axis`` to ``size`` evenly spaced points."""
+    new_values = np.linspace(values[0], values[-1], size)
+    position = np.linspace(0, len(values) - 1, size)
+    lower = np.minimum(position.astype(int), len(values) - 2)
+    weight = position - lower
+    shape = [1] * data.ndim
+    shape[axis] = size
+    weight = weight.reshape(shape)
+    data = np.take(data, lower, axis=axis) * (1 - weight) + np.take(data, lower + 1, axis=axis) * weight
+    return data, new_values
+
+
+def square(data, lat, lon, regrid=False):
+    """Return the fields on a square grid, as RainFARM needs it.
+
+    The fields are cropped to the central square, or interpolated to a
+    square grid of the larger dimension with ``regrid``.
+    """
+    ny, nx = data.shape[1:]
+    if min(ny, nx) < 2:
+        raise Exception("The subset needs at least 2x2 grid cells, it has {0}x{1}.".format(nx, ny))
+    if ny == nx:
+        return data, lat, lon
+    if regrid:
+        size = max(ny, nx)
+        data, lat = interpolate(data, 1, lat, size)
+        data, lon = interpolate(data, 2, lon, size)
+        return data, lat, lon
+    size = min(ny, nx)
+    y0, x0 = (ny - size) // 2, (nx - size) // 2
+    return data[:, y0:y0 + size, x0:x0 + size], lat[y0:y0 + size], lon[x0:x0 + size]
+
+
+def chunk_steps(fine_size):
+    # the noise, the fields and their spectrum are in memory at the same time
+    return max(1, CHUNK_BYTES // (fine_size * fine_size * 8 * 4))
+
+
+def run_member(path, times, coarse, lat, lon, nf, slope, seed, attributes, time_units, calendar):
+    """Write one ensemble member to ``path``."""
+    rng = np.random.default_rng(seed)
+    size = coarse.shape[1] * nf
+    amplitude = spectral_filter(size, slope)
+    steps = chunk_steps(size)
+    with ncdata.FieldWriter(path, 'pr', fine_coordinates(lat, nf), fine_coordinates(lon, nf),
+                            time_units, calendar, attributes,
+                            global_attributes={'rainfarm_slope': slope, 'rainfarm_nf': nf,
+                                               'rainfarm_seed': str(seed.entropy),
+                                               'rainfarm_member': seed.spawn_key[-1] + 1}) as writer:
+        for start in range(0, len(times), steps):
+            writer.write(times[start:start + steps], downscale(coarse[start:start + steps], nf, amplitude, rng))
+    return path
+
+
+def ensemble(field, output_dir, members, nf, slope=None, regrid=False, workers=None, seed=None, progress=None):
+    """Generate the downscaled ensemble of a precipitation field.
+
+    :param field: a :class:`copernicus.ncdata.Field` of ``pr``.
+    :param slope: the spectral slope, fitted on the coarse fields if None.
+    :param progress: called with the number of finished members.
+    :returns: the files of the members and the slope.
+    """
+    ny, nx = len(field.lat), len(field.lon)
+    fine_size = (max(ny, nx) if regrid else min(ny, nx)) * nf
+    if fine_size > MAX_FINE_SIZE:
+        raise Exception("The fine grid of {0}x{0} cells is larger than {1}x{1}, use a smaller subset "
+                        "or fewer subdivisions.".format(fine_size, MAX_FINE_SIZE))
+    times, coarse = field.read()
+    coarse, lat, lon = square(coarse, field.lat, field.lon, regrid=regrid)
+    if slope is None:
+        slope = fit_slope(coarse)
+    seeds = np.random.SeedSequence(seed).spawn(members)
+    paths = [os.path.join(output_dir, 'rainfarm_member{0:03d}.nc'.format(i + 1)) for i in range(members)]
+    args = (times, coarse, lat, lon, nf, slope)
+    extra = (field.attributes, field.time_units, field.calendar)
+    workers = min(members, workers or runner.max_workers('rainfarm'))
+    LOGGER.info("rainfarm: %s members of %sx%s cells with slope %.2f in %s processes",
+                members, coarse.shape[1] * nf, coarse.shape[1] * nf, slope, workers)
+    start = time.time()
+    if workers == 1:
+        for i, path in enumerate(paths):
+            run_member(path, *(args + (seeds[i],) + extra))
+            if progress:
+                progress(i + 1)
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            futures = [executor.submit(run_member, path, *(args + (seeds[i],) + extra))
+                       for i, path in enumerate(paths)]
+            for done, future in enumerate(as_completed(futures)):
+                future.result()
+                if progress:
+                    progress(done + 1)
+    LOGGER.debug("rainfarm: ensemble done in %.1f s", time.time() - start)
+    return paths, slope
@@ -0,0 +1,270 @@
+"""Garbage collection of job outputs and working directories.
+
+The reaper enforces the size and age quotas of the ``[reaper]`` section on
+
+* the outputs of the jobs (``<outputpath>/<uuid>/`` and the status document
+  ``<outputpath>/<uuid>.xml``),
+* the working directories of the jobs (``<workdir>/pywps_process_*``),
+
+removing the least recently used first. Outputs are used when they are
+written or downloaded. It never removes anything of a queued or running job
+or outputs which are referenced by a recently updated status document, like
+the ones of attached jobs.
+
+Only the top level of the directories is listed in each cycle. The sizes of
+the entries are kept in ``reaper.sqlite`` in the state directory and only
+measured again when the modification time of an entry changed or its job
+finished since the last cycle.
+"""
+
+import os
+import re
+import time
+import fcntl
+import shutil
+import sqlite3
+import threading
+
+from pywps import configuration, dblog
+
+from copernicus import util
+from copernicus import cache
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+UUID = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+WORKDIR_PREFIX = 'pywps_process_'
+# file in the working directory with the uuid of its job
+JOB_MARKER = '.copernicus-job'
+# seconds between two recorded downloads of the outputs of a job
+USE_INTERVAL = 600
+
+_used = {}
+_reaper = None
+
+
+def reaper_database():
+    return os.path.join(util.state_directory(), 'reaper.sqlite')
+
+
+def connect(database=None):
+    conn = sqlite3.connect(database or reaper_database(), timeout=30)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS entries (path TEXT PRIMARY KEY, kind TEXT, uuid TEXT, "
+        "mtime REAL, size INTEGER, finished INTEGER)")
+    conn.execute("CREATE TABLE IF NOT EXISTS used (uuid TEXT PRIMARY KEY, time REAL)")
+    return conn
+
+
+def get_quotas():
+    """Return the quotas of the kinds of entries as ``(max bytes, max seconds)``."""
+    quotas = {}
+    for kind in ['outputs', 'workdir']:
+        max_size = str(configuration.get_config_value('reaper', '{0}_max_size'.format(kind)) or 0)
+        max_age = configuration.get_config_value('reaper', '{0}_max_age'.format(kind)) or 0
+        max_size = 0 if max_size == '0' else int(configuration.get_size_mb(max_size) * 1024 ** 2)
+        quotas[kind] = (max_size, float(max_age) * 86400)
+    return quotas
+
+
+def protect_age():
+    return float(configuration.get_config_value('reaper', 'protect_age') or 1) * 86400
+
+
+def mark_used(filename):
+    """Record the download of an output file."""
+    outputpath = os.path.abspath(configuration.get_config_value('server', 'outputpath'))
+    uuid = os.path.relpath(filename, outputpath).split(os.sep)[0]
+    now = time.time()
+    if not UUID.match(uuid) or now - _used.get(uuid, 0) < USE_INTERVAL:
+        return
+    _used[uuid] = now
+    try:
+        conn = connect()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO used VALUES (?, ?)", (uuid, now))
+        conn.close()
+    except sqlite3.Error:
+        LOGGER.exception("could not record the use of %s", uuid)
+
+
+def active_jobs():
+    """Return the uuids of queued and running jobs from the PyWPS database."""
+    session = dblog.get_session()
+    try:
+        stored = set(uuid for uuid, in session.query(dblog.RequestInstance.uuid))
+        running = (session.query(dblog.ProcessInstance.uuid)
+                   .filter(dblog.ProcessInstance.operation == 'execute')
+                   .filter((dblog.ProcessInstance.percent_done < 100) | (dblog.ProcessInstance.percent_done.is_(None))))
+        return stored | set(uuid for uuid, in running)
+    finally:
+        session.close()
+
+
+def referenced_jobs(outputpath, max_age):
+    """Return the uuids of the recent status documents and of the outputs they reference."""
+    uuids = set()
+    now = time.time()
+    with os.scandir(outputpath) as entries:
+        for entry in entries:
+            uuid, ext = os.path.splitext(entry.name)
+            if ext != '.xml' or not UUID.match(uuid) or now - entry.stat().st_mtime > max_age:
+                continue
+            uuids.add(uuid)
+            try:
+                with open(entry.path) as fp:
+                    uuids.update(re.findall(r'/([0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12})/',
+                                            fp.read()))
+            except (IOError, OSError):
+                pass
+    return uuids
+
+
+def job_of(path):
+    try:
+        with open(os.path.join(path, JOB_MARKER)) as fp:
+            return fp.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+class Reaper(object):
+    """Enforce the quotas on the outputs and working directories.
+
+    :param outputpath: outputs directory of PyWPS.
+    :param workdir: working directory of PyWPS.
+    :param quotas: dict of ``outputs`` and ``workdir`` to ``(max bytes, max seconds)``,
+                   0 for no limit.
+    :param protect_age: seconds in which status documents protect their outputs.
+    """
+
+    def __init__(self, outputpath, workdir, quotas, protect_age=86400, database=None):
+        self.roots = {'outputs': os.path.abspath(outputpath), 'workdir': os.path.abspath(workdir)}
+        self.quotas = quotas
+        self.protect_age = protect_age
+        self.database = database
+
+    def scan(self, conn, protected):
+        """Update the index from the top level of the directories."""
+        known = dict((row[0], row[1:]) for row in conn.execute("SELECT path, mtime, finished FROM entries"))
+        seen = set()
+        for kind, root in sorted(self.roots.items()):
+            try:
+                entries = list(os.scandir(root))
+            except OSError:
+                continue
+            for entry in entries:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                if kind == 'outputs' and not UUID.match(entry.name):
+                    continue
+                if kind == 'workdir' and not entry.name.startswith(WORKDIR_PREFIX):
+                    continue
+                if entry.path in seen:
+                    # outputs and working directories in the same directory
+                    continue
+                seen.add(entry.path)
+                mtime = entry.stat().st_mtime
+                uuid = entry.name if kind == 'outputs' else job_of(entry.path)
+                finished = uuid not in protected
+                if entry.path in known and known[entry.path] == (mtime, int(finished)):
+                    continue
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                             (entry.path, kind, uuid, mtime, cache.tree_size(entry.path), int(finished)))
+        for path in set(known) - seen:
+            conn.execute("DELETE FROM entries WHERE path = ?", (path,))
+
+    def is_protected(self, uuid, mtime, protected, now):
+        if uuid in protected:
+            return True
+        # working directories of unknown jobs which are still in use
+        return uuid is None and now - mtime < self.protect_age
+
+    def candidates(self, conn, kind, protected, now):
+        """Return the removable entries, least recently used first."""
+        rows = conn.execute(
+            "SELECT e.path, e.uuid, e.mtime, e.size, u.time FROM entries e LEFT JOIN used u ON e.uuid = u.uuid "
+            "WHERE e.kind = ?", (kind,)).fetchall()
+        total = sum(row[3] for row in rows)
+        entries = []
+        for path, uuid, mtime, size, used in rows:
+            if not self.is_protected(uuid, mtime, protected, now):
+                entries.append((max(mtime, used or 0), path, uuid, size))
+        return sorted(entries), total
+
+    def remove(self, conn, kind, path, uuid):
+        shutil.rmtree(path, ignore_errors=True)
+        conn.execute("DELETE FROM entries WHERE path = ?", (path,))
+        if kind == 'outputs':
+            conn.execute("DELETE FROM used WHERE uuid = ?", (uuid,))
+            status_file = os.path.join(self.roots['outputs'], '{0}.xml'.format(uuid))
+            if os.path.exists(status_file):
+                os.remove(status_file)
+
+    def run(self, dry_run=False):
+        """Run one cycle, return the removed paths and bytes."""
+        now = time.time()
+        protected = active_jobs() | referenced_jobs(self.roots['outputs'], self.protect_age)
+        removed = []
+        conn = connect(self.database)
+        try:
+            with conn:
+                self.scan(conn, protected)
+            for kind in ['outputs', 'workdir']:
+                max_size, max_age = self.quotas[kind]
+                entries, total = self.candidates(conn, kind, protected, now)
+                for last_used, path, uuid, size in entries:
+                    expired = max_age and now - last_used > max_age
+                    if not expired and not (max_size and total > max_size):
+                        continue
+                    LOGGER.info("removing %s of job %s, %s bytes", path, uuid, size)
+                    if not dry_run:
+                        with conn:
+                            self.remove(conn, kind, path, uuid)
+                    total -= size
+                    removed.append((path, size))
+        finally:
+            conn.close()
+        return removed
+
+
+def get_reaper():
+    return Reaper(
+        configuration.get_config_value('server', 'outputpath'),
+        configuration.get_config_value('server', 'workdir'),
+        get_quotas(),
+        protect_age())
+
+
+def reap(dry_run=False):
+    """Run one cycle unless another process is running one."""
+    with open(os.path.join(util.state_directory(), 'reaper.lock'), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            LOGGER.debug("reaper is running in another process")
+            return []
+        return get_reaper().run(dry_run)
+
+
+def loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            removed = reap()
+            if removed:
+                LOGGER.info("reaper removed %s entries, %s bytes", len(removed), sum(size for _, size in removed))
+        except Exception:
+            LOGGER.exception("reaper failed")
+
+
+def start_reaper():
+    """Start the reaper thread configured in the ``[reaper]`` section."""
+    global _reaper
+    if _reaper is not None or configuration.get_config_value('reaper', 'enabled') is False:
+        return
+    interval = float(configuration.get_config_value('reaper', 'interval') or 600)
+    _reaper = threading.Thread(target=loop, args=(interval,), name='reaper')
+    _reaper.daemon = True
+    _reaper.start()
@@ -0,0 +1,126 @@
+"""Lazy registry of the WPS processes.
+
+GetCapabilities only needs the identifier, title, abstract, version, keywords
+and metadata of each process. The registry keeps these as lightweight
+descriptors and constructs the full :class:`pywps.Process` (with its inputs
+and outputs) only when DescribeProcess or Execute asks for it.
+
+The descriptors are persisted in the state directory, keyed by the size and
+mtime of the process modules and of the modules with the versions and
+metadata links of the processes, so a restarted server does not need to import
+and construct any process to answer GetCapabilities.
+"""
+
+import os
+import json
+import hashlib
+import importlib
+import collections
+from importlib.util import find_spec
+
+from copernicus import util
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# keys of the process json not needed by GetCapabilities
+HEAVY_KEYS = ['inputs', 'outputs', 'uuid', 'workdir']
+# modules with the package version, the process version and the metadata links of the descriptors
+SHARED_MODULES = ['copernicus', 'copernicus.runner', 'copernicus.util']
+
+
+class ProcessDescriptor(object):
+    """Descriptor of a process which is constructed on first use.
+
+    :param identifier: identifier of the process.
+    :param path: ``module:Class`` of the process.
+    """
+
+    def __init__(self, identifier, path, info=None):
+        self.identifier = identifier
+        self.path = path
+        self.info = info
+        self._process = None
+
+    def load(self):
+        if self._process is None:
+            module_name, class_name = self.path.split(':')
+            self._process = getattr(importlib.import_module(module_name), class_name)()
+            if self._process.identifier != self.identifier:
+                raise Exception('process {0} has identifier {1}'.format(self.path, self._process.identifier))
+            LOGGER.debug("loaded process %s", self.identifier)
+        return self._process
+
+    @property
+    def json(self):
+        """Process json without inputs and outputs, used by GetCapabilities."""
+        if self.info is None:
+            info = dict(self.load().json)
+            for key in HEAVY_KEYS:
+                info.pop(key, None)
+            self.info = info
+        return dict(self.info, inputs=[], outputs=[])
+
+    def __getattr__(self, name):
+        # all other attributes come from the process
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
+
+
+class ProcessRegistry(collections.OrderedDict):
+    """Mapping of identifiers to processes for :class:`pywps.Service`.
+
+    ``registry[identifier]`` returns the constructed process,
+    ``registry.values()`` the descriptors.
+    """
+
+    def __init__(self, processes):
+        super(ProcessRegistry, self).__init__()
+        for identifier, path in processes:
+            collections.OrderedDict.__setitem__(self, identifier, ProcessDescriptor(identifier, path))
+
+    def __getitem__(self, identifier):
+        return collections.OrderedDict.__getitem__(self, identifier).load()
+
+    def descriptors(self):
+        return list(collections.OrderedDict.values(self))
+
+    def reset(self):
+        """Construct the processes again on their next use."""
+        for descriptor in self.descriptors():
+            descriptor._process = None
+
+    def load_all(self):
+        """Construct and return all processes."""
+        return [descriptor.load() for descriptor in self.descriptors()]
+
+    def fingerprint(self):
+        checksum = hashlib.sha256()
+        paths = [(descriptor.identifier, descriptor.path) for descriptor in self.descriptors()]
+        for name, path in paths + [(module_name, module_name) for module_name in SHARED_MODULES]:
+            stat = os.stat(find_spec(path.split(':')[0]).origin)
+            checksum.update('{0} {1} {2} {3}'.format(name, path, stat.st_size, stat.st_mtime).encode('utf-8'))
+        return checksum.hexdigest()
+
+    def load_descriptors(self, path=None):
+        """Read the persisted descriptors or build and persist them."""
+        path = path or os.path.join(util.state_directory(), 'processes-{0}.json'.format(self.fingerprint()[:16]))
+        try:
+            with open(path) as fp:
+                infos = json.load(fp)
+        except (IOError, OSError, ValueError):
+            infos = {}
+        descriptors = self.descriptors()
+        if all(descriptor.identifier in infos for descriptor in descriptors):
+            for descriptor in descriptors:
+                descriptor.info = infos[descriptor.identifier]
+            return
+        infos = dict((descriptor.identifier, descriptor.json) for descriptor in descriptors)
+        try:
+            tmp_path = '{0}.{1}'.format(path, os.getpid())
+            with open(tmp_path, 'w') as fp:
+                json.dump(infos, fp)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            LOGGER.warning("could not persist process descriptors in %s", path)
@@ -1,25 +1,96 @@
 import os
-import glob
 import sys
-import zipfile
 
-from jinja2 import Environment, PackageLoader, select_autoescape
+import yaml
+import psutil
+from jinja2 import Environment, PackageLoader, FileSystemBytecodeCache, select_autoescape
 
 from pywps import configuration
+from pywps import dblog
+
+from copernicus import archive
+from copernicus import cache
+from copernicus import instrument
+from copernicus import manifest
+from copernicus import preflight as preflight_check
+from copernicus import preproc_cache
+from copernicus import progress
+from copernicus import workerpool
 
 import logging
 LOGGER = logging.getLogger("PYWPS")
 
 template_env = Environment(
-    loader=PackageLoader('copernicus', '/templates/esmvaltool'),
-    autoescape=select_autoescape(['yml', ])
+    loader=PackageLoader('copernicus', 'templates/esmvaltool'),
+    autoescape=select_autoescape(['yml', ]),
+    # templates are part of the package and do not change at runtime
+    auto_reload=False,
+    cache_size=-1,
+    bytecode_cache=FileSystemBytecodeCache(),
 )
 
 VERSION = "2.0.0"
 
+# placeholder for the job specific output_dir in the memoized config.yml
+OUTPUT_DIR_MARKER = '@@OUTPUT_DIR@@'
+
+# rendered config.yml by server config and output format
+_rendered_configs = {}
+# recipe templates which have already been validated
+_validated_recipes = set()
+
+
+def compile_templates():
+    """Load and compile all esmvaltool templates, for example at startup."""
+    for name in template_env.list_templates(extensions=['yml']):
+        template_env.get_template(name)
+
+
+def run(recipe_file, config_file, response=None):
+    """Run esmvaltool
+
+    The result is looked up in the result cache first and stored there
+    after a successful run. ESMValTool itself is run in the worker pool
+    if one is configured. If a ``response`` is given, the progress of the
+    run is reported from the ESMValTool log.
+    """
+    output_dir = cache.read_yaml(config_file)['output_dir']
+    result_cache = cache.get_cache()
+    if result_cache:
+        # input files resolved by the pre-flight check, if it was run
+        cache_key = cache.cache_key(recipe_file, config_file, files=preflight_check.cached_files(recipe_file))
+        result = result_cache.lookup(cache_key, output_dir)
+        instrument.increment('result_cache_hits' if result else 'result_cache_misses')
+        if result:
+            manifest.register(os.path.dirname(result[3]))
+            return result
+    log_progress = None
+    if response is not None:
+        log_progress = progress.LogProgress(output_dir, response)
+        log_progress.start()
+    try:
+        result = workerpool.call('copernicus.runner._run', recipe_file, config_file)
+    finally:
+        if log_progress:
+            log_progress.stop()
+    if result_cache:
+        result_cache.store(cache_key, *result)
+    # index the output tree once for all following get_output calls
+    manifest.register(os.path.dirname(result[3]))
+    return result
+
+
+def preflight(recipe_file, config_file):
+    """Check that the input data of the recipe is available before running it.
+
+    Raises an exception naming the missing data, see :mod:`copernicus.preflight`.
+    """
+    if configuration.get_config_value('esmvaltool', 'preflight') is False:
+        return None
+    return preflight_check.check(recipe_file, config_file)
+
 
-def run(recipe_file, config_file):
-    """Run esmvaltool"""
+def _run(recipe_file, config_file):
     from esmvaltool._main import configure_logging, read_config_user_file, process_recipe
     recipe_name = os.path.splitext(os.path.basename(recipe_file))[0]
     cfg = read_config_user_file(config_file, recipe_name)
@@ -42,6 +113,13 @@ def run(recipe_file, config_file):
     # ncl_version_check()
 
     cfg['synda_download'] = False
+    # read the input files resolved by the pre-flight check instead of searching the data roots
+    cfg['rootpath'] = preflight_check.link_inputs(recipe_file, cfg['rootpath'])
+
+    # share preprocessed data with other runs
+    store = preproc_cache.get_store()
+    if store:
+        preproc_cache.install(store)
 
     try:
         LOGGER.info("run esmvaltool ...")
@@ -64,13 +142,7 @@ def generate_recipe(diag, constraints=None, options=None, start_year=2000, end_y
     workdir = os.path.abspath(workdir)
     output_dir = os.path.join(workdir, 'output')
     # write config.yml
-    config_templ = template_env.get_template('config.yml')
-    rendered_config = config_templ.render(
-        archive_root=configuration.get_config_value("data", "archive_root"),
-        obs_root=configuration.get_config_value("data", "obs_root"),
-        output_dir=output_dir,
-        output_format=output_format,
-    )
+    rendered_config = render_config(output_format).replace(OUTPUT_DIR_MARKER, output_dir)
     config_file = os.path.abspath(os.path.join(workdir, "config.yml"))
     with open(config_file, 'w') as fp:
         fp.write(rendered_config)
@@ -84,21 +156,89 @@ def generate_recipe(diag, constraints=None, options=None, start_year=2000, end_y
         constraints=constraints,
         start_year=start_year,
         end_year=end_year,
-	options=options,
+        options=options,
     )
+    if recipe not in _validated_recipes:
+        validate_recipe(recipe, rendered_recipe)
+        _validated_recipes.add(recipe)
     recipe_file = os.path.abspath(os.path.join(workdir, "recipe.yml"))
     with open(recipe_file, 'w') as fp:
         fp.write(rendered_recipe)
     return recipe_file, config_file
 
 
+def render_config(output_format='pdf'):
+    """Render config.yml with a placeholder for the output_dir.
+
+    The result only depends on the server configuration and the output format
+    and is memoized.
+    """
+    values = dict(
+        archive_root=configuration.get_config_value("data", "archive_root"),
+        obs_root=configuration.get_config_value("data", "obs_root"),
+        output_format=output_format,
+        max_parallel_tasks=max_parallel_tasks(),
+    )
+    key = tuple(sorted(values.items()))
+    if key not in _rendered_configs:
+        config_templ = template_env.get_template('config.yml')
+        _rendered_configs[key] = config_templ.render(output_dir=OUTPUT_DIR_MARKER, **values)
+    return _rendered_configs[key]
+
+
+def max_parallel_tasks():
+    """Return the number of parallel ESMValTool tasks of a new job.
+
+    With ``max_parallel_tasks = auto`` the cores of the host are shared by
+    the jobs which may run at the same time: the PyWPS ``parallelprocesses``
+    or the number of currently running jobs if that is larger.
+    """
+    value = configuration.get_config_value('esmvaltool', 'max_parallel_tasks') or 'auto'
+    if value != 'auto':
+        return max(1, int(value))
+    cores = psutil.cpu_count() or 1
+    parallelprocesses = int(configuration.get_config_value('server', 'parallelprocesses') or 1)
+    try:
+        running, _ = dblog.get_process_counts()
+    except Exception:
+        LOGGER.debug("could not count running jobs")
+        running = 1
+    return max(1, cores // max(parallelprocesses, running, 1))
+
+
+def max_workers(section):
+    """Return the processes of a native engine configured by ``workers`` in
+    ``section``, ``auto`` shares the host cores like :func:`max_parallel_tasks`.
+    """
+    value = configuration.get_config_value(section, 'workers') or 'auto'
+    if value == 'auto':
+        return max_parallel_tasks()
+    return max(1, int(value))
+
+
+def validate_recipe(name, rendered_recipe):
+    """Check that a rendered recipe is valid YAML with the sections
+    and dataset keys needed by ESMValTool.
+    """
+    try:
+        recipe = yaml.safe_load(rendered_recipe)
+    except yaml.YAMLError as err:
+        raise Exception('invalid recipe {0}: {1}'.format(name, err))
+    for section in ('datasets', 'diagnostics'):
+        if not isinstance(recipe.get(section), (list, dict)):
+            raise Exception('invalid recipe {0}: missing section {1}'.format(name, section))
+    for dataset in recipe['datasets']:
+        missing = {'dataset', 'project', 'start_year', 'end_year'} - set(dataset)
+        if missing:
+            raise Exception('invalid recipe {0}: dataset without {1}'.format(name, ', '.join(sorted(missing))))
+
+
 def get_output(output_dir, path_filter, name_filter=None, output_format='pdf'):
     name_filter = name_filter or '*'
     # output/recipe_20180130_111116/plots/diagnostic1/script1/MultiModelMean_T3M_ta_2001-2002_mean.pdf
-    output_filter = os.path.join(
-        output_dir, path_filter, '{0}.{1}'.format(name_filter, output_format))
-    LOGGER.debug("output_fitler %s", output_filter)
-    matches = glob.glob(output_filter)
+    LOGGER.debug("output_filter %s", os.path.join(output_dir, path_filter, name_filter))
+    matches = manifest.get_manifest(output_dir).find(
+        output_dir, path_filter, name_filter=name_filter, output_format=output_format)
     if len(matches) == 0:
         LOGGER.info("output_dir=%s", output_dir)
         raise Exception("no output found in output dir.")
@@ -107,13 +247,5 @@ def get_output(output_dir, path_filter, name_filter=None, output_format='pdf'):
     LOGGER.debug("output found=%s", matches[0])
     return matches[0]
 
-def compress_output(output_dir, archive_file):
-    with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as ziph:
-        for root, dirs, files in os.walk(output_dir):
-            for file in files:
-                path = os.path.join(root, file)
-                arcname = os.path.relpath(path, output_dir)
-                ziph.write(path, arcname)
-
-    return archive_file
-
+def compress_output(output_dir, archive_file, response=None):
+    return archive.build_archive(output_dir, archive_file, response=response)
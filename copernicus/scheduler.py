@@ -0,0 +1,412 @@
+"""Priority scheduling of asynchronous jobs.
+
+PyWPS runs an async Execute request immediately while less than
+``parallelprocesses`` jobs are running and otherwise stores it in its job
+queue, which is worked off first come, first served. The scheduler replaces
+this order: every async request goes through the queue and the next job is
+chosen by
+
+* the priority class of its process (``high``, ``normal`` or ``low``),
+* fair share: the process with the least running (and already chosen) jobs,
+* the time of the request.
+
+A process is skipped while it has reached its ``max_running`` cap. The
+status document of a queued job reports its position in the queue.
+
+The queue is the job queue of PyWPS in its database, so it is shared by all
+server processes. A job is chosen and removed from the queue in one
+transaction, which first updates the row of ``copernicus_scheduler``, so the
+servers claim their jobs one after another and the caps hold. Configured in the ``[scheduler]`` section::
+
+    [scheduler]
+    enabled = true
+    high_priority = sleep, shape_select
+    low_priority = ensclus
+    max_running = ensclus:2, cvdp:1
+
+The scheduler overrides private methods of :class:`pywps.Process` and its
+response (``_execute_process``, ``_run_process``, ``_set_uuid``,
+``_setup_status_storage``, ``_update_status_doc`` and
+``_update_status_file``). They were written against PyWPS 4.8, which is
+pinned in the requirements, and their parameters are checked on import.
+"""
+
+import os
+import copy
+import json
+import time
+import inspect
+
+import sqlalchemy
+
+import pywps
+from pywps import Process, configuration, dblog
+from pywps.app.WPSRequest import WPSRequest
+from pywps.exceptions import ServerBusy
+from pywps.response.execute import ExecuteResponse
+from pywps.response.status import WPS_STATUS
+
+from copernicus import coalesce
+from copernicus import instrument
+from copernicus import reaper
+from copernicus import statusdb
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+PRIORITIES = {'high': 2, 'normal': 1, 'low': 0}
+# queued jobs which get their position updated when a job is started
+MAX_POSITION_UPDATES = 50
+
+# parameters of the PyWPS 4.8 methods which are overridden or called
+PYWPS_METHODS = [
+    (Process, '_execute_process', ['self', 'async_', 'wps_request', 'wps_response']),
+    (Process, '_run_process', ['self', 'wps_request', 'wps_response']),
+    (Process, '_run_async', ['self', 'wps_request', 'wps_response']),
+    (Process, 'launch_next_process', ['self']),
+    (Process, '_set_uuid', ['self', 'uuid']),
+    (Process, '_setup_status_storage', ['self']),
+    (ExecuteResponse, '_update_status', ['self', 'status', 'message', 'status_percentage', 'clean']),
+    (ExecuteResponse, '_update_status_doc', ['self']),
+    (ExecuteResponse, '_update_status_file', ['self']),
+]
+
+# the row updated first by every claim of a job
+claims_table = sqlalchemy.Table(
+    'copernicus_scheduler', sqlalchemy.MetaData(),
+    sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column('claimed', sqlalchemy.Float))
+# databases which have the claims table
+_claims_created = set()
+
+
+def check_pywps(methods=None):
+    """Return the PyWPS methods whose parameters differ from the ones the
+    scheduler was written for.
+    """
+    changed = []
+    for cls, name, parameters in methods or PYWPS_METHODS:
+        method = getattr(cls, name, None)
+        if method is None or list(inspect.signature(method).parameters) != parameters:
+            changed.append('{0}.{1}'.format(cls.__name__, name))
+    return changed
+
+
+_changed = check_pywps()
+if _changed:
+    raise ImportError('the scheduler does not support PyWPS {0}, changed methods: {1}'.format(
+        pywps.__version__, ', '.join(_changed)))
+
+
+def is_enabled():
+    return configuration.get_config_value('scheduler', 'enabled') is not False
+
+
+def config_list(option):
+    value = configuration.get_config_value('scheduler', option) or ''
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def priority(identifier):
+    if identifier in config_list('high_priority'):
+        return PRIORITIES['high']
+    if identifier in config_list('low_priority'):
+        return PRIORITIES['low']
+    return PRIORITIES['normal']
+
+
+def max_running():
+    """Return the caps of running jobs per process from ``max_running``."""
+    caps = {}
+    for item in config_list('max_running'):
+        identifier, _, limit = item.partition(':')
+        caps[identifier.strip()] = int(limit)
+    return caps
+
+
+def order(queued, running, priorities=None):
+    """Return the queued jobs in the order they are started.
+
+    :param queued: list of ``(uuid, identifier, time)`` of the queued jobs.
+    :param running: dict of identifiers to their number of running jobs.
+    :param priorities: dict of identifiers to their priority class.
+    """
+    priorities = priorities or {}
+    running = dict(running)
+    pending = sorted(queued, key=lambda job: job[2])
+    result = []
+    while pending:
+        job = min(pending, key=lambda job: (
+            -priorities.get(job[1], PRIORITIES['normal']), running.get(job[1], 0), job[2]))
+        pending.remove(job)
+        running[job[1]] = running.get(job[1], 0) + 1
+        result.append(job)
+    return result
+
+
+def read_queue(session):
+    stored = session.query(dblog.RequestInstance.uuid)
+    running = {}
+    jobs = (session.query(dblog.ProcessInstance.identifier)
+            .filter(dblog.ProcessInstance.percent_done < 100)
+            .filter(dblog.ProcessInstance.percent_done > -1)
+            .filter(~dblog.ProcessInstance.uuid.in_(stored)))
+    for identifier, in jobs:
+        running[identifier] = running.get(identifier, 0) + 1
+    queued = [(job.uuid, job.identifier, job.time_start) for job in
+              session.query(dblog.ProcessInstance).filter(dblog.ProcessInstance.uuid.in_(stored))]
+    priorities = dict((identifier, priority(identifier)) for _, identifier, _ in queued)
+    return order(queued, running, priorities), running
+
+
+def get_queue():
+    """Return the queued jobs in the order they are started and the number
+    of running jobs per process.
+    """
+    session = dblog.get_session()
+    try:
+        return read_queue(session)
+    finally:
+        session.close()
+
+
+def lock_queue(session):
+    """Update the row of the claims table, which holds off the claims of the
+    other servers until the transaction of the session ends.
+    """
+    bind = session.get_bind()
+    if str(bind.url) not in _claims_created:
+        try:
+            claims_table.create(bind, checkfirst=True)
+            with bind.begin() as conn:
+                conn.execute(claims_table.insert().values(id=1, claimed=time.time()))
+        except sqlalchemy.exc.SQLAlchemyError:
+            # created by another server
+            pass
+        _claims_created.add(str(bind.url))
+    session.execute(claims_table.update().where(claims_table.c.id == 1).values(claimed=time.time()))
+
+
+def claim_next():
+    """Remove the next job from the queue.
+
+    Returns its uuid and request and the queue it was chosen from, the uuid
+    is None when no job may start.
+    """
+    session = dblog.get_session()
+    try:
+        lock_queue(session)
+        queue, running = read_queue(session)
+        uuid = next_job(queue, running)
+        request_json = None
+        if uuid is not None:
+            request_json = session.query(dblog.RequestInstance).filter_by(uuid=uuid).first().request
+            session.query(dblog.RequestInstance).filter_by(uuid=uuid).delete()
+        session.commit()
+    finally:
+        session.close()
+    return uuid, request_json, queue
+
+
+def next_job(queue, running):
+    """Return the uuid of the job to start next or None."""
+    maxparallel = int(configuration.get_config_value('server', 'parallelprocesses'))
+    if maxparallel != -1 and sum(running.values()) >= maxparallel:
+        return None
+    caps = max_running()
+    for uuid, identifier, _ in queue:
+        if identifier not in caps or running.get(identifier, 0) < caps[identifier]:
+            return uuid
+    return None
+
+
+def store_request(uuid, wps_request, workdir):
+    """Store the request in the job queue, like :func:`pywps.dblog.store_process`,
+    with the working directory which already has its input files.
+    """
+    request_json = dict(json.loads(wps_request.json), scheduler_workdir=workdir)
+    session = dblog.get_session()
+    try:
+        session.add(dblog.RequestInstance(uuid=str(uuid), request=json.dumps(request_json).encode('utf-8')))
+        session.commit()
+    finally:
+        session.close()
+
+
+def pop_stored(uuid):
+    """Remove the job from the queue, return its request or None when
+    another process took it.
+    """
+    session = dblog.get_session()
+    try:
+        request = session.query(dblog.RequestInstance).filter_by(uuid=uuid).first()
+        if request is None:
+            return None
+        if session.query(dblog.RequestInstance).filter_by(uuid=uuid).delete() == 0:
+            return None
+        session.commit()
+        return request.request
+    finally:
+        session.close()
+
+
+def queue_message(position, length):
+    return 'PyWPS Process stored in job queue, position {0} of {1}'.format(position, length)
+
+
+class QueuedResponse(ExecuteResponse):
+    """Execute response which keeps the message of accepted jobs, like
+    their position in the queue.
+    """
+
+    @property
+    def json(self):
+        message = self.message
+        data = super(QueuedResponse, self).json
+        if self.status == WPS_STATUS.ACCEPTED:
+            self.message = data['status']['message'] = message
+        return data
+
+    def _update_status(self, status, message, status_percentage, clean=True):
+        # like ExecuteResponse._update_status, with the batched status store
+        self.message = message
+        self.status = status
+        self.status_percentage = status_percentage
+        statusdb.store_status(self.uuid, status, message, status_percentage)
+        self._update_status_doc()
+        if self.store_status_file:
+            self._update_status_file()
+        if clean and status in (WPS_STATUS.SUCCEEDED, WPS_STATUS.FAILED):
+            self.process.clean()
+        if status == WPS_STATUS.SUCCEEDED:
+            # the outputs are in the outputs directory now
+            instrument.record_outputs(self.process.identifier, self.uuid)
+        if self.store_status_file and coalesce.is_enabled(self.process.identifier):
+            coalesce.propagate(self)
+
+
+class ScheduledProcess(Process):
+    """:class:`pywps.Process` whose async jobs are started by the scheduler."""
+
+    def _execute_process(self, async_, wps_request, wps_response):
+        if not async_ or not is_enabled():
+            return super(ScheduledProcess, self)._execute_process(async_, wps_request, wps_response)
+        dblog.cleanup_crashed_process()
+        if coalesce.is_enabled(self.identifier):
+            leader = coalesce.attach(coalesce.request_key(self.identifier, wps_request), self.uuid)
+            if leader != str(self.uuid):
+                return self.attach_to(leader, wps_request)
+        _, stored = dblog.get_process_counts()
+        LOGGER.debug("Store process in job queue, uuid={}".format(self.uuid))
+        store_request(self.uuid, wps_request, self.workdir)
+        wps_response = QueuedResponse(wps_request, process=self, uuid=self.uuid)
+        wps_response.store_status_file = True
+        queue, running = get_queue()
+        if next_job(queue, running) == str(self.uuid):
+            message = "PyWPS Request accepted"
+        else:
+            maxprocesses = int(configuration.get_config_value('server', 'maxprocesses'))
+            if stored >= maxprocesses != -1:
+                pop_stored(str(self.uuid))
+                if coalesce.is_enabled(self.identifier):
+                    coalesce.release(self.uuid)
+                self.clean()
+                raise ServerBusy('Maximum number of processes in queue reached. Please try later.')
+            positions = [job[0] for job in queue]
+            message = queue_message(positions.index(str(self.uuid)) + 1, len(positions))
+        wps_response._update_status(WPS_STATUS.ACCEPTED, message, 0)
+        self.launch_next_process()
+        return wps_response
+
+    def attach_to(self, leader, wps_request):
+        """Respond with a job which gets the status updates of the leader."""
+        LOGGER.info("Attached request {} to the identical job {}".format(self.uuid, leader))
+        wps_response = QueuedResponse(wps_request, process=self, uuid=self.uuid)
+        wps_response.store_status_file = True
+        # written when the leader crashes
+        wps_response.status = WPS_STATUS.FAILED
+        wps_response.message = 'The identical job {0} did not finish'.format(leader)
+        wps_response._update_status_doc()
+        coalesce.set_failed_doc(self.uuid, wps_response.doc)
+        # not stored in the PyWPS database, the job does not count as running
+        wps_response.status = WPS_STATUS.ACCEPTED
+        wps_response.message = 'PyWPS Process attached to the identical job {0}'.format(leader)
+        wps_response.status_percentage = 0
+        wps_response._update_status_doc()
+        wps_response._update_status_file()
+        self.clean()
+        return wps_response
+
+    def _run_process(self, wps_request, wps_response):
+        if self.workdir and os.path.isdir(self.workdir):
+            # lets the reaper find the job of the working directory
+            with open(os.path.join(self.workdir, reaper.JOB_MARKER), 'w') as fp:
+                fp.write(str(self.uuid))
+        return super(ScheduledProcess, self)._run_process(wps_request, wps_response)
+
+    def launch_next_process(self):
+        if not is_enabled():
+            return super(ScheduledProcess, self).launch_next_process()
+        try:
+            started = False
+            while True:
+                uuid, request_json, queue = claim_next()
+                if uuid is None:
+                    break
+                self.launch_stored(uuid, request_json)
+                started = True
+            if started:
+                self.update_positions(queue)
+        except Exception as e:
+            LOGGER.exception("Could not run stored process. {}".format(e))
+
+    def restore(self, uuid, request_json, prepare=True):
+        """Return the process and response of a stored request."""
+        wps_request = WPSRequest()
+        request_json = json.loads(request_json.decode('utf-8'))
+        workdir = request_json.pop('scheduler_workdir', None)
+        # This request was saved by PyWPS, so it is trusted.
+        wps_request.restore_json(request_json)
+        if prepare and workdir and os.path.isdir(workdir):
+            # the working directory of the accepted request, with its input files
+            process = copy.deepcopy(self.service.processes[wps_request.identifier])
+            process.service = self.service
+            process.set_workdir(workdir)
+        elif prepare:
+            process = self.service.prepare_process_for_execution(wps_request.identifier)
+        else:
+            process = copy.deepcopy(self.service.processes[wps_request.identifier])
+        process._set_uuid(uuid)
+        process._setup_status_storage()
+        process.async_ = True
+        process.setup_outputs_from_wps_request(wps_request)
+        wps_response = QueuedResponse(wps_request, process=process, uuid=uuid)
+        wps_response.store_status_file = True
+        return process, wps_request, wps_response
+
+    def launch_stored(self, uuid, request_json):
+        LOGGER.debug("Launching the stored request {}".format(uuid))
+        process, wps_request, wps_response = self.restore(uuid, request_json)
+        process._run_async(wps_request, wps_response)
+
+    def update_positions(self, queue):
+        """Write the queue position into the status documents of queued jobs
+        whose position has changed.
+        """
+        session = dblog.get_session()
+        try:
+            requests = dict((request.uuid, request.request) for request in session.query(dblog.RequestInstance))
+            messages = dict(session.query(dblog.ProcessInstance.uuid, dblog.ProcessInstance.message)
+                            .filter(dblog.ProcessInstance.uuid.in_(list(requests))))
+        finally:
+            session.close()
+        queue = [job for job in queue if job[0] in requests]
+        for position, (uuid, _, _) in enumerate(queue[:MAX_POSITION_UPDATES], 1):
+            message = queue_message(position, len(queue))
+            if messages.get(uuid) == message:
+                continue
+            try:
+                _, _, wps_response = self.restore(uuid, requests[uuid], prepare=False)
+                wps_response._update_status(WPS_STATUS.ACCEPTED, message, 0, False)
+            except Exception:
+                LOGGER.exception("Could not update the queue position of {}".format(uuid))
@@ -0,0 +1,118 @@
+"""PyWPS service with cached GetCapabilities and DescribeProcess documents.
+
+The documents only depend on the processes and the configuration of the
+service. They are rendered once for each distinct GET request, kept in
+memory with their gzip compressed body and served with a strong ETag for
+each encoding, so clients polling them get a ``304 Not Modified``. The cache is cleared when
+the processes of the service are replaced. The processes offer the datasets
+of the data catalogue, so they are constructed again and the cache is cleared
+when the catalogue changes. A new configuration needs a (graceful) restart of
+the service, which starts with an empty cache.
+"""
+
+import gzip
+import hashlib
+import threading
+
+from werkzeug.http import parse_accept_header, parse_etags
+from werkzeug.wrappers import Response
+from pywps import Service
+
+from copernicus import catalogue
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+CACHED_OPERATIONS = ['getcapabilities', 'describeprocess']
+# query parameters which select a document
+KEY_PARAMETERS = ['service', 'request', 'version', 'acceptversions', 'identifier', 'language']
+# maximum number of cached documents
+MAX_DOCUMENTS = 256
+
+
+class Document(object):
+    """A rendered document with its gzip compressed body."""
+
+    def __init__(self, data, content_type):
+        self.data = data
+        self.gzip_data = gzip.compress(data, 6)
+        self.content_type = content_type
+        self.etag = hashlib.sha256(data).hexdigest()[:32]
+
+    def response(self, http_request):
+        # the gzip body is a different representation with its own strong ETag
+        use_gzip = parse_accept_header(http_request.headers.get('Accept-Encoding')).quality('gzip') > 0
+        etag = self.etag + '-gz' if use_gzip else self.etag
+        headers = {
+            'ETag': '"{0}"'.format(etag),
+            'Cache-Control': 'no-cache',
+            'Vary': 'Accept-Encoding',
+        }
+        if parse_etags(http_request.headers.get('If-None-Match')).contains(etag):
+            return Response(status=304, headers=headers)
+        if use_gzip:
+            headers['Content-Encoding'] = 'gzip'
+            return Response(self.gzip_data, content_type=self.content_type, headers=headers)
+        return Response(self.data, content_type=self.content_type, headers=headers)
+
+
+class CachingService(Service):
+    """:class:`pywps.Service` caching the GetCapabilities and
+    DescribeProcess documents of GET requests.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._documents = {}
+        self._lock = threading.Lock()
+        self._generation = None
+        super(CachingService, self).__init__(*args, **kwargs)
+
+    @property
+    def processes(self):
+        return self._processes
+
+    @processes.setter
+    def processes(self, processes):
+        self._processes = processes
+        self.invalidate()
+
+    def invalidate(self):
+        with self._lock:
+            self._documents.clear()
+
+    def check_catalogue(self):
+        """Construct the processes again when the catalogue has changed."""
+        generation = catalogue.generation()
+        if generation == self._generation:
+            return
+        LOGGER.debug("catalogue changed, clearing the process documents")
+        self._generation = generation
+        if hasattr(self._processes, 'reset'):
+            self._processes.reset()
+        self.invalidate()
+
+    def document_key(self, http_request):
+        if http_request.method != 'GET':
+            return None
+        args = dict((key.lower(), value) for key, value in http_request.args.items())
+        if args.get('request', '').lower() not in CACHED_OPERATIONS:
+            return None
+        return tuple((key, args.get(key)) for key in KEY_PARAMETERS)
+
+    def call(self, http_request):
+        self.check_catalogue()
+        key = self.document_key(http_request)
+        if key is None:
+            return super(CachingService, self).call(http_request)
+        document = self._documents.get(key)
+        if document is None:
+            response = Response.from_app(super(CachingService, self).call(http_request), http_request.environ)
+            if response.status_code != 200:
+                return response
+            document = Document(response.get_data(), response.headers.get('Content-Type'))
+            with self._lock:
+                if len(self._documents) >= MAX_DOCUMENTS:
+                    self._documents.clear()
+                self._documents[key] = document
+            LOGGER.debug("cached document for %s", key)
+        return document.response(http_request)
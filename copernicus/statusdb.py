@@ -0,0 +1,188 @@
+"""Pooled and batched persistence of the job status in the PyWPS database.
+
+PyWPS opens a new database connection for every status update of a job
+(``NullPool``) and runs three queries per update. This module
+
+* binds the sessions of :mod:`pywps.dblog` to an engine with a bounded
+  connection pool (client/server databases like PostgreSQL), or with WAL
+  journaling and a busy timeout (SQLite),
+* writes the status with a single ``UPDATE``,
+* coalesces the progress updates of a job within ``update_interval``
+  seconds. Changes of the status (accepted, started, succeeded, failed) are
+  written immediately, so the scheduler always sees the running jobs.
+
+Configured in the ``[statusdb]`` section::
+
+    [statusdb]
+    pool_size = 5
+    max_overflow = 5
+    pool_timeout = 30
+    update_interval = 2
+"""
+
+import os
+import time
+import atexit
+import datetime
+import threading
+
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool, QueuePool, StaticPool
+
+from pywps import configuration, dblog
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# jobs whose last written status is remembered by the writer
+MAX_JOBS = 10000
+
+_engine = None
+_writer = None
+_lock = threading.Lock()
+
+
+def config_value(option, default):
+    value = configuration.get_config_value('statusdb', option)
+    return default if value in (None, '') else value
+
+
+def create_engine(database, pool_size=5, max_overflow=5, pool_timeout=30):
+    """Return the engine of the PyWPS database."""
+    if ':memory:' in database:
+        return sqlalchemy.create_engine(database, connect_args={'check_same_thread': False}, poolclass=StaticPool)
+    if database.startswith('sqlite'):
+        # connections are cheap, but writers have to wait for each other
+        engine = sqlalchemy.create_engine(database, connect_args={'check_same_thread': False, 'timeout': 30},
+                                          poolclass=NullPool)
+
+        @sqlalchemy.event.listens_for(engine, 'connect')
+        def set_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA busy_timeout=30000')
+            cursor.close()
+        return engine
+    return sqlalchemy.create_engine(database, poolclass=QueuePool, pool_size=pool_size, max_overflow=max_overflow,
+                                    pool_timeout=pool_timeout, pool_pre_ping=True, pool_recycle=3600)
+
+
+def setup():
+    """Bind the sessions of :mod:`pywps.dblog` to a pooled engine of the configured database."""
+    global _engine
+    database = configuration.get_config_value('logging', 'database')
+    with _lock:
+        if _engine is not None and dblog._SESSION_MAKER_DATABASE == database:
+            return _engine
+        _engine = create_engine(
+            database,
+            pool_size=int(config_value('pool_size', 5)),
+            max_overflow=int(config_value('max_overflow', 5)),
+            pool_timeout=float(config_value('pool_timeout', 30)))
+        dblog.ProcessInstance.metadata.create_all(_engine)
+        dblog.RequestInstance.metadata.create_all(_engine)
+        # used by dblog.get_session as long as the database is not changed
+        dblog._SESSION_MAKER = sessionmaker(bind=_engine)
+        dblog._SESSION_MAKER_DATABASE = database
+    return _engine
+
+
+def _after_fork():
+    # the connections of the pool belong to the parent process
+    if _engine is not None:
+        _engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def write(updates):
+    """Write ``(uuid, status, message, percentage, time)`` updates in one transaction."""
+    session = dblog.get_session()
+    try:
+        for uuid, status, message, percentage, time_end in updates:
+            (session.query(dblog.ProcessInstance)
+             .filter(dblog.ProcessInstance.uuid == str(uuid))
+             .update({'status': status, 'message': str(message), 'percent_done': percentage,
+                      'time_end': time_end}, synchronize_session=False))
+        session.commit()
+    finally:
+        session.close()
+
+
+class StatusWriter(object):
+    """Coalesce the progress updates of the jobs of this process.
+
+    :param interval: seconds a progress update may be delayed, 0 writes all
+                     updates immediately.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.pid = os.getpid()
+        # uuid to the last written status
+        self.written = {}
+        # uuid to the pending update
+        self.pending = {}
+        self.lock = threading.Lock()
+        # keeps a delayed update from overwriting a newer status
+        self.write_lock = threading.Lock()
+        self.thread = None
+
+    def store_status(self, uuid, status, message=None, percentage=None):
+        uuid = str(uuid)
+        update = (uuid, status, message, percentage, datetime.datetime.now())
+        with self.lock:
+            if self.interval > 0 and self.written.get(uuid) == status:
+                self.pending[uuid] = update
+                self.start()
+                return
+        with self.write_lock:
+            with self.lock:
+                self.pending.pop(uuid, None)
+                if len(self.written) >= MAX_JOBS:
+                    self.written.clear()
+                self.written[uuid] = status
+                if percentage is not None and percentage >= 100:
+                    del self.written[uuid]
+            write([update])
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='statusdb')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                updates = list(self.pending.values())
+                self.pending.clear()
+            if updates:
+                try:
+                    write(updates)
+                except Exception:
+                    LOGGER.exception("could not write the status of %s jobs", len(updates))
+
+
+def get_writer():
+    """Return the status writer of this process."""
+    global _writer
+    with _lock:
+        if _writer is None or _writer.pid != os.getpid():
+            # the writer of a forked parent has no thread in this process
+            _writer = StatusWriter(float(config_value('update_interval', 2)))
+            atexit.register(_writer.flush)
+        return _writer
+
+
+def store_status(uuid, status, message=None, percentage=None):
+    """Store the status of a job, like :func:`pywps.dblog.store_status`."""
+    get_writer().store_status(uuid, status, message, percentage)
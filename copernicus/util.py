@@ -1,4 +1,7 @@
 import os
+import tempfile
+
+from pywps import configuration
 
 
 # wps roles
@@ -24,6 +27,15 @@ def static_directory():
     return os.path.join(os.path.dirname(__file__), 'static')
 
 
+def state_directory():
+    """Helper function to return the directory for the persistent state of the service."""
+    path = configuration.get_config_value('copernicus', 'state_dir')
+    path = path or os.path.join(tempfile.gettempdir(), 'copernicus-state')
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    return path
+
+
 def static_url():
     # return 'http://localhost:5000/static'
     return 'https://raw.githubusercontent.com/cp4cds/copernicus-wps-demo/master/copernicus/static'
@@ -0,0 +1,215 @@
+"""Pool of long-lived worker processes running ESMValTool recipes.
+
+The workers are forked from the server process after ESMValTool and its heavy
+dependencies have been imported. All workers accept jobs on one shared unix
+socket, so any process forked from the server (like the PyWPS job processes)
+can dispatch a job by connecting to it. A worker exits after a number of jobs
+or when its memory exceeds a limit and is replaced by a fresh one.
+"""
+
+import os
+import atexit
+import shutil
+import importlib
+import tempfile
+import threading
+import traceback
+import multiprocessing
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, wait
+
+import psutil
+
+from pywps import configuration
+
+from copernicus import instrument
+
+import logging
+LOGGER = logging.getLogger("PYWPS")
+
+# modules imported once before the workers are forked
+PRELOAD_MODULES = ['numpy', 'iris', 'cartopy', 'esmvaltool._main']
+
+_pool = None
+
+
+def get_pool():
+    return _pool
+
+
+def start_pool():
+    """Start the worker pool configured in the ``[esmvaltool]`` section."""
+    global _pool
+    workers = int(configuration.get_config_value('esmvaltool', 'workers') or 0)
+    if workers < 1 or _pool is not None:
+        return _pool
+    max_memory = configuration.get_config_value('esmvaltool', 'max_worker_memory') or '0'
+    _pool = WorkerPool(
+        workers=workers,
+        max_jobs=int(configuration.get_config_value('esmvaltool', 'max_jobs_per_worker') or 0),
+        max_memory=int(configuration.get_size_mb(max_memory) * 1024 ** 2))
+    _pool.start()
+    atexit.register(_pool.stop)
+    return _pool
+
+
+def call(func, *args):
+    """Run the function with dotted name ``func`` in the worker pool.
+
+    Runs it in the current process when no pool is running.
+    """
+    if _pool is None:
+        return resolve(func)(*args)
+    return _pool.call(func, *args)
+
+
+def resolve(name):
+    module_name, func_name = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+def preload(modules=None):
+    for name in modules or PRELOAD_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            LOGGER.debug("could not preload module %s", name)
+
+
+def serve(listener, max_jobs=0, max_memory=0):
+    """Main loop of a worker process."""
+    jobs = 0
+    process = psutil.Process()
+    while True:
+        try:
+            conn = listener.accept()
+        except AuthenticationError:
+            LOGGER.warning("rejected connection to worker pool")
+            continue
+        try:
+            cwd, func, args = conn.recv()
+            os.chdir(cwd)
+            before = instrument.snapshot()
+            peak_rss = instrument.PeakRSS()
+            peak_rss.start()
+            try:
+                status, result = 'ok', resolve(func)(*args)
+            except Exception as err:
+                status, result = 'error', '{0}\n{1}'.format(err, traceback.format_exc())
+            job_usage = instrument.usage(before, instrument.snapshot())
+            job_usage['max_rss'] = peak_rss.stop()
+            conn.send((status, result, job_usage))
+        except (EOFError, OSError):
+            LOGGER.exception("lost connection to client")
+        finally:
+            conn.close()
+        jobs += 1
+        if max_jobs and jobs >= max_jobs:
+            break
+        if max_memory and process.memory_info().rss > max_memory:
+            break
+
+
+class WorkerPool(object):
+    """Pre-forked workers with preloaded ESMValTool.
+
+    :param workers: number of worker processes.
+    :param max_jobs: jobs after which a worker is replaced, 0 for no limit.
+    :param max_memory: resident memory in bytes above which a worker is
+                       replaced after its current job, 0 for no limit.
+    """
+
+    def __init__(self, workers=2, max_jobs=0, max_memory=0, preload_modules=None):
+        self.workers = workers
+        self.max_jobs = max_jobs
+        self.max_memory = max_memory
+        self.preload_modules = preload_modules
+        self.owner = os.getpid()
+        self.authkey = os.urandom(32)
+        self.tmpdir = None
+        self.address = None
+        self.listener = None
+        self.processes = []
+        self.running = False
+
+    def start(self):
+        preload(self.preload_modules)
+        self.tmpdir = tempfile.mkdtemp(prefix='copernicus-pool-')
+        self.address = os.path.join(self.tmpdir, 'pool.sock')
+        self.listener = Listener(self.address, family='AF_UNIX', backlog=128, authkey=self.authkey)
+        self.running = True
+        for _ in range(self.workers):
+            self.spawn()
+        supervisor = threading.Thread(target=self.supervise, name='workerpool')
+        supervisor.daemon = True
+        supervisor.start()
+        LOGGER.info("started %s esmvaltool workers on %s", self.workers, self.address)
+
+    def spawn(self):
+        process = multiprocessing.get_context('fork').Process(
+            target=serve, args=(self.listener, self.max_jobs, self.max_memory), name='esmvaltool-worker')
+        process.daemon = True
+        process.start()
+        self.processes.append(process)
+        self.write_pids()
+
+    def write_pids(self):
+        """Write the pids of the workers for processes forked before they started."""
+        with open(os.path.join(self.tmpdir, 'workers.tmp'), 'w') as fp:
+            fp.write(' '.join(str(process.pid) for process in self.processes))
+        os.rename(os.path.join(self.tmpdir, 'workers.tmp'), os.path.join(self.tmpdir, 'workers'))
+
+    def worker_pids(self):
+        try:
+            with open(os.path.join(self.tmpdir, 'workers')) as fp:
+                return [int(pid) for pid in fp.read().split()]
+        except (IOError, OSError, ValueError):
+            return []
+
+    def is_alive(self):
+        """Check that the socket exists and a worker is running."""
+        if not self.running or not os.path.exists(self.address):
+            return False
+        for pid in self.worker_pids():
+            try:
+                os.kill(pid, 0)
+                return True
+            except OSError:
+                pass
+        return False
+
+    def supervise(self):
+        """Replace workers which have exited."""
+        while self.running:
+            wait([process.sentinel for process in self.processes], timeout=1)
+            for process in [process for process in self.processes if not process.is_alive()]:
+                process.join()
+                self.processes.remove(process)
+                if self.running:
+                    LOGGER.debug("replacing worker %s, exitcode=%s", process.pid, process.exitcode)
+                    self.spawn()
+
+    def stop(self):
+        if os.getpid() != self.owner or not self.running:
+            return
+        self.running = False
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(timeout=5)
+        self.listener.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def call(self, func, *args):
+        conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+        try:
+            conn.send((os.getcwd(), func, args))
+            status, result, usage = conn.recv()
+        except EOFError:
+            raise Exception('esmvaltool worker died while running {0}'.format(func))
+        finally:
+            conn.close()
+        instrument.add_usage(usage)
+        if status == 'error':
+            raise Exception(result)
+        return result
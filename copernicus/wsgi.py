@@ -1,18 +1,46 @@
 import os
-from pywps.app.Service import Service
 
-from .processes import processes
+from .processes import registry
+from . import runner
+from . import workerpool
+from . import reaper
+from . import catalogue
+from . import statusdb
+from .service import CachingService
+from .metrics import MetricsApp
+from .health import HealthApp
 
 
-def create_app(cfgfiles=None):
+def get_config_files(cfgfiles=None):
     config_files = [os.path.join(os.path.dirname(__file__), 'default.cfg')]
     if cfgfiles:
         config_files.extend(cfgfiles)
     if 'PYWPS_CFG' in os.environ:
         config_files.append(os.environ['PYWPS_CFG'])
+    return config_files
+
+
+def create_app(cfgfiles=None, background_tasks=True):
+    """Create the WSGI application of the service.
+
+    :param background_tasks: update the data catalogue and run the reaper in
+                             threads of this process, False in the gunicorn
+                             workers whose master runs them.
+    """
+    config_files = get_config_files(cfgfiles)
     print(config_files)
-    service = Service(processes=processes, cfgfiles=config_files)
-    return service
+    service = CachingService(processes=[], cfgfiles=config_files)
+    statusdb.setup()
+    # processes are constructed on the first DescribeProcess or Execute
+    registry.load_descriptors()
+    service.processes = registry
+    runner.compile_templates()
+    # needs the pywps configuration loaded by the service
+    workerpool.start_pool()
+    if background_tasks:
+        reaper.start_reaper()
+        catalogue.start_refresh()
+    return HealthApp(MetricsApp(service))
 
 
 #application = create_app()
@@ -12,3 +12,27 @@ class WpsTestClient(WpsClient):
 
 def client_for(service):
     return WpsTestClient(service, WpsTestResponse)
+
+
+class DummyResponse(object):
+    """Records the status updates of a process."""
+
+    def __init__(self):
+        self.status = []
+
+    def update_status(self, message, status_percentage):
+        self.status.append((message, status_percentage))
+
+
+def wait_for_jobs(outputpath, count, timeout=30):
+    """Wait until ``count`` status documents in ``outputpath`` are finished."""
+    import time
+    end = time.time() + timeout
+    while time.time() < end:
+        status_files = outputpath.listdir('*.xml')
+        if len(status_files) == count and all(
+                'ProcessSucceeded' in status_file.read() or 'ProcessFailed' in status_file.read()
+                for status_file in status_files):
+            break
+        time.sleep(0.2)
+    return outputpath.listdir('*.xml')
@@ -0,0 +1,26 @@
+import os
+import zipfile
+
+from copernicus import archive
+
+from .common import DummyResponse
+
+
+def test_build_archive(tmpdir, monkeypatch):
+    monkeypatch.setattr(archive, 'STATUS_INTERVAL', 0)
+    output_dir = tmpdir.mkdir('output')
+    output_dir.mkdir('plots').join('plot.png').write_binary(os.urandom(4096))
+    output_dir.mkdir('work').join('data.txt').write('abc' * 10000)
+    output_dir.join('work', 'empty.txt').write('')
+    response = DummyResponse()
+    archive_file = str(tmpdir.join('result.zip'))
+    archive.build_archive(str(output_dir), archive_file, response=response)
+    with zipfile.ZipFile(archive_file) as ziph:
+        assert ziph.testzip() is None
+        assert sorted(ziph.namelist()) == ['plots/plot.png', 'work/data.txt', 'work/empty.txt']
+        assert ziph.getinfo('plots/plot.png').compress_type == zipfile.ZIP_STORED
+        assert ziph.getinfo('work/data.txt').compress_type == zipfile.ZIP_DEFLATED
+        assert ziph.getinfo('work/data.txt').compress_size < 1000
+        assert ziph.read('work/data.txt') == b'abc' * 10000
+    assert len(response.status) == 3
+    assert response.status[-1][1] == 99
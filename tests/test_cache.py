@@ -0,0 +1,105 @@
+import os
+
+from copernicus import cache
+
+
+def write(path, text=''):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as fp:
+        fp.write(text)
+    return path
+
+
+def make_session(output_dir, size=10):
+    session_dir = os.path.join(output_dir, 'recipe_20180101_000000')
+    logfile = write(os.path.join(session_dir, 'run', 'main_log.txt'), 'log')
+    write(os.path.join(session_dir, 'plots', 'diag', 'main', 'plot.png'), 'x' * size)
+    write(os.path.join(session_dir, 'work', 'diag', 'main', 'data.nc'), 'y' * size)
+    return (logfile, os.path.join(session_dir, 'plots'),
+            os.path.join(session_dir, 'work'), os.path.join(session_dir, 'run'))
+
+
+def test_cache_key_ignores_output_dir(tmpdir):
+    recipe = write(str(tmpdir.join('recipe.yml')), 'datasets: []\n')
+    config_a = write(str(tmpdir.join('a.yml')), 'output_dir: /a\noutput_file_type: png\n')
+    config_b = write(str(tmpdir.join('b.yml')), 'output_dir: /b\noutput_file_type: png\n')
+    config_c = write(str(tmpdir.join('c.yml')), 'output_dir: /b\noutput_file_type: pdf\n')
+    assert cache.cache_key(recipe, config_a) == cache.cache_key(recipe, config_b)
+    assert cache.cache_key(recipe, config_a) != cache.cache_key(recipe, config_c)
+
+
+def test_cache_key_input_files(tmpdir):
+    root = str(tmpdir.join('archive'))
+    nc_file = write(os.path.join(
+        root, 'MPI-M', 'MPI-ESM-MR', 'amip', 'day', 'atmos', 'day', 'r1i1p1', 'latest', 'zg',
+        'zg_day_MPI-ESM-MR_amip_r1i1p1_20000101-20051231.nc'), 'data')
+    recipe = write(str(tmpdir.join('recipe.yml')), """
+datasets:
+  - {dataset: MPI-ESM-MR, project: CMIP5, mip: day, exp: amip, ensemble: r1i1p1}
+diagnostics:
+  zmnam:
+    variables:
+      zg: {}
+""")
+    config = write(str(tmpdir.join('config.yml')), 'rootpath:\n  CMIP5: {}\n'.format(root))
+    assert cache.input_files(cache.read_yaml(recipe), cache.read_yaml(config)) == [nc_file]
+    key = cache.cache_key(recipe, config)
+    write(nc_file, 'changed data')
+    assert cache.cache_key(recipe, config) != key
+
+
+def test_cache_key_obs_files(tmpdir):
+    root = str(tmpdir.join('obs'))
+    nc_file = write(os.path.join(root, 'Tier3', 'ERA-Interim', 'OBS_ERA-Interim_reanaly_1_T2Ms_ta_200001-200512.nc'))
+    recipe = write(str(tmpdir.join('recipe.yml')), """
+diagnostics:
+  diag:
+    additional_datasets:
+      - {dataset: ERA-Interim, project: OBS, tier: 3, type: reanaly, version: 1}
+    variables:
+      ta: {mip: Amon}
+""")
+    config = write(str(tmpdir.join('config.yml')), 'rootpath:\n  OBS: {}\n'.format(root))
+    assert cache.input_files(cache.read_yaml(recipe), cache.read_yaml(config)) == [nc_file]
+    key = cache.cache_key(recipe, config)
+    write(nc_file, 'changed data')
+    assert cache.cache_key(recipe, config) != key
+
+
+def test_link_tree_keeps_symlinks(tmpdir):
+    data = write(str(tmpdir.join('data', 'ta.nc')), 'data')
+    src = tmpdir.mkdir('src')
+    write(str(src.join('run', 'main_log.txt')), 'log')
+    os.symlink(data, str(src.join('input.nc')))
+    os.symlink(os.path.dirname(data), str(src.join('input_data')))
+    cache.link_tree(str(src), str(tmpdir.join('dst')))
+    assert os.readlink(str(tmpdir.join('dst', 'input.nc'))) == data
+    assert os.readlink(str(tmpdir.join('dst', 'input_data'))) == os.path.dirname(data)
+    assert os.path.isfile(str(tmpdir.join('dst', 'run', 'main_log.txt')))
+
+
+def test_store_and_lookup(tmpdir):
+    result_cache = cache.ResultCache(str(tmpdir.join('cache')))
+    result = make_session(str(tmpdir.join('job1', 'output')))
+    assert result_cache.lookup('abcd', str(tmpdir.join('job2', 'output'))) is None
+    result_cache.store('abcd', *result)
+    logfile, plot_dir, work_dir, run_dir = result_cache.lookup('abcd', str(tmpdir.join('job2', 'output')))
+    assert logfile == str(tmpdir.join('job2', 'output', 'recipe_20180101_000000', 'run', 'main_log.txt'))
+    assert os.path.isfile(os.path.join(plot_dir, 'diag', 'main', 'plot.png'))
+    assert os.path.isfile(os.path.join(work_dir, 'diag', 'main', 'data.nc'))
+
+
+def test_evict_least_recently_used(tmpdir):
+    # 40 bytes per entry, room for two entries
+    result_cache = cache.ResultCache(str(tmpdir.join('cache')), max_size=100 / 1024. ** 2)
+    for key in ['aa', 'bb']:
+        result_cache.store(key, *make_session(str(tmpdir.join(key)), size=17))
+    os.utime(os.path.join(result_cache.entry_path('aa'), cache.ENTRY_FILE), (0, 0))
+    result_cache.store('cc', *make_session(str(tmpdir.join('cc')), size=17))
+    keys = sorted(os.path.basename(entry['path']) for entry in result_cache.entries())
+    assert keys == ['bb', 'cc']
+    preproc_file = write(os.path.join(result_cache.path, cache.PREPROC_DIR, 'ab', 'abcd.nc'), 'data')
+    result_cache.invalidate()
+    assert list(result_cache.entries()) == []
+    assert not os.path.exists(preproc_file)
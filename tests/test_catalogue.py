@@ -0,0 +1,113 @@
+import pytest
+
+from pywps import configuration
+
+from copernicus import catalogue
+
+CMIP5_DIR = 'BCC/{dataset}/historical/{frequency}/atmos/{mip}/r1i1p1/latest/{short_name}'
+CMIP5_FILE = '{short_name}_{mip}_{dataset}_historical_r1i1p1_{years}.nc'
+
+
+def add_cmip5(root, dataset, short_name, years, mip='day', frequency='day'):
+    values = dict(dataset=dataset, short_name=short_name, mip=mip, frequency=frequency, years=years)
+    root.join(CMIP5_DIR.format(**values), CMIP5_FILE.format(**values)).ensure()
+
+
+@pytest.fixture
+def archive(tmpdir):
+    root = tmpdir.join('archive')
+    add_cmip5(root, 'bcc-csm1-1', 'pr', '18500101-19491231')
+    add_cmip5(root, 'bcc-csm1-1', 'pr', '19500101-20121231')
+    add_cmip5(root, 'bcc-csm1-1-m', 'pr', '19500101-19791231')
+    add_cmip5(root, 'bcc-csm1-1-m', 'pr', '20000101-20121231')
+    add_cmip5(root, 'MPI-ESM-LR', 'tas', '185001-200512', mip='Amon', frequency='mon')
+    tmpdir.join('obs', 'Tier3', 'ERA-Interim', 'OBS_ERA-Interim_reanaly_1_Amon_ta_197901-201412.nc').ensure()
+    return tmpdir
+
+
+def test_catalogue(archive):
+    data = catalogue.Catalogue({'CMIP5': str(archive.join('archive')), 'OBS': str(archive.join('obs'))},
+                               str(archive.join('catalogue.json')))
+    stats = data.update()
+    assert stats['dirs'] == stats['listed']
+    assert data.values('dataset', project='CMIP5', mip='day', short_name='pr') == ['bcc-csm1-1', 'bcc-csm1-1-m']
+    assert data.values('dataset', frequency='mon') == ['ERA-Interim', 'MPI-ESM-LR']
+    assert data.values('dataset', project='OBS') == ['ERA-Interim']
+    assert data.coverage('CMIP5', 'bcc-csm1-1', 'historical', 'r1i1p1', 'day', 'pr') == [[1850, 2012]]
+    assert data.coverage('CMIP5', 'bcc-csm1-1-m', 'historical', 'r1i1p1', 'day', 'pr') == [[1950, 1979], [2000, 2012]]
+    dataset = dict(project='CMIP5', dataset='bcc-csm1-1-m', exp='historical', ensemble='r1i1p1', mip='day')
+    assert data.missing([dataset], ['pr'], 2001, 2002) == []
+    assert data.missing([dataset], ['pr', 'tas'], 1970, 2005) == [
+        'bcc-csm1-1-m historical r1i1p1 day pr is available for 1950-1979, 2000-2012, not 1970-2005',
+        'no data for bcc-csm1-1-m historical r1i1p1 day tas']
+
+    # only changed directories are listed again
+    add_cmip5(archive.join('archive'), 'bcc-csm1-1-m', 'pr', '19800101-19991231')
+    stats = data.update()
+    assert stats['listed'] == 1
+    assert data.coverage('CMIP5', 'bcc-csm1-1-m', 'historical', 'r1i1p1', 'day', 'pr') == [[1950, 2012]]
+
+    # the persisted catalogue is used on startup
+    restored = catalogue.Catalogue(data.roots, data.path)
+    assert restored.load()
+    assert restored.index == data.index
+    assert restored.update()['listed'] == 0
+
+
+def test_reload(archive, monkeypatch):
+    monkeypatch.setattr(catalogue, 'RELOAD_INTERVAL', 0)
+    roots = {'CMIP5': str(archive.join('archive'))}
+    path = str(archive.join('catalogue.json'))
+    writer = catalogue.Catalogue(roots, path)
+    writer.update()
+    reader = catalogue.Catalogue(roots, path)
+    assert reader.load()
+    # the process updating the catalogue does not read it again
+    assert not writer.reload()
+    assert not reader.reload()
+    add_cmip5(archive.join('archive'), 'MIROC5', 'pr', '19500101-20121231')
+    writer.update()
+    # another process reads the update
+    assert reader.reload()
+    assert 'MIROC5' in reader.values('dataset')
+
+
+@pytest.fixture
+def config(archive):
+    configuration.load_configuration()
+    configuration.CONFIG.add_section('data')
+    configuration.CONFIG.set('data', 'archive_root', str(archive.join('archive')))
+    configuration.CONFIG.set('data', 'obs_root', str(archive.join('obs')))
+    configuration.CONFIG.add_section('copernicus')
+    configuration.CONFIG.set('copernicus', 'state_dir', str(archive))
+    yield configuration
+    configuration.load_configuration()
+
+
+def test_check_request(config):
+    catalogue.get_catalogue().update()
+    models = catalogue.allowed_values('dataset', ['x'], project='CMIP5', mip='day', short_name='pr')
+    assert models == ['bcc-csm1-1', 'bcc-csm1-1-m']
+    assert catalogue.default(models, 'bcc-csm1-1-m') == 'bcc-csm1-1-m'
+    assert catalogue.allowed_values('dataset', ['x'], mip='fx') == ['x']
+    constraints = dict(model='bcc-csm1-1', experiment='historical', ensemble='r1i1p1', cmor_table='day')
+    catalogue.check_request(constraints, ['pr'], 2001, 2002)
+    with pytest.raises(Exception) as excinfo:
+        catalogue.check_request(constraints, ['pr'], 2001, 2020)
+    assert 'not 2001-2020' in str(excinfo.value)
+
+
+def test_generation(config, archive):
+    # before the first scan the processes offer their built-in choices
+    assert catalogue.generation() == 0
+    assert catalogue.allowed_values('dataset', ['x'], project='CMIP5') == ['x']
+    catalogue.get_catalogue().update()
+    generation = catalogue.generation()
+    assert generation > 0
+    assert 'bcc-csm1-1' in catalogue.allowed_values('dataset', ['x'], project='CMIP5')
+    # an update without changes keeps the index
+    catalogue.get_catalogue().update()
+    assert catalogue.generation() == generation
+    add_cmip5(archive.join('archive'), 'MIROC5', 'pr', '19500101-20121231')
+    catalogue.get_catalogue().update()
+    assert catalogue.generation() > generation
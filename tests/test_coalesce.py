@@ -0,0 +1,115 @@
+import pytest
+
+from pywps import configuration
+from pywps.response.status import WPS_STATUS
+from pywps.tests import WpsClient, WpsTestResponse
+
+from copernicus import coalesce
+from copernicus.service import CachingService
+from copernicus.processes import registry
+
+from .common import wait_for_jobs
+
+EXECUTE = ('?service=WPS&request=Execute&version=1.0.0&identifier=sleep'
+           '&storeExecuteResponse=true&status=true&DataInputs=delay={0}')
+
+
+class Input(object):
+
+    def __init__(self, data):
+        self.data = data
+        self.data_type = 'float'
+
+
+class Request(object):
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+        self.outputs = {}
+
+
+def test_request_key():
+    key = coalesce.request_key('sleep', Request({'delay': [Input(1.0)], 'a': [Input(2)]}))
+    assert key == coalesce.request_key('sleep', Request({'a': [Input(2)], 'delay': [Input(1.0)]}))
+    assert key != coalesce.request_key('sleep', Request({'delay': [Input(2.0)], 'a': [Input(2)]}))
+    assert key != coalesce.request_key('cvdp', Request({'delay': [Input(1.0)], 'a': [Input(2)]}))
+
+
+class Response(object):
+
+    def __init__(self, status):
+        self.uuid = 'leader'
+        self.status = status
+
+
+def test_is_enabled(config):
+    assert coalesce.is_enabled('sleep')
+    assert not coalesce.is_enabled('rainfarm')
+    configuration.CONFIG.set('scheduler', 'coalesce', '')
+    assert not coalesce.is_enabled('sleep')
+
+
+def test_crashed_leader(tmpdir, monkeypatch):
+    database = str(tmpdir.join('jobs.sqlite'))
+    written = []
+    monkeypatch.setattr(coalesce, 'write_failed', written.extend)
+    monkeypatch.setattr(coalesce, 'crashed', lambda uuid: False)
+    assert coalesce.attach('key', 'leader', database) == 'leader'
+    assert coalesce.attach('key', 'follower', database) == 'leader'
+    coalesce.set_failed_doc('follower', '<failed/>', database)
+    # the next request finds the crashed leader, its attached job fails
+    monkeypatch.setattr(coalesce, 'crashed', lambda uuid: uuid == 'leader')
+    assert coalesce.attach('other', 'job', database) == 'job'
+    assert written == [('follower', '<failed/>')]
+    assert coalesce.attach('key', 'new', database) == 'new'
+    # a leader which is not queued
+    assert coalesce.attach('key', 'next', database) == 'new'
+    coalesce.release('new', database)
+    assert written == [('follower', '<failed/>'), ('next', None)]
+
+
+def test_propagate_without_followers(monkeypatch):
+    calls = []
+    monkeypatch.setattr(coalesce, 'followers', lambda leader, finished: calls.append(finished) or [])
+    for _ in range(3):
+        coalesce.propagate(Response(WPS_STATUS.STARTED))
+    assert calls == [False]
+    coalesce.propagate(Response(WPS_STATUS.SUCCEEDED))
+    assert calls == [False, True]
+    assert 'leader' not in coalesce._no_followers
+
+
+@pytest.fixture
+def config(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.set('server', 'outputpath', str(tmpdir))
+    configuration.CONFIG.set('server', 'workdir', str(tmpdir))
+    configuration.CONFIG.set('logging', 'database', 'sqlite:///{0}'.format(tmpdir.join('db.sqlite')))
+    configuration.CONFIG.add_section('copernicus')
+    configuration.CONFIG.set('copernicus', 'state_dir', str(tmpdir))
+    configuration.CONFIG.add_section('scheduler')
+    configuration.CONFIG.set('scheduler', 'coalesce', 'sleep')
+    yield configuration
+    configuration.load_configuration()
+
+
+def status_text(resp):
+    return resp.xpath_text('/wps:ExecuteResponse/wps:Status/wps:ProcessAccepted')
+
+
+@pytest.mark.slow
+def test_coalesce(config, tmpdir):
+    service = CachingService(processes=[])
+    service.processes = registry
+    client = WpsClient(service, WpsTestResponse)
+    leader = client.get(EXECUTE.format(0.05))
+    follower = client.get(EXECUTE.format(0.05))
+    other = client.get(EXECUTE.format(0.02))
+    assert 'attached' not in status_text(leader)
+    assert 'attached to the identical job' in status_text(follower)
+    assert 'attached' not in status_text(other)
+    status_files = wait_for_jobs(tmpdir, 3)
+    assert len(status_files) == 3
+    assert all('ProcessSucceeded' in status_file.read() for status_file in status_files)
+    outputs = [status_file.read().count('done sleeping (delay=0.05)') for status_file in status_files]
+    assert sorted(outputs) == [0, 1, 1]
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from copernicus import drydays
+from copernicus import ncdata
+
+from . test_ncdata import write_pr, netCDF4
+
+
+def diag_cdd(series, plim, frlim):
+    """``drymax`` and ``dryfreq`` of one grid point like ESMValTool's diag_cdd.py.
+
+    The spells are the pairs of wet to dry and dry to wet changes of the
+    series after a wet day. A spell without an end counts in ``drymax`` only.
+    """
+    change = np.diff(np.concatenate([[0], series < plim]).astype(int))
+    starts = np.nonzero(change == 1)[0]
+    ends = np.nonzero(change == -1)[0]
+    spells = ends - starts[:len(ends)]
+    drymax = max(spells.max(initial=0), len(series) - starts[-1] if len(starts) > len(ends) else 0)
+    return drymax, (spells >= frlim).sum()
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 365, 1000])
+def test_dry_spells(chunk):
+    rng = np.random.default_rng(1)
+    pr = rng.gamma(0.3, 2.0, size=(730, 3, 4)) / drydays.SECONDS_PER_DAY
+    pr[100:140, 0, 0] = 0
+    pr[:, 2, 3] = 0
+    pr[5, 1, 1] = np.nan
+    spells = drydays.DrySpells((3, 4), plim=1, frlim=5)
+    for start in range(0, len(pr), chunk):
+        spells.update(pr[start:start + chunk])
+    drymax, dryfreq = spells.finish()
+    for i in range(3):
+        for j in range(4):
+            expected = diag_cdd(pr[:, i, j], 1.0 / drydays.SECONDS_PER_DAY, 5)
+            assert (drymax[i, j], dryfreq[i, j]) == expected
+    assert drymax[0, 0] >= 40
+    assert drymax[2, 3] == 730 and dryfreq[2, 3] == 0
+
+
+def test_dry_spells_frlim():
+    pr = np.ones((20, 1))
+    pr[1:6] = 0
+    pr[7:11] = 0
+    pr[12:] = 0
+    spells = drydays.DrySpells((1,), plim=1, frlim=5)
+    spells.update(pr)
+    drymax, dryfreq = spells.finish()
+    # the spell of 5 days counts, the one of 4 days and the one still running do not
+    assert drymax.tolist() == [8] and dryfreq.tolist() == [1]
+
+def test_run(tmpdir):
+    pr = np.full((10, 2, 2), 2.0 / drydays.SECONDS_PER_DAY)
+    pr[2:9, 0, 1] = 0
+    path = str(tmpdir.join('pr.nc'))
+    write_pr(path, 10, [0, 1], [0, 1], values=pr)
+    paths = drydays.run([path], 2000, 2000, 1, 5, str(tmpdir.join('work')), 'CMIP5_test')
+    assert [p.split('/')[-1] for p in paths] == ['CMIP5_test_drymax.nc', 'CMIP5_test_dryfreq.nc']
+    with netCDF4.Dataset(paths[0]) as ds:
+        assert ds.variables['drymax'][:].tolist() == [[0, 7], [0, 0]]
+    with netCDF4.Dataset(paths[1]) as ds:
+        assert ds.variables['dryfreq'][:].tolist() == [[0, 1], [0, 0]]
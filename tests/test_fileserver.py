@@ -0,0 +1,51 @@
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from copernicus import fileserver
+
+
+def app(environ, start_response):
+    return Response('wps')(environ, start_response)
+
+
+def client_for(tmpdir):
+    outputs = tmpdir.mkdir('outputs')
+    outputs.join('job.xml').write('<status/>')
+    outputs.mkdir('job').join('result.nc').write_binary(b'0123456789')
+    return Client(fileserver.FileServer(app, {'/outputs': (str(outputs), True)}))
+
+
+def test_serve_output(tmpdir):
+    client = client_for(tmpdir)
+    resp = client.get('/outputs/job/result.nc')
+    assert resp.status_code == 200
+    assert resp.data == b'0123456789'
+    assert resp.headers['Content-Type'] == 'application/x-netcdf'
+    assert resp.headers['Cache-Control'] == fileserver.IMMUTABLE
+    assert client.get('/outputs/job.xml').headers['Cache-Control'] == fileserver.REVALIDATE
+    assert client.get('/wps').data == b'wps'
+    assert client.get('/outputs/../outputs/job.xml').data != b'<status/>'
+    assert client.get('/outputs/missing.nc').data == b'wps'
+
+
+def test_conditional(tmpdir):
+    client = client_for(tmpdir)
+    etag = client.get('/outputs/job/result.nc').headers['ETag']
+    resp = client.get('/outputs/job/result.nc', headers={'If-None-Match': etag})
+    assert resp.status_code == 304
+    assert resp.data == b''
+
+
+def test_range(tmpdir):
+    client = client_for(tmpdir)
+    resp = client.get('/outputs/job/result.nc', headers={'Range': 'bytes=2-4'})
+    assert resp.status_code == 206
+    assert resp.data == b'234'
+    assert resp.headers['Content-Range'] == 'bytes 2-4/10'
+    resp = client.get('/outputs/job/result.nc', headers={'Range': 'bytes=7-'})
+    assert resp.data == b'789'
+    resp = client.get('/outputs/job/result.nc', headers={'Range': 'bytes=20-'})
+    assert resp.status_code == 416
+    resp = client.get('/outputs/job/result.nc', headers={'Range': 'bytes=2-4', 'If-Range': '"changed"'})
+    assert resp.status_code == 200
+    assert resp.data == b'0123456789'
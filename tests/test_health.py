@@ -0,0 +1,53 @@
+import json
+
+import pytest
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from pywps import configuration
+
+from copernicus import health
+
+
+def app(environ, start_response):
+    return Response('wps')(environ, start_response)
+
+
+@pytest.fixture
+def config(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.set('server', 'outputpath', str(tmpdir))
+    configuration.CONFIG.set('logging', 'database', 'sqlite:///{0}'.format(tmpdir.join('db.sqlite')))
+    configuration.CONFIG.add_section('data')
+    for option in ['archive_root', 'obs_root']:
+        tmpdir.join(option, 'CMIP5').ensure(dir=True)
+        configuration.CONFIG.set('data', option, str(tmpdir.join(option)))
+    configuration.CONFIG.add_section('health')
+    configuration.CONFIG.set('health', 'min_free_space', '1mb')
+    yield configuration
+    configuration.load_configuration()
+
+
+def test_health(config, tmpdir):
+    client = Client(health.HealthApp(app))
+    assert client.get('/wps').data == b'wps'
+    resp = client.get('/health')
+    assert resp.status_code == 200
+    resp = client.get('/ready')
+    assert resp.status_code == 200
+    checks = json.loads(resp.data.decode('utf-8'))['checks']
+    assert sorted(checks) == ['data', 'disk', 'queue', 'workers']
+    assert checks['queue']['message'] == '0 running, 0 queued'
+
+
+def test_not_ready(config, tmpdir):
+    tmpdir.join('obs_root', 'CMIP5').remove()
+    configuration.CONFIG.set('health', 'min_free_space', '1000000000gb')
+    resp = Client(health.HealthApp(app)).get('/ready')
+    assert resp.status_code == 503
+    data = json.loads(resp.data.decode('utf-8'))
+    assert data['status'] == 'unavailable'
+    assert not data['checks']['data']['ok']
+    assert not data['checks']['disk']['ok']
+    assert data['checks']['queue']['ok']
@@ -0,0 +1,63 @@
+import json
+import time
+import sqlite3
+
+from pywps import configuration
+
+from copernicus import instrument
+
+
+def test_stage_recorder(tmpdir, monkeypatch):
+    monkeypatch.setattr(configuration, 'get_config_value', lambda section, option, default='': str(tmpdir))
+    stages = instrument.StageRecorder('zmnam', 'abc-123')
+    stages.start('generate_recipe')
+    stages.start('run')
+    sum(range(100000))
+    instrument.add_usage(dict(cpu_time=2.0, read_bytes=10, write_bytes=20, max_rss=0))
+    stages.save()
+
+    with open(str(tmpdir.join('abc-123', 'stages.json'))) as fp:
+        record = json.load(fp)
+    assert record['process'] == 'zmnam'
+    assert [stage['stage'] for stage in record['stages']] == ['generate_recipe', 'run']
+    run = record['stages'][1]
+    assert run['cpu_time'] >= 2.0
+    assert run['write_bytes'] >= 20
+    assert run['max_rss'] > 0
+    conn = sqlite3.connect(str(tmpdir.join('stats.sqlite')))
+    assert conn.execute("SELECT stage FROM stages WHERE uuid='abc-123'").fetchall() == [
+        ('generate_recipe',), ('run',)]
+
+
+def test_stage_peak_rss(tmpdir, monkeypatch):
+    monkeypatch.setattr(configuration, 'get_config_value', lambda section, option, default='': str(tmpdir))
+    monkeypatch.setattr(instrument, 'RSS_INTERVAL', 0.01)
+    stages = instrument.StageRecorder('zmnam')
+    stages.start('large')
+    data = b'x' * 200 * 1024 ** 2
+    time.sleep(0.1)
+    del data
+    stages.start('small')
+    stages.finish()
+    large, small = stages.stages
+    # each stage has its own peak, not the peak of the process lifetime
+    assert large['max_rss'] - small['max_rss'] > 100 * 1024 ** 2
+
+
+def test_schema_created_once(tmpdir, monkeypatch):
+    statements = []
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        conn = connect(*args, **kwargs)
+        conn.set_trace_callback(statements.append)
+        return conn
+
+    monkeypatch.setattr(sqlite3, 'connect', traced_connect)
+    database = str(tmpdir.join('stats.sqlite'))
+    for _ in range(3):
+        instrument.increment('result_cache_hits', database=database)
+    assert len([statement for statement in statements if statement.startswith('CREATE TABLE')]) == 3
+    conn = connect(database)
+    assert conn.execute("SELECT value FROM counters").fetchall() == [(3,)]
+    conn.close()
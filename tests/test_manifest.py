@@ -0,0 +1,27 @@
+import os
+
+from copernicus import manifest
+
+
+def test_find(tmpdir):
+    session = tmpdir.mkdir('recipe_20180101_000000')
+    plots = session.mkdir('plots').mkdir('zmnam').mkdir('main')
+    plots.join('CMIP5_MPI-ESM-MR_25000Pa_da_pdf.png').write('')
+    plots.join('CMIP5_MPI-ESM-MR_25000Pa_mo_ts.png').write('')
+    plots.join('CMIP5_MPI-ESM-MR_25000Pa_mo_ts.pdf').write('')
+    session.mkdir('work').mkdir('zmnam').mkdir('main').join('CMIP5_zg.nc').write('')
+    output_manifest = manifest.OutputManifest(str(session))
+    plot_dir = str(session.join('plots'))
+    assert output_manifest.find(plot_dir, os.path.join('zmnam', 'main'), 'CMIP5*_mo_ts', 'png') == [
+        str(plots.join('CMIP5_MPI-ESM-MR_25000Pa_mo_ts.png'))]
+    assert len(output_manifest.find(plot_dir, os.path.join('zmnam', 'main'), 'CMIP5*', 'png')) == 2
+    assert len(output_manifest.find(plot_dir, os.path.join('zmnam', '*'), '*', '*')) == 3
+    assert output_manifest.find(plot_dir, 'zmnam', '*', 'png') == []
+    assert output_manifest.find(str(session.join('work')), os.path.join('zmnam', 'main'), '*', 'nc') == [
+        str(session.join('work', 'zmnam', 'main', 'CMIP5_zg.nc'))]
+
+
+def test_get_manifest(tmpdir):
+    session = tmpdir.mkdir('session')
+    registered = manifest.register(str(session))
+    assert manifest.get_manifest(str(session.join('plots'))) is registered
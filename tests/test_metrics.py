@@ -0,0 +1,56 @@
+import pytest
+
+from werkzeug.test import Client
+from werkzeug.wrappers import Response
+
+from pywps import configuration
+
+from copernicus import instrument
+from copernicus import metrics
+
+
+def app(environ, start_response):
+    return Response('wps')(environ, start_response)
+
+
+@pytest.fixture
+def config(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.set('server', 'outputpath', str(tmpdir))
+    configuration.CONFIG.set('logging', 'database', 'sqlite:///{0}'.format(tmpdir.join('db.sqlite')))
+    configuration.CONFIG.add_section('copernicus')
+    configuration.CONFIG.set('copernicus', 'state_dir', str(tmpdir))
+    yield configuration
+    configuration.load_configuration()
+
+
+def test_duration_histogram():
+    histogram = metrics.DurationHistogram(buckets=[1, 10])
+    histogram.observe('sleep', None, 5)
+    histogram.observe('sleep', None, 50)
+    lines = histogram.metric().lines
+    assert 'copernicus_job_duration_seconds_bucket{le="1",process="sleep",status="failed"} 0.0' in lines
+    assert 'copernicus_job_duration_seconds_bucket{le="10",process="sleep",status="failed"} 1.0' in lines
+    assert 'copernicus_job_duration_seconds_bucket{le="+Inf",process="sleep",status="failed"} 2.0' in lines
+    assert 'copernicus_job_duration_seconds_sum{process="sleep",status="failed"} 55.0' in lines
+
+
+def test_metrics(config, tmpdir):
+    stages = instrument.StageRecorder('zmnam', 'abc-123')
+    stages.start('run')
+    stages.save()
+    tmpdir.join('abc-123', 'result.zip').write('x' * 100, ensure=True)
+    instrument.record_outputs('zmnam', 'abc-123')
+    instrument.increment('result_cache_hits')
+    instrument.increment('result_cache_hits')
+    client = Client(metrics.MetricsApp(app))
+    assert client.get('/wps').data == b'wps'
+    resp = client.get('/metrics')
+    assert resp.headers['Content-Type'] == metrics.CONTENT_TYPE
+    text = resp.data.decode('utf-8')
+    assert 'copernicus_stage_seconds_count{process="zmnam",stage="run"} 1.0' in text
+    assert 'copernicus_output_bytes_total{process="zmnam"} ' in text
+    assert 'copernicus_cache_lookups_total{cache="result",result="hit"} 2.0' in text
+    assert 'copernicus_cache_lookups_total{cache="preproc",result="miss"} 0.0' in text
+    assert 'copernicus_memory_bytes{kind="server"}' in text
+    assert '# TYPE copernicus_jobs_running gauge' in text
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from copernicus import modes
+from copernicus import ncdata
+
+from . test_ncdata import write_pr, netCDF4
+
+LAT = np.arange(62, 90, 6)
+LON = np.arange(0, 360, 45)
+
+
+def regimes(seed, steps=240, k=3, stay=0.8):
+    """Monthly fields of ``k`` patterns with a seasonal cycle, a trend and noise."""
+    rng = np.random.default_rng(seed)
+    patterns = np.random.default_rng(0).standard_normal((k, LAT.size, LON.size))
+    labels = [0]
+    for _ in range(steps - 1):
+        labels.append(labels[-1] if rng.random() < stay else rng.integers(k))
+    labels = np.array(labels)
+    season = 5 * np.sin(2 * np.pi * np.arange(steps) / 12)[:, None, None]
+    trend = 0.01 * np.arange(steps)[:, None, None]
+    values = patterns[labels] + season + trend + 0.1 * rng.standard_normal((steps, LAT.size, LON.size))
+    return values, labels
+
+
+def test_randomized_svd(tmpdir):
+    rng = np.random.default_rng(1)
+    data = rng.standard_normal((500, 3)) @ rng.standard_normal((3, 40)) + 0.01 * rng.standard_normal((500, 40))
+    path = str(tmpdir.join('a.dat'))
+    anomalies = modes.Anomalies(path, 500, 40, np.ones(40))
+    anomalies.array('w+')[:] = data
+    # products of chunks of 7 time steps
+    anomalies.chunks = lambda steps=7, chunks=anomalies.chunks: chunks(steps)
+    u, s, vt = modes.randomized_svd(anomalies, 3, rng)
+    expected = np.linalg.svd(data.astype(np.float32).astype(float), compute_uv=False)[:3]
+    assert np.allclose(s, expected, rtol=1e-6)
+    assert np.allclose((u * s) @ vt, data, atol=0.1)
+
+
+def test_persistence():
+    labels = np.array([0, 0, 1, 1, 1, 0, 2, 0, 0, 0])
+    assert modes.frequency(labels, 3).tolist() == [60, 30, 10]
+    assert modes.persistence(labels, 3).tolist() == [2, 3, 1]
+
+
+@pytest.mark.parametrize('eofs', [False, True])
+def test_modes(tmpdir, eofs):
+    values, labels = regimes(1)
+    path = str(tmpdir.join('sic.nc'))
+    write_pr(path, len(values), LAT, LON, year=1990, values=values, short_name='sic', monthly=True)
+    field = ncdata.Field([path], 'sic', 1990, 2009, bbox=modes.REGIONS['Arctic'])
+    result = modes.Modes(field, str(tmpdir), 'test', 3, monthly=True, detrend=1, eofs=eofs, seed=2, workers=1)
+    # the planted regimes are found
+    for cluster in range(3):
+        assert len(set(labels[result.labels == cluster])) == 1
+    assert sorted(result.frequency) == sorted(modes.frequency(labels, 3))
+    assert not tmpdir.join('test_anomalies.dat').check()
+
+
+def test_compare(tmpdir):
+    fields = []
+    for name, seed in [('model', 3), ('reference', 4)]:
+        values, _ = regimes(seed)
+        path = str(tmpdir.join('{0}.nc'.format(name)))
+        write_pr(path, len(values), LAT, LON, year=1990, values=values, short_name='sic', monthly=True)
+        fields.append(ncdata.Field([path], 'sic', 1990, 2009))
+    model, reference = [modes.Modes(field, str(tmpdir), name, 3, monthly=True, detrend=1, seed=5, workers=2)
+                        for name, field in zip(['model', 'reference'], fields)]
+    result = modes.compare(model, reference)
+    assert sorted(result['order']) == [0, 1, 2]
+    # the patterns have a standard deviation of 1
+    assert (result['rmse'] < 0.3).all()
+    assert np.allclose(result['frequency_bias'],
+                       100 * (model.frequency[result['order']] - reference.frequency) / reference.frequency)
+    output = str(tmpdir.join('modes.nc'))
+    modes.write_results(output, model, reference, result, 'sic', '%')
+    with netCDF4.Dataset(output) as ds:
+        assert ds.variables['model_pattern'].shape == (3, LAT.size, LON.size)
+        assert np.allclose(ds.variables['rmse'][:], result['rmse'])
+    modes.write_table(str(tmpdir.join('modes.csv')), model, reference, result)
+    assert len(tmpdir.join('modes.csv').readlines()) == 4
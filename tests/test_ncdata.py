@@ -0,0 +1,60 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from copernicus import ncdata
+
+netCDF4 = pytest.importorskip('netCDF4')
+
+
+def write_pr(path, days, lat, lon, year=2000, values=None, short_name='pr', monthly=False):
+    """Write a pr file of ``days`` daily or monthly time steps.
+
+    The values default to ``time * 1000 + lat index * 10 + lon index``.
+    """
+    lat, lon = np.array(lat, dtype=float), np.array(lon, dtype=float)
+    if values is None:
+        values = (np.arange(days)[:, None, None] * 1000 + np.arange(lat.size)[None, :, None] * 10 +
+                  np.arange(lon.size)[None, None, :])
+    with netCDF4.Dataset(path, 'w') as ds:
+        ds.createDimension('time', None)
+        ds.createDimension('lat', lat.size)
+        ds.createDimension('lon', lon.size)
+        time = ds.createVariable('time', 'f8', ('time',))
+        time.units = 'days since {0}-01-01'.format(year)
+        time.calendar = 'standard'
+        if monthly:
+            time[:] = netCDF4.date2num([datetime.datetime(year + i // 12, i % 12 + 1, 15) for i in range(days)],
+                                       time.units, time.calendar)
+        else:
+            time[:] = np.arange(days) + 0.5
+        ds.createVariable('lat', 'f8', ('lat',))[:] = lat
+        ds.createVariable('lon', 'f8', ('lon',))[:] = lon
+        pr = ds.createVariable(short_name, 'f4', ('time', 'lat', 'lon'))
+        pr.units = 'kg m-2 s-1'
+        pr[:] = values
+
+
+def test_parse_bbox():
+    assert ncdata.parse_bbox('4,13,44,53') == (4, 13, 44, 53)
+    with pytest.raises(Exception):
+        ncdata.parse_bbox('4,13,53,44')
+    with pytest.raises(Exception):
+        ncdata.parse_bbox('4,13')
+
+
+def test_field(tmpdir):
+    files = [str(tmpdir.join('pr_{0}.nc'.format(year))) for year in [2000, 2001]]
+    for year, path in zip([2000, 2001], files):
+        write_pr(path, days=5, lat=[-10, 0, 10, 20], lon=range(0, 360, 30), year=year)
+    # across the date line
+    field = ncdata.Field(files, 'pr', 2001, 2001, bbox=(-40, 35, -5, 15))
+    assert len(field) == 5
+    assert field.lat.tolist() == [0, 10]
+    assert field.lon.tolist() == [330, 360, 390]
+    chunks = list(field.chunks(steps=2))
+    assert [len(times) for times, _ in chunks] == [2, 2, 1]
+    times, data = field.read()
+    assert times.tolist() == [366.5, 367.5, 368.5, 369.5, 370.5]
+    assert data[1].tolist() == [[1021, 1010, 1011], [1031, 1020, 1021]]
@@ -0,0 +1,63 @@
+import pytest
+
+from pywps import configuration
+
+from copernicus import preflight
+from copernicus import runner
+
+CONSTRAINTS = dict(model='MPI-ESM-LR', experiment='historical', cmor_table='Amon', ensemble='r1i1p1')
+CMIP5_DIR = 'MPI-M/MPI-ESM-LR/historical/mon/atmos/Amon/r1i1p1/latest/ta'
+
+
+@pytest.fixture
+def data(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.add_section('data')
+    configuration.CONFIG.set('data', 'archive_root', str(tmpdir.join('archive')))
+    configuration.CONFIG.set('data', 'obs_root', str(tmpdir.join('obs')))
+    for years in ['185001-194912', '195001-200512']:
+        tmpdir.join('archive', CMIP5_DIR, 'ta_Amon_MPI-ESM-LR_historical_r1i1p1_{0}.nc'.format(years)).ensure()
+    tmpdir.join('obs', 'Tier3', 'ERA-Interim', 'OBS_ERA-Interim_reanaly_1_Amon_ta_197901-201412.nc').ensure()
+    tmpdir.join('obs', 'Tier2', 'NCEP', 'OBS_NCEP_reanaly_1_Amon_ta_194801-201712.nc').ensure()
+    yield tmpdir
+    configuration.load_configuration()
+
+
+def test_preflight(data):
+    recipe_file, config_file = runner.generate_recipe(
+        diag='python', constraints=CONSTRAINTS, start_year=2000, end_year=2005, workdir=str(data.mkdir('job')))
+    files = runner.preflight(recipe_file, config_file)
+    assert [f.split('/')[-1] for f in files] == [
+        'ta_Amon_MPI-ESM-LR_historical_r1i1p1_195001-200512.nc',
+        'OBS_NCEP_reanaly_1_Amon_ta_194801-201712.nc',
+        'OBS_ERA-Interim_reanaly_1_Amon_ta_197901-201412.nc']
+    assert preflight.cached_files(recipe_file) == files
+    # the run reads the resolved files from links
+    rootpath = preflight.link_inputs(recipe_file, {'CMIP5': str(data.join('archive')), 'OBS': str(data.join('obs'))})
+    assert rootpath == {'CMIP5': str(data.join('job', 'input_data', 'CMIP5')),
+                        'OBS': str(data.join('job', 'input_data', 'OBS'))}
+    link = data.join('job', 'input_data', 'CMIP5', CMIP5_DIR, 'ta_Amon_MPI-ESM-LR_historical_r1i1p1_195001-200512.nc')
+    assert link.realpath() == data.join('archive', CMIP5_DIR, 'ta_Amon_MPI-ESM-LR_historical_r1i1p1_195001-200512.nc')
+    assert data.join('job', 'input_data', 'CMIP5', CMIP5_DIR).listdir() == [link]
+    assert data.join('job', 'input_data', 'OBS', 'Tier2', 'NCEP').check(dir=True)
+
+
+def test_preflight_missing_data(data):
+    recipe_file, config_file = runner.generate_recipe(
+        diag='python', constraints=CONSTRAINTS, start_year=1970, end_year=2010, workdir=str(data.mkdir('job')))
+    with pytest.raises(Exception) as excinfo:
+        runner.preflight(recipe_file, config_file)
+    message = str(excinfo.value)
+    assert 'CMIP5 MPI-ESM-LR historical r1i1p1 Amon ta is available for 1850-2005, not 1970-2010' in message
+    assert 'OBS ERA-Interim Amon ta is available for 1979-2014, not 1970-2010' in message
+    assert 'NCEP' not in message
+    assert preflight.cached_files(recipe_file) is None
+    assert preflight.link_inputs(recipe_file, {'CMIP5': 'archive'}) == {'CMIP5': 'archive'}
+    data.join('obs', 'Tier2', 'NCEP').remove()
+    files, problems, projects = preflight.resolve(
+        {'datasets': [], 'diagnostics': {'d': {'variables': {'ta': {'field': 'T3M', 'additional_datasets': [
+            {'dataset': 'NCEP', 'project': 'OBS', 'tier': 2, 'type': 'reanaly', 'version': 1,
+             'start_year': 2000, 'end_year': 2001}]}}}}},
+        {'rootpath': {'OBS': str(data.join('obs'))}})
+    assert problems == ['no data for OBS NCEP Amon ta']
+    assert projects == ['OBS']
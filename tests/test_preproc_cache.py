@@ -0,0 +1,51 @@
+from copernicus import preproc_cache
+
+
+class Product(object):
+    def __init__(self, filename, **attributes):
+        self.filename = filename
+        self.attributes = attributes
+        self.settings = {'regrid': {'target_grid': '2.5x2.5', 'scheme': 'linear'},
+                         'save': {'filename': filename}}
+
+
+class Task(object):
+    name = 'EnsClus/pr'
+    write_ncl_interface = False
+
+    def __init__(self, products):
+        self.products = products
+
+
+def test_product_key():
+    key = preproc_cache.product_key({'dataset': 'CCSM4'}, {'regrid': {}, 'save': {'filename': '/a'}})
+    assert key == preproc_cache.product_key({'dataset': 'CCSM4'}, {'regrid': {}, 'save': {'filename': '/b'}})
+    assert key != preproc_cache.product_key({'dataset': 'CCSM4'}, {'regrid': {'scheme': 'linear'}})
+    assert key != preproc_cache.product_key({'dataset': 'CanESM2'}, {'regrid': {}})
+
+
+def test_cached_run(tmpdir):
+    store = preproc_cache.PreprocStore(str(tmpdir.join('store')))
+    runs = []
+
+    def run(task, input_files):
+        runs.append(task)
+        for product in task.products:
+            with open(product.filename, 'w') as fp:
+                fp.write(product.attributes['dataset'])
+        return ['metadata.yml']
+
+    def write_metadata(products, write_ncl):
+        return ['restored.yml']
+
+    _run = preproc_cache.cached_run(run, store, write_metadata)
+    job1 = tmpdir.mkdir('job1')
+    assert _run(Task([Product(str(job1.join('a.nc')), dataset='CCSM4')]), []) == ['metadata.yml']
+    job2 = tmpdir.mkdir('job2')
+    assert _run(Task([Product(str(job2.join('a.nc')), dataset='CCSM4')]), []) == ['restored.yml']
+    assert job2.join('a.nc').read() == 'CCSM4'
+    assert len(runs) == 1
+    # partial hit runs the whole task
+    _run(Task([Product(str(job2.join('b.nc')), dataset='CCSM4'),
+               Product(str(job2.join('c.nc')), dataset='CanESM2')]), [])
+    assert len(runs) == 2
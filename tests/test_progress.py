@@ -0,0 +1,49 @@
+import time
+
+from copernicus import progress
+
+from .common import DummyResponse
+
+LOG = """\
+2018-06-22 10:00:00,000 UTC [1234] INFO    Creating tasks from recipe
+2018-06-22 10:00:01,000 UTC [1234] INFO    Running 2 tasks using 2 processes
+2018-06-22 10:00:01,100 UTC [1235] INFO    Starting task zmnam/zg in process [1235]
+2018-06-22 10:00:09,000 UTC [1235] INFO    Successfully completed task zmnam/zg (priority 0) in 0:00:08
+2018-06-22 10:00:09,100 UTC [1236] INFO    Starting task zmnam/main in process [1236]
+2018-06-22 10:00:20,000 UTC [1236] INFO    Successfully completed task zmnam/main (priority 1) in 0:00:11
+"""
+
+
+def test_parse_line():
+    lines = LOG.splitlines()
+    assert progress.parse_line(lines[0]) is None
+    assert progress.parse_line(lines[1]) == ('tasks', '2')
+    assert progress.parse_line(lines[2]) == ('start', 'zmnam/zg')
+    assert progress.parse_line(lines[3]) == ('done', 'zmnam/zg')
+
+
+def test_log_progress(tmpdir, monkeypatch):
+    monkeypatch.setattr(progress, 'POLL_INTERVAL', 0.01)
+    response = DummyResponse()
+    log_progress = progress.LogProgress(str(tmpdir), response, interval=0)
+    log_progress.start()
+    tmpdir.mkdir('recipe_20180622_100000').mkdir('run').join('main_log.txt').write(LOG)
+    for _ in range(500):
+        if len(response.status) == 5:
+            break
+        time.sleep(0.01)
+    log_progress.stop()
+    assert response.status[-1] == ("running diagnostic: completed task zmnam/main (2/2 done) ...", 80)
+    assert [percentage for _, percentage in response.status] == [20, 20, 50, 50, 80]
+
+
+def test_log_progress_flush(tmpdir, monkeypatch):
+    monkeypatch.setattr(progress, 'POLL_INTERVAL', 0.01)
+    response = DummyResponse()
+    log_progress = progress.LogProgress(str(tmpdir), response, interval=3600)
+    log_progress.start()
+    tmpdir.mkdir('recipe_20180622_100000').mkdir('run').join('main_log.txt').write(LOG)
+    log_progress.stop()
+    # the first event is sent, the last one when stopped
+    assert response.status == [("running diagnostic: 2 tasks ...", 20),
+                               ("running diagnostic: completed task zmnam/main (2/2 done) ...", 80)]
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from copernicus import ncdata
+from copernicus import rainfarm
+
+from . test_ncdata import write_pr, netCDF4
+
+
+def test_fit_slope():
+    rng = np.random.default_rng(1)
+    fields = rainfarm.gaussian_fields(rng, rainfarm.spectral_filter(64, 2.5), 50)
+    assert rainfarm.fit_slope(fields) == pytest.approx(2.5, abs=0.2)
+    # the wavenumbers of a 2x2 field give no slope
+    assert rainfarm.fit_slope(fields[:, :2, :2]) == rainfarm.DEFAULT_SLOPE
+
+
+def test_downscale_conserves_cells():
+    rng = np.random.default_rng(2)
+    coarse = rng.gamma(0.5, size=(3, 4, 4))
+    coarse[1] = 0
+    fine = rainfarm.downscale(coarse, 8, rainfarm.spectral_filter(32, 1.7), rng)
+    assert fine.shape == (3, 32, 32)
+    assert np.allclose(fine.reshape(3, 4, 8, 4, 8).mean(axis=(2, 4)), coarse)
+    assert (fine >= 0).all()
+    # small scale variability within the cells
+    assert fine[0, :8, :8].std() > 0
+
+
+def test_square():
+    data = np.arange(2 * 3 * 5, dtype=float).reshape(2, 3, 5)
+    lat, lon = np.array([0., 1, 2]), np.arange(5.)
+    cropped, lat1, lon1 = rainfarm.square(data, lat, lon)
+    assert cropped.shape == (2, 3, 3) and lon1.tolist() == [1, 2, 3]
+    regridded, lat2, lon2 = rainfarm.square(data, lat, lon, regrid=True)
+    assert regridded.shape == (2, 5, 5) and lat2.tolist() == [0, 0.5, 1, 1.5, 2]
+    assert regridded[0, 1, 0] == (data[0, 0, 0] + data[0, 1, 0]) / 2
+    assert rainfarm.fine_coordinates(np.array([10., 12]), 2).tolist() == [9.5, 10.5, 11.5, 12.5]
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_ensemble(tmpdir, workers):
+    rng = np.random.default_rng(3)
+    path = str(tmpdir.join('pr.nc'))
+    write_pr(path, days=7, lat=[40, 42, 44, 46], lon=[0, 2, 4, 6, 8], values=rng.gamma(0.5, size=(7, 4, 5)))
+    field = ncdata.Field([path], 'pr', 2000, 2000, fill_value=0)
+    done = []
+    paths, slope = rainfarm.ensemble(field, str(tmpdir), 3, 4, slope=1.7, workers=workers, seed=42,
+                                     progress=done.append)
+    assert slope == 1.7
+    assert done == [1, 2, 3]
+    members = []
+    for path in paths:
+        with netCDF4.Dataset(path) as ds:
+            assert ds.variables['pr'].shape == (7, 16, 16)
+            assert ds.variables['pr'].units == 'kg m-2 s-1'
+            assert ds.variables['lat'][:].tolist() == [39.25 + 0.5 * i for i in range(16)]
+            members.append(ds.variables['pr'][:])
+    assert not np.allclose(members[0], members[1])
+    # the same seed gives the same ensemble
+    again, _ = rainfarm.ensemble(field, str(tmpdir.mkdir('again')), 1, 4, slope=1.7, workers=1, seed=42)
+    with netCDF4.Dataset(again[0]) as ds:
+        assert np.allclose(ds.variables['pr'][:], members[0])
+
+
+def test_ensemble_size(tmpdir, monkeypatch):
+    monkeypatch.setattr(rainfarm, 'MAX_FINE_SIZE', 12)
+    path = str(tmpdir.join('pr.nc'))
+    write_pr(path, days=2, lat=[40, 42, 44, 46], lon=[0, 2, 4, 6, 8], values=np.ones((2, 4, 5)))
+    field = ncdata.Field([path], 'pr', 2000, 2000, fill_value=0)
+    rainfarm.ensemble(field, str(tmpdir), 1, 3, slope=1.7, workers=1)
+    # regridding to 5x5 cells makes the fine grid too large
+    with pytest.raises(Exception) as excinfo:
+        rainfarm.ensemble(field, str(tmpdir), 1, 3, slope=1.7, regrid=True, workers=1)
+    assert 'fine grid of 15x15 cells is larger than 12x12' in str(excinfo.value)
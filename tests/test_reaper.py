@@ -0,0 +1,105 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from pywps import configuration
+
+from copernicus import reaper
+
+MB = 1024 ** 2
+
+
+@pytest.fixture
+def config(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.set('server', 'outputpath', str(tmpdir.join('outputs')))
+    configuration.CONFIG.set('server', 'workdir', str(tmpdir.join('workdir')))
+    configuration.CONFIG.add_section('copernicus')
+    configuration.CONFIG.set('copernicus', 'state_dir', str(tmpdir.join('state')))
+    yield configuration
+    configuration.load_configuration()
+
+
+def make_job(tmpdir, size, age, status=None):
+    job = str(uuid.uuid4())
+    outputs = tmpdir.join('outputs', job)
+    outputs.join('result.zip').write('x' * size, ensure=True)
+    mtime = time.time() - age * 86400
+    os.utime(str(outputs), (mtime, mtime))
+    if status is not None:
+        status_file = tmpdir.join('outputs', '{0}.xml'.format(job))
+        status_file.write(status)
+        os.utime(str(status_file), (mtime, mtime))
+    return job
+
+
+def get_reaper(tmpdir, outputs_max_size=0, outputs_max_age=0):
+    return reaper.Reaper(str(tmpdir.join('outputs')), str(tmpdir.join('workdir')), {
+        'outputs': (outputs_max_size, outputs_max_age * 86400),
+        'workdir': (0, 86400),
+    }, database=str(tmpdir.join('reaper.sqlite')))
+
+
+def test_reaper_quotas(config, tmpdir, monkeypatch):
+    old = make_job(tmpdir, 100, 10, status='done')
+    running = make_job(tmpdir, 100, 20)
+    newer = make_job(tmpdir, 100, 5)
+    recent = make_job(tmpdir, 100, 3)
+    # an attached job referencing the outputs of its leader
+    follower = str(uuid.uuid4())
+    tmpdir.join('outputs', '{0}.xml'.format(follower)).write(
+        'http://localhost/outputs/{0}/result.zip'.format(recent))
+    monkeypatch.setattr(reaper, 'active_jobs', lambda: set([running]))
+    # over the size quota, the least recently used goes first
+    removed = get_reaper(tmpdir, outputs_max_size=350).run(dry_run=True)
+    assert [os.path.basename(path) for path, _ in removed] == [old]
+    assert tmpdir.join('outputs', old).check()
+    removed = get_reaper(tmpdir, outputs_max_size=150).run()
+    assert [os.path.basename(path) for path, _ in removed] == [old, newer]
+    assert not tmpdir.join('outputs', old).check()
+    assert not tmpdir.join('outputs', '{0}.xml'.format(old)).check()
+    assert tmpdir.join('outputs', running).check()
+    assert tmpdir.join('outputs', recent).check()
+
+
+def test_reaper_age_and_downloads(config, tmpdir, monkeypatch):
+    downloaded = make_job(tmpdir, 10, 10)
+    unused = make_job(tmpdir, 10, 10)
+    monkeypatch.setattr(reaper, 'active_jobs', set)
+    monkeypatch.setattr(reaper, 'reaper_database', lambda: str(tmpdir.join('reaper.sqlite')))
+    reaper.mark_used(str(tmpdir.join('outputs', downloaded, 'result.zip')))
+    reaper.mark_used(str(tmpdir.join('outputs', 'index.html')))
+    removed = get_reaper(tmpdir, outputs_max_age=7).run()
+    assert [os.path.basename(path) for path, _ in removed] == [unused]
+
+
+def test_reaper_workdir(config, tmpdir, monkeypatch):
+    running = str(uuid.uuid4())
+    for name, job, age in [('pywps_process_a', running, 5), ('pywps_process_b', str(uuid.uuid4()), 5),
+                           ('pywps_process_c', None, 0), ('other', None, 5)]:
+        workdir = tmpdir.join('workdir', name)
+        workdir.ensure(dir=True)
+        if job:
+            workdir.join(reaper.JOB_MARKER).write(job)
+        mtime = time.time() - age * 86400
+        os.utime(str(workdir), (mtime, mtime))
+    tmpdir.join('outputs').ensure(dir=True)
+    monkeypatch.setattr(reaper, 'active_jobs', lambda: set([running]))
+    removed = get_reaper(tmpdir).run()
+    assert [os.path.basename(path) for path, _ in removed] == ['pywps_process_b']
+    assert tmpdir.join('workdir', 'other').check()
+
+
+def test_reaper_incremental_scan(config, tmpdir, monkeypatch):
+    job = make_job(tmpdir, 100, 1)
+    monkeypatch.setattr(reaper, 'active_jobs', set)
+    get_reaper(tmpdir).run()
+    sizes = []
+    monkeypatch.setattr(reaper.cache, 'tree_size', lambda path: sizes.append(path) or 0)
+    get_reaper(tmpdir).run()
+    assert sizes == []
+    os.utime(str(tmpdir.join('outputs', job)), None)
+    get_reaper(tmpdir).run()
+    assert sizes == [str(tmpdir.join('outputs', job))]
@@ -0,0 +1,35 @@
+from copernicus import registry as registry_module
+from copernicus.registry import ProcessRegistry
+from copernicus.processes import registry
+
+
+def test_descriptors_match_processes(tmpdir):
+    lazy = ProcessRegistry([(descriptor.identifier, descriptor.path) for descriptor in registry.descriptors()])
+    lazy.load_descriptors(str(tmpdir.join('processes.json')))
+    # a new registry reads the persisted descriptors without constructing processes
+    persisted = ProcessRegistry([(descriptor.identifier, descriptor.path) for descriptor in registry.descriptors()])
+    persisted.load_descriptors(str(tmpdir.join('processes.json')))
+    for descriptor in persisted.descriptors():
+        assert descriptor._process is None
+        process = descriptor.load()
+        assert descriptor.json['title'] == process.title
+        assert descriptor.json['version'] == process.version
+        assert descriptor.json['metadata'] == [metadata.json for metadata in process.metadata]
+
+
+def test_getitem_loads_process():
+    lazy = ProcessRegistry([('sleep', 'copernicus.processes.wps_sleep:Sleep')])
+    assert lazy['sleep'].inputs[0].identifier == 'delay'
+    assert lazy.descriptors()[0].inputs[0].identifier == 'delay'
+
+
+def test_fingerprint_shared_modules(tmpdir, monkeypatch):
+    tmpdir.join('shared_links.py').write('URL = "a"\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setattr(registry_module, 'SHARED_MODULES', registry_module.SHARED_MODULES + ['shared_links'])
+    lazy = ProcessRegistry([('sleep', 'copernicus.processes.wps_sleep:Sleep')])
+    fingerprint = lazy.fingerprint()
+    assert lazy.fingerprint() == fingerprint
+    # a new version or metadata link gives new descriptors
+    tmpdir.join('shared_links.py').write('URL = "ab"\n')
+    assert lazy.fingerprint() != fingerprint
@@ -0,0 +1,37 @@
+import pytest
+
+from copernicus import runner
+
+
+CONSTRAINTS = dict(model='MPI-ESM-MR', experiment='amip', cmor_table='day', ensemble='r1i1p1')
+
+
+def test_generate_recipe(tmpdir):
+    recipe_file, config_file = runner.generate_recipe(
+        diag='zmnam', constraints=CONSTRAINTS, workdir=str(tmpdir), output_format='png')
+    with open(config_file) as fp:
+        config = fp.read()
+    assert 'output_dir: {0}\n'.format(tmpdir.join('output')) in config
+    assert 'output_file_type: png\n' in config
+    assert 'recipe_zmnam.yml' in runner._validated_recipes
+    assert runner.render_config('png') is runner.render_config('png')
+
+
+def test_validate_recipe():
+    runner.validate_recipe('ok', 'datasets: []\ndiagnostics: {}\n')
+    with pytest.raises(Exception) as err:
+        runner.validate_recipe('broken', 'datasets:\n  - {dataset: ACCESS1-0}\ndiagnostics: {}\n')
+    assert 'dataset without end_year, project, start_year' in str(err.value)
+
+
+def test_max_parallel_tasks(monkeypatch):
+    config = {('esmvaltool', 'max_parallel_tasks'): 'auto', ('server', 'parallelprocesses'): '2'}
+    monkeypatch.setattr(runner.configuration, 'get_config_value',
+                        lambda section, option, default='': config.get((section, option), default))
+    monkeypatch.setattr(runner.psutil, 'cpu_count', lambda: 32)
+    monkeypatch.setattr(runner.dblog, 'get_process_counts', lambda: (1, 0))
+    assert runner.max_parallel_tasks() == 16
+    monkeypatch.setattr(runner.dblog, 'get_process_counts', lambda: (5, 3))
+    assert runner.max_parallel_tasks() == 6
+    config[('esmvaltool', 'max_parallel_tasks')] = '3'
+    assert runner.max_parallel_tasks() == 3
@@ -0,0 +1,120 @@
+import time
+import datetime
+import multiprocessing
+
+import pytest
+
+from pywps import configuration, dblog
+from pywps.response.status import WPS_STATUS
+from pywps.tests import WpsClient, WpsTestResponse
+
+from copernicus import scheduler
+from copernicus.service import CachingService
+from copernicus.processes import registry
+
+from .common import wait_for_jobs
+
+
+def test_order():
+    queued = [('a', 'ensclus', 1), ('b', 'ensclus', 2), ('c', 'ensclus', 3), ('d', 'sleep', 4), ('e', 'cvdp', 5)]
+    # fair share between the processes
+    assert [job[0] for job in scheduler.order(queued, {})] == ['a', 'd', 'e', 'b', 'c']
+    assert [job[0] for job in scheduler.order(queued, {'sleep': 2})] == ['a', 'e', 'b', 'c', 'd']
+    # priority classes come first
+    priorities = {'ensclus': scheduler.PRIORITIES['low'], 'cvdp': scheduler.PRIORITIES['high']}
+    assert [job[0] for job in scheduler.order(queued, {}, priorities)] == ['e', 'd', 'a', 'b', 'c']
+
+
+def test_check_pywps():
+    assert scheduler.check_pywps() == []
+    changed = [(scheduler.Process, '_run_process', ['self', 'wps_request']),
+               (scheduler.Process, '_missing', ['self'])]
+    assert scheduler.check_pywps(changed) == ['Process._run_process', 'Process._missing']
+
+
+@pytest.fixture
+def config(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.set('server', 'parallelprocesses', '1')
+    configuration.CONFIG.set('server', 'outputpath', str(tmpdir))
+    configuration.CONFIG.set('server', 'workdir', str(tmpdir))
+    configuration.CONFIG.set('logging', 'database', 'sqlite:///{0}'.format(tmpdir.join('db.sqlite')))
+    configuration.CONFIG.add_section('copernicus')
+    configuration.CONFIG.set('copernicus', 'state_dir', str(tmpdir))
+    configuration.CONFIG.add_section('scheduler')
+    configuration.CONFIG.set('scheduler', 'high_priority', 'shape_select')
+    yield configuration
+    configuration.load_configuration()
+
+
+@pytest.mark.slow
+def test_queue_position(config, tmpdir):
+    service = CachingService(processes=[])
+    service.processes = registry
+    client = WpsClient(service, WpsTestResponse)
+    messages = []
+    for delay in [0.05, 0.06, 0.07]:
+        resp = client.get('?service=WPS&request=Execute&version=1.0.0&identifier=sleep'
+                          '&storeExecuteResponse=true&status=true&DataInputs=delay={0}'.format(delay))
+        messages.append(resp.xpath_text('/wps:ExecuteResponse/wps:Status/wps:ProcessAccepted'))
+    assert messages == [
+        'PyWPS Request accepted',
+        'PyWPS Process stored in job queue, position 1 of 1',
+        'PyWPS Process stored in job queue, position 2 of 2']
+    # the queued jobs are started when the running ones finish
+    status_files = wait_for_jobs(tmpdir, 3)
+    assert len(status_files) == 3
+    assert all('ProcessSucceeded' in status_file.read() for status_file in status_files)
+    # the jobs run in the working directories of the accepted requests, which are removed
+    for _ in range(100):
+        workdirs = tmpdir.listdir(lambda path: path.basename.startswith('pywps_process_'))
+        if not workdirs:
+            break
+        time.sleep(0.05)
+    assert workdirs == []
+
+
+def queue_jobs(count):
+    session = dblog.get_session()
+    try:
+        for number in range(count):
+            uuid = 'job{0}'.format(number)
+            session.add(dblog.ProcessInstance(
+                uuid=uuid, pid=0, operation='execute', version='1.0.0', time_start=datetime.datetime.now(),
+                identifier='sleep', message='', percent_done=0, status=WPS_STATUS.ACCEPTED))
+            session.add(dblog.RequestInstance(uuid=uuid, request=b'{}'))
+        session.commit()
+    finally:
+        session.close()
+
+
+def claim_jobs(barrier, results):
+    barrier.wait()
+    claimed = []
+    while True:
+        uuid, _, _ = scheduler.claim_next()
+        if uuid is None:
+            break
+        claimed.append(uuid)
+    results.put(claimed)
+
+
+def test_claim_in_two_processes(config):
+    configuration.CONFIG.set('server', 'parallelprocesses', '-1')
+    configuration.CONFIG.set('scheduler', 'max_running', 'sleep:3')
+    queue_jobs(10)
+    context = multiprocessing.get_context('fork')
+    barrier = context.Barrier(2)
+    results = context.Queue()
+    workers = [context.Process(target=claim_jobs, args=(barrier, results)) for _ in range(2)]
+    for worker in workers:
+        worker.start()
+    claimed = results.get(timeout=30) + results.get(timeout=30)
+    for worker in workers:
+        worker.join()
+    # the claimed jobs count as running, the cap holds for both servers
+    assert len(claimed) == 3
+    assert len(set(claimed)) == 3
+    queue, running = scheduler.get_queue()
+    assert running == {'sleep': 3}
+    assert len(queue) == 7
@@ -0,0 +1,71 @@
+import gzip
+
+from werkzeug.test import Client
+
+from copernicus import catalogue
+from copernicus.service import CachingService
+from copernicus.processes import registry
+
+CAPS = '/wps?service=wps&request=getcapabilities&version=1.0.0'
+DESCRIBE = '/wps?service=wps&request=describeprocess&version=1.0.0&identifier={0}'
+
+
+def caching_service():
+    service = CachingService(processes=[])
+    service.processes = registry
+    return service
+
+
+def test_cached_capabilities():
+    service = caching_service()
+    client = Client(service)
+    resp = client.get(CAPS)
+    assert resp.status_code == 200
+    assert b'zonal_mean_nam' in resp.data
+    etag = resp.headers['ETag']
+    assert len(service._documents) == 1
+    assert client.get(CAPS).data == resp.data
+    assert client.get(CAPS, headers={'If-None-Match': etag}).status_code == 304
+    resp_gzip = client.get(CAPS, headers={'Accept-Encoding': 'gzip, deflate'})
+    assert resp_gzip.headers['Content-Encoding'] == 'gzip'
+    assert resp_gzip.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(resp_gzip.data) == resp.data
+    assert len(service._documents) == 1
+    # each encoding has its own ETag
+    gzip_etag = resp_gzip.headers['ETag']
+    assert gzip_etag != etag
+    assert client.get(CAPS, headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'}).status_code == 200
+    assert client.get(CAPS, headers={'If-None-Match': gzip_etag, 'Accept-Encoding': 'gzip'}).status_code == 304
+    resp = client.get(CAPS, headers={'Accept-Encoding': 'gzip;q=0, deflate'})
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.headers['ETag'] == etag
+
+
+def test_describe_and_invalidate():
+    service = caching_service()
+    client = Client(service)
+    resp = client.get('/wps?service=wps&request=describeprocess&version=1.0.0&identifier=sleep')
+    assert b'delay' in resp.data
+    # errors are not cached
+    resp = client.get('/wps?service=wps&request=describeprocess&version=1.0.0&identifier=unknown')
+    assert resp.status_code == 400
+    assert len(service._documents) == 1
+    service.processes = registry
+    assert len(service._documents) == 0
+
+
+def test_catalogue_change(monkeypatch):
+    generation = [1]
+    monkeypatch.setattr(catalogue, 'generation', lambda: generation[0])
+    service = caching_service()
+    client = Client(service)
+    client.get(DESCRIBE.format('sleep'))
+    process = registry['sleep']
+    client.get(CAPS)
+    assert len(service._documents) == 2
+    assert registry['sleep'] is process
+    # the allowed values of the processes come from the catalogue
+    generation[0] = 2
+    client.get(CAPS)
+    assert len(service._documents) == 1
+    assert registry['sleep'] is not process
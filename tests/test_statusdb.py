@@ -0,0 +1,58 @@
+import uuid
+
+import pytest
+
+from pywps import configuration, dblog
+from pywps.response.status import WPS_STATUS
+
+from copernicus import statusdb
+
+
+class Request(object):
+    operation = 'execute'
+    version = '1.0.0'
+    identifier = 'sleep'
+
+
+@pytest.fixture
+def database(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.set('logging', 'database', 'sqlite:///{0}'.format(tmpdir.join('db.sqlite')))
+    statusdb.setup()
+    yield configuration
+    configuration.load_configuration()
+
+
+def get_job(job):
+    session = dblog.get_session()
+    try:
+        row = session.query(dblog.ProcessInstance).filter_by(uuid=job).one()
+        return row.status, row.message, row.percent_done
+    finally:
+        session.close()
+
+
+def test_setup(database):
+    engine = statusdb.setup()
+    assert dblog.get_session().bind is engine
+    assert statusdb.setup() is engine
+
+
+def test_status_writer(database):
+    job = str(uuid.uuid4())
+    dblog.log_request(job, Request())
+    writer = statusdb.StatusWriter(interval=60)
+    writer.store_status(job, WPS_STATUS.STARTED, 'started', 0)
+    assert get_job(job) == (WPS_STATUS.STARTED, 'started', 0)
+    # progress updates are delayed
+    writer.store_status(job, WPS_STATUS.STARTED, 'running', 20)
+    writer.store_status(job, WPS_STATUS.STARTED, 'running', 40)
+    assert get_job(job) == (WPS_STATUS.STARTED, 'started', 0)
+    writer.flush()
+    assert get_job(job) == (WPS_STATUS.STARTED, 'running', 40)
+    # final states are written immediately
+    writer.store_status(job, WPS_STATUS.STARTED, 'running', 60)
+    writer.store_status(job, WPS_STATUS.SUCCEEDED, 'done', 100)
+    assert get_job(job) == (WPS_STATUS.SUCCEEDED, 'done', 100)
+    writer.flush()
+    assert get_job(job) == (WPS_STATUS.SUCCEEDED, 'done', 100)
@@ -0,0 +1,30 @@
+import pytest
+
+from copernicus import workerpool
+
+
+@pytest.fixture
+def pool():
+    pool = workerpool.WorkerPool(workers=1, max_jobs=1, preload_modules=['json'])
+    pool.start()
+    yield pool
+    pool.stop()
+
+
+def test_call(pool):
+    assert pool.call('os.path.join', 'a', 'b') == 'a/b'
+
+
+def test_recycle_worker(pool):
+    # every worker is replaced after one job
+    assert pool.call('os.getpid') != pool.call('os.getpid')
+
+
+def test_error(pool):
+    with pytest.raises(Exception) as err:
+        pool.call('os.path.getsize', '/does/not/exist')
+    assert 'No such file' in str(err.value)
+
+
+def test_call_without_pool():
+    assert workerpool.call('os.path.join', 'a', 'b') == 'a/b'
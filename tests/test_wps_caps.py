@@ -2,20 +2,39 @@ from pywps import Service
 from pywps.tests import assert_response_success
 
 from .common import client_for
-from copernicus.processes import processes
+from copernicus.processes import registry
+
+
+def lazy_service():
+    service = Service(processes=[])
+    service.processes = registry
+    return service
 
 
 def test_wps_caps():
-    client = client_for(Service(processes=processes))
+    client = client_for(lazy_service())
     resp = client.get(service='wps', request='getcapabilities', version='1.0.0')
     names = resp.xpath_text('/wps:Capabilities'
                             '/wps:ProcessOfferings'
                             '/wps:Process'
                             '/ows:Identifier')
     assert sorted(names.split()) == [
-        'mydiag',
-        'perfmetrics',
-        'py_demo',
+        'consecdrydays',
+        'cvdp',
+        'ensclus',
+        'esmvaltool_preprocessor',
         'rainfarm',
         'rmse',
-        'sleep']
+        'shape_select',
+        'sleep',
+        'zonal_mean_nam']
+
+
+def test_wps_describe():
+    client = client_for(lazy_service())
+    resp = client.get(service='wps', request='describeprocess', version='1.0.0', identifier='sleep')
+    assert resp.xpath_text('/wps:ProcessDescriptions'
+                           '/ProcessDescription'
+                           '/DataInputs'
+                           '/Input'
+                           '/ows:Identifier') == 'delay'
@@ -0,0 +1,43 @@
+import re
+
+import numpy as np
+import pytest
+
+from pywps import Service, configuration
+from pywps.tests import assert_response_success
+
+from . common import client_for
+from . test_ncdata import write_pr, netCDF4
+from copernicus.processes.wps_consecdrydays import ConsecDryDays
+
+CMIP5_DIR = 'BCC/bcc-csm1-1-m/historical/day/atmos/day/r1i1p1/latest/pr'
+
+
+@pytest.fixture
+def archive(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.add_section('data')
+    configuration.CONFIG.set('data', 'archive_root', str(tmpdir.join('archive')))
+    configuration.CONFIG.set('data', 'obs_root', str(tmpdir.join('obs')))
+    configuration.CONFIG.add_section('copernicus')
+    configuration.CONFIG.set('copernicus', 'state_dir', str(tmpdir.join('state')))
+    path = tmpdir.join('archive', CMIP5_DIR, 'pr_day_bcc-csm1-1-m_historical_r1i1p1_20010101-20021231.nc')
+    path.dirpath().ensure(dir=True)
+    pr = np.random.default_rng(0).gamma(0.3, 2.0, size=(730, 3, 4)) / 86400.0
+    write_pr(str(path), 730, [10, 20, 30], [0, 10, 20, 30], year=2001, values=pr)
+    yield tmpdir
+    configuration.load_configuration()
+
+
+def test_wps_consecdrydays_native(archive):
+    client = client_for(Service(processes=[ConsecDryDays()]))
+    resp = client.get(
+        service='WPS', request='Execute', version='1.0.0', identifier='consecdrydays',
+        datainputs="mode=native;start_year=2001;end_year=2002")
+    print(resp.data)
+    assert_response_success(resp)
+    drymax = re.search(r'href="file://([^"]+_drymax.nc)"', resp.data.decode('utf-8')).group(1)
+    assert drymax.endswith('CMIP5_bcc-csm1-1-m_day_historical_r1i1p1_pr_2001-2002_drymax.nc')
+    with netCDF4.Dataset(drymax) as ds:
+        assert ds.variables['drymax'].shape == (3, 4)
+        assert (ds.variables['drymax'][:] > 0).all()
@@ -1,17 +1,55 @@
+import re
+import zipfile
+
 import pytest
 
-from pywps import Service
+from pywps import Service, configuration
 from pywps.tests import assert_response_success
 
 from . common import client_for
+from . test_ncdata import write_pr
 from copernicus.processes.wps_rainfarm import RainFarm
 
+CMIP5_DIR = 'CSIRO-BOM/ACCESS1-0/historical/day/atmos/day/r1i1p1/latest/pr'
+
+
+@pytest.fixture
+def archive(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.add_section('data')
+    configuration.CONFIG.set('data', 'archive_root', str(tmpdir.join('archive')))
+    configuration.CONFIG.add_section('copernicus')
+    configuration.CONFIG.set('copernicus', 'state_dir', str(tmpdir.join('state')))
+    path = tmpdir.join('archive', CMIP5_DIR, 'pr_day_ACCESS1-0_historical_r1i1p1_19970101-19971231.nc')
+    path.dirpath().ensure(dir=True)
+    write_pr(str(path), days=10, lat=range(40, 58, 2), lon=range(0, 20, 2), year=1997)
+    yield tmpdir
+    configuration.load_configuration()
+
 
-def test_wps_rainfarm():
+def test_wps_rainfarm(archive):
     client = client_for(Service(processes=[RainFarm()]))
-    datainputs = "regridding=false;slope=false"
+    datainputs = "regridding=false;slope=false;num_subdivs=4"
     resp = client.get(
         service='WPS', request='Execute', version='1.0.0', identifier='rainfarm',
         datainputs=datainputs)
     print(resp.data)
     assert_response_success(resp)
+    zip_file = re.search(r'href="file://([^"]+rainfarm_ensemble.zip)"', resp.data.decode('utf-8')).group(1)
+    assert zipfile.ZipFile(zip_file).namelist() == ['rainfarm_member001.nc', 'rainfarm_member002.nc']
+
+
+def test_wps_rainfarm_missing_data(archive):
+    client = client_for(Service(processes=[RainFarm()]))
+    resp = client.get(
+        service='WPS', request='Execute', version='1.0.0', identifier='rainfarm',
+        datainputs="regridding=false;slope=false;start_year=2001;end_year=2001")
+    assert b'No pr data for 2001-2001' in resp.data
+
+
+def test_wps_rainfarm_limits(archive):
+    client = client_for(Service(processes=[RainFarm()]))
+    resp = client.get(
+        service='WPS', request='Execute', version='1.0.0', identifier='rainfarm',
+        datainputs="regridding=false;slope=false;num_subdivs=1000")
+    assert b'The number of subdivisions must be between 1 and 64.' in resp.data
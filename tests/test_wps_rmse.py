@@ -1,17 +1,75 @@
+import re
+import sqlite3
+
 import pytest
 
-from pywps import Service
+from pywps import Service, configuration
 from pywps.tests import assert_response_success
 
 from . common import client_for
+from . test_modes import regimes, LAT, LON
+from . test_ncdata import write_pr, netCDF4
 from copernicus.processes.wps_rmse import RMSE
 
+CMIP5_DIR = 'NASA-GISS/NASA/historical/mon/seaIce/OImon/r1i1p1/latest/sic'
+
+
+@pytest.fixture
+def archive(tmpdir):
+    configuration.load_configuration()
+    configuration.CONFIG.add_section('data')
+    configuration.CONFIG.set('data', 'archive_root', str(tmpdir.join('archive')))
+    configuration.CONFIG.set('data', 'obs_root', str(tmpdir.join('obs')))
+    configuration.CONFIG.add_section('copernicus')
+    configuration.CONFIG.set('copernicus', 'state_dir', str(tmpdir.join('state')))
+    for seed, path in [(1, tmpdir.join('archive', CMIP5_DIR, 'sic_OImon_NASA_historical_r1i1p1_199001-200912.nc')),
+                       (2, tmpdir.join('obs', 'Tier2', 'HadISST', 'OBS_HadISST_reanaly_1_OImon_sic_199001-200912.nc'))]:
+        path.dirpath().ensure(dir=True)
+        values, _ = regimes(seed)
+        write_pr(str(path), len(values), LAT, LON, year=1990, values=values, short_name='sic', monthly=True)
+    yield tmpdir
+    configuration.load_configuration()
 
-def test_wps_rmse():
+
+def test_wps_rmse(archive):
     client = client_for(Service(processes=[RMSE()]))
-    datainputs = "eofs=false;experiment=historical"
+    datainputs = "eofs=false;experiment=historical;ncenters=3"
     resp = client.get(
         service='WPS', request='Execute', version='1.0.0', identifier='rmse',
         datainputs=datainputs)
     print(resp.data)
     assert_response_success(resp)
+    table = re.search(r'href="file://([^"]+modes_of_variability.csv)"', resp.data.decode('utf-8')).group(1)
+    assert len(open(table).readlines()) == 4
+    output = re.search(r'href="file://([^"]+modes_of_variability.nc)"', resp.data.decode('utf-8')).group(1)
+    with netCDF4.Dataset(output) as ds:
+        seed = ds.seed
+    # the seed comes from the inputs, identical requests give the same clusters
+    resp = client.get(
+        service='WPS', request='Execute', version='1.0.0', identifier='rmse',
+        datainputs=datainputs)
+    again = re.search(r'href="file://([^"]+modes_of_variability.csv)"', resp.data.decode('utf-8')).group(1)
+    assert again != table
+    assert open(again).read() == open(table).read()
+    output = re.search(r'href="file://([^"]+modes_of_variability.nc)"', resp.data.decode('utf-8')).group(1)
+    with netCDF4.Dataset(output) as ds:
+        assert ds.seed == seed
+
+
+def test_wps_rmse_missing_data(archive):
+    client = client_for(Service(processes=[RMSE()]))
+    resp = client.get(
+        service='WPS', request='Execute', version='1.0.0', identifier='rmse',
+        datainputs="variable=psl")
+    assert b'no files for CMIP5 NASA historical r1i1p1 day psl' in resp.data
+    # the stages of failed jobs are recorded too
+    conn = sqlite3.connect(str(archive.join('state', 'stats.sqlite')))
+    assert conn.execute("SELECT stage FROM stages WHERE process='rmse'").fetchall() == [('read_data',)]
+
+
+def test_wps_rmse_cluster_method(archive):
+    client = client_for(Service(processes=[RMSE()]))
+    resp = client.get(
+        service='WPS', request='Execute', version='1.0.0', identifier='rmse',
+        datainputs="cluster_method=hclust")
+    assert b'InvalidParameterValue' in resp.data
@@ -0,0 +1,27 @@
+import pytest
+
+from pywps import configuration
+
+from copernicus import wsgi
+
+
+@pytest.fixture
+def cfgfile(tmpdir):
+    cfgfile = tmpdir.join('test.cfg')
+    cfgfile.write('\n'.join([
+        '[server]', 'outputpath = {0}'.format(tmpdir), 'workdir = {0}'.format(tmpdir),
+        '[logging]', 'database = sqlite:///{0}'.format(tmpdir.join('db.sqlite')),
+        '[copernicus]', 'state_dir = {0}'.format(tmpdir),
+        '[esmvaltool]', 'workers = 0', '']))
+    yield str(cfgfile)
+    configuration.load_configuration()
+
+
+@pytest.mark.parametrize('background_tasks', [True, False])
+def test_background_tasks(cfgfile, monkeypatch, background_tasks):
+    started = []
+    monkeypatch.setattr(wsgi.reaper, 'start_reaper', lambda: started.append('reaper'))
+    monkeypatch.setattr(wsgi.catalogue, 'start_refresh', lambda: started.append('catalogue'))
+    wsgi.create_app([cfgfile], background_tasks=background_tasks)
+    # the gunicorn master runs them for its workers
+    assert started == (['reaper', 'catalogue'] if background_tasks else [])